@@ -0,0 +1,143 @@
+"""
+Benchmark for ``disk_writer``: event-loop stalls and write throughput while
+many byte ranges are written at once.
+
+``--streams`` producers each push ``--mb`` MB in ``--chunk-kb`` KB pieces
+(what ``iter_chunked`` typically yields off a socket) into one spool file
+per ``--segments`` ranges, first the way the downloader used to (a
+synchronous ``f.write`` per chunk on the loop) and then through
+``FileWriter`` segments. A ticker measures how late the loop wakes it up;
+with enough data to push the page cache into writeback, the inline writes
+show up as loop stalls every other transfer has to sit through.
+``--sync-mb`` forces that writeback (``fdatasync`` after every N MB a range
+writes) on disks fast enough to absorb the whole run in cache.
+
+    python -m benchmarks.disk_writes --streams 32 --mb 256 --dir /var/tmp
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import disk_writer
+
+TICK = 0.01
+
+
+async def ticker(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started - TICK)
+
+
+async def inline_stream(path: str, offset: int, size: int, chunk: bytes, sync_every: int):
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        for i in range(1, size // len(chunk) + 1):
+            f.write(chunk)
+            if sync_every and i * len(chunk) % sync_every == 0:
+                f.flush()
+                os.fdatasync(f.fileno())
+            await asyncio.sleep(0)
+
+
+def synced_pwrite(sync_every: int):
+    """disk_writer._pwrite followed by fdatasync once every ``sync_every`` bytes, as inline_stream does."""
+    pwrite = disk_writer._pwrite
+    written = {}
+
+    def _pwrite(fd, view, offset, submitted):
+        result = pwrite(fd, view, offset, submitted)
+        written[fd] = written.get(fd, 0) + len(view)
+        if written[fd] >= sync_every:
+            written[fd] = 0
+            os.fdatasync(fd)
+        return result
+    return _pwrite
+
+
+async def writer_stream(file: disk_writer.FileWriter, offset: int, size: int, chunk: bytes):
+    segment = file.segment(offset)
+    try:
+        for _ in range(size // len(chunk)):
+            await segment.write(chunk)
+            await asyncio.sleep(0)
+    finally:
+        await segment.close()
+
+
+async def run(mode: str, args, directory: str) -> dict:
+    size = args.mb * 1024 * 1024
+    chunk = os.urandom(args.chunk_kb * 1024)
+    files = [os.path.join(directory, f"{mode}-{i}") for i in range(args.streams // args.segments)]
+    per_segment = size // args.segments
+    lags, stop = [], asyncio.Event()
+    tick = asyncio.create_task(ticker(lags, stop))
+    started = time.perf_counter()
+    handles = []
+    try:
+        tasks = []
+        for path in files:
+            if mode == "inline":
+                with open(path, "wb") as f:
+                    f.truncate(size)
+                tasks += [inline_stream(path, i * per_segment, per_segment, chunk, args.sync_mb * 1024 * 1024)
+                          for i in range(args.segments)]
+            else:
+                file = disk_writer.FileWriter(path)
+                handles.append(file)
+                await file.preallocate(size)
+                tasks += [writer_stream(file, i * per_segment, per_segment, chunk) for i in range(args.segments)]
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    finally:
+        stop.set()
+        await tick
+        for file in handles:
+            file.close()
+        for path in files:
+            os.unlink(path)
+    lags.sort()
+    return {
+        "seconds": elapsed,
+        "mb_s": len(files) * size / elapsed / (1024 * 1024),
+        "lag_p50": statistics.median(lags) if lags else 0,
+        "lag_p99": lags[int(len(lags) * 0.99)] if lags else 0,
+        "lag_max": lags[-1] if lags else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Disk writer benchmark")
+    parser.add_argument("--streams", type=int, default=32, help="byte ranges written at once")
+    parser.add_argument("--segments", type=int, default=8, help="ranges per file")
+    parser.add_argument("--mb", type=int, default=128, help="size of each file")
+    parser.add_argument("--chunk-kb", type=int, default=64)
+    parser.add_argument("--sync-mb", type=int, default=0, help="fdatasync after every N MB per range (0 = never)")
+    parser.add_argument("--dir", default=tempfile.gettempdir())
+    args = parser.parse_args()
+    if args.sync_mb:
+        # Per file rather than per range: the writer shares one fd between a file's ranges
+        disk_writer._pwrite = synced_pwrite(args.sync_mb * 1024 * 1024 * args.segments)
+
+    directory = tempfile.mkdtemp(prefix="diskbench-", dir=args.dir)
+    try:
+        total = args.streams // args.segments * args.mb
+        print(f"{args.streams} ranges in {args.streams // args.segments} file(s), {total} MB in {args.chunk_kb} KB chunks")
+        for mode in ("inline", "writer"):
+            r = asyncio.run(run(mode, args, directory))
+            print(f"  {mode:<7} {r['seconds']:.2f}s ({r['mb_s']:.0f} MB/s), loop lag "
+                  f"p50 {r['lag_p50'] * 1000:.1f} ms, p99 {r['lag_p99'] * 1000:.1f} ms, max {r['lag_max'] * 1000:.1f} ms")
+        s = disk_writer.stats
+        print(f"  writer: {s['writes']} pwrite(s) of {s['bytes'] / max(s['writes'], 1) / (1024 * 1024):.1f} MB, "
+              f"queue lag {s['lag_seconds'] / max(s['writes'], 1) * 1000:.1f} ms avg / {s['max_lag'] * 1000:.1f} ms max")
+    finally:
+        disk_writer.shutdown()
+        os.rmdir(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""
+Offline end-to-end benchmark for bot1.py (aiogram) and bot.py (PTB).
+
+Starts the stand-in resolver, CDN and Bot API from ``benchmarks.standins``
+in a child process, swaps MongoDB for ``benchmarks.memory_mongo`` and pushes
+``--files`` share links through the bot at ``--concurrency``:
+
+* bot1: each link is one ``run_url_job`` (resolve → download → upload stages)
+* bot:  each link is one ``download_and_send``
+
+Reports files/min, p50/p99 time-to-delivery, peak RSS of the bot process
+(the stand-ins run elsewhere) and peak spool disk usage.
+
+    python -m benchmarks.e2e --bot bot1 --files 40 --concurrency 10 --file-mb 50 --bandwidth-mbps 400
+
+Stage sizes and other tuning knobs are read from the usual environment
+variables (RESOLVE_WORKERS, DOWNLOAD_SEGMENTS, STREAM_UPLOADS...).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from benchmarks import standins
+
+BENCH_TOKEN = "123456:BENCHbenchBENCHbench"
+SAMPLE_INTERVAL = 0.25
+
+
+def percentile(values, pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def directory_bytes(path: str) -> int:
+    total = 0
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            # Blocks on disk, not st_size: spool files are sized before their data arrives
+            total += entry.stat().st_blocks * 512
+        except OSError:
+            pass
+    return total
+
+
+def current_rss() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+async def sample_peaks(spool_dir: str, peaks: dict):
+    while True:
+        peaks["disk"] = max(peaks["disk"], directory_bytes(spool_dir))
+        try:
+            peaks["rss"] = max(peaks["rss"], current_rss())
+        except OSError:
+            pass
+        await asyncio.sleep(SAMPLE_INTERVAL)
+
+
+async def drive(run_one, files: int, concurrency: int):
+    """Run ``run_one(i)`` for every file with at most ``concurrency`` in flight; returns per-file seconds and errors."""
+    limiter = asyncio.Semaphore(concurrency)
+    durations = []
+    errors = []
+
+    async def one(i: int):
+        async with limiter:
+            started = time.monotonic()
+            try:
+                ok = await run_one(i)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+                return
+            if ok is False:
+                errors.append(f"file {i} not delivered")
+                return
+            durations.append(time.monotonic() - started)
+
+    await asyncio.gather(*(one(i) for i in range(files)))
+    return durations, errors
+
+
+def share_url(i: int) -> str:
+    return f"https://terabox.com/s/1bench{i:05d}"
+
+
+async def bench_bot1(base_url: str, args):
+    import bot1
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from benchmarks.memory_mongo import MemoryDatabase
+
+    db = MemoryDatabase()
+    bot1.db = db
+    bot1.config_col = db["config"]
+    bot1.broadcast_col = bot1.broadcasts.col = db["broadcasted"]
+    bot1.admins_col = db["admins"]
+    bot1.file_cache_col = db["file_cache"]
+    bot1.jobs_col = bot1.jobs.col = db["jobs"]
+    bot1.API_BASE = base_url
+    bot1.bot = Bot(token=BENCH_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+    await bot1.get_config()
+    await bot1.load_admins()
+    bot1.start_pipeline()
+
+    async def run_one(i: int):
+        await bot1.run_url_job({"source_url": share_url(i), "chat_id": 100000 + i, "source_type": "user", "message_id": i + 1})
+        # Failures are reported to the chat, a delivered file leaves its file_id behind
+        return await db["file_cache"].find_one({"share_id": bot1.share_id(share_url(i))}) is not None
+
+    try:
+        return await drive(run_one, args.files, args.concurrency)
+    finally:
+        for stage in bot1.stages:
+            await stage.stop()
+        await bot1.bot.session.close()
+        await bot1.close_session()
+
+
+async def bench_bot(base_url: str, args):
+    import bot
+    from telegram import Bot, Chat, Message, Update
+
+    bot.TERABOX_API = base_url
+    ptb_bot = Bot(BENCH_TOKEN, base_url=f"{base_url}/bot")
+    await ptb_bot.initialize()
+
+    async def run_one(i: int):
+        message = Message(message_id=i + 1, date=datetime.now(timezone.utc), chat=Chat(id=100000 + i, type="private"))
+        message.set_bot(ptb_bot)
+        failed_links = []
+        await bot.download_and_send(Update(update_id=i + 1, message=message), share_url(i), failed_links)
+        return not failed_links
+
+    try:
+        return await drive(run_one, args.files, args.concurrency)
+    finally:
+        await ptb_bot.shutdown()
+        await bot.close_session()
+
+
+async def run(args, base_url: str):
+    import spool
+    runner = bench_bot1 if args.bot == "bot1" else bench_bot
+    peaks = {"disk": 0, "rss": 0}
+    started = time.monotonic()
+    sampler = asyncio.create_task(sample_peaks(os.path.join(os.environ["SPOOL_DIR"], spool.directory_name()), peaks))
+    try:
+        durations, errors = await runner(base_url, args)
+    finally:
+        sampler.cancel()
+    elapsed = time.monotonic() - started
+
+    from http_client import get_session, close_session
+    async with get_session().get(f"{base_url}/stats") as resp:
+        served = await resp.json()
+    await close_session()
+    return {
+        "bot": args.bot,
+        "files": args.files,
+        "concurrency": args.concurrency,
+        "file_mb": args.file_mb,
+        "files_per_share": args.files_per_share,
+        "delivered": len(durations),
+        "failed": len(errors),
+        "elapsed_s": round(elapsed, 2),
+        "files_per_min": round(len(durations) / elapsed * 60, 2) if elapsed else 0,
+        "mb_per_s": round(len(durations) * args.file_mb / elapsed, 2) if elapsed else 0,
+        "p50_s": round(percentile(durations, 50), 2),
+        "p99_s": round(percentile(durations, 99), 2),
+        "mean_s": round(statistics.fmean(durations), 2) if durations else 0,
+        "peak_rss_mb": round(max(peaks["rss"], resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024) / 2 ** 20, 1),
+        "peak_disk_mb": round(peaks["disk"] / 2 ** 20, 1),
+        "served": served,
+        "errors": sorted(set(errors))[:10],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark for the TeraBox bots")
+    parser.add_argument("--bot", choices=("bot1", "bot"), default="bot1")
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--log-level", default="ERROR")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    standins.add_arguments(parser)
+    args = parser.parse_args()
+
+    # The bots read their configuration at import time
+    os.environ.setdefault("BOT_TOKEN", BENCH_TOKEN)
+    os.environ.setdefault("MONGO_URI", "mongodb://127.0.0.1:1")
+    os.environ.setdefault("METRICS_PORT", "0")
+    os.environ.setdefault("SPOOL_DIR", tempfile.mkdtemp(prefix="terabench-"))
+
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(
+        target=standins.run_forever,
+        args=("127.0.0.1", args.port, ready),
+        kwargs=standins.options_from_args(args),
+        daemon=True,
+    )
+    server.start()
+    if not ready.wait(10):
+        server.terminate()
+        sys.exit("Stand-in servers did not start")
+
+    # Each bot configures logging on import; quieten it afterwards
+    try:
+        report = asyncio.run(_run_quietly(args, f"http://127.0.0.1:{args.port}"))
+    finally:
+        server.terminate()
+        server.join()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"\n{report['bot']}: {report['delivered']}/{report['files']} files of {report['file_mb']} MB "
+          f"at concurrency {report['concurrency']} in {report['elapsed_s']}s")
+    print(f"  throughput     {report['files_per_min']} files/min ({report['mb_per_s']} MB/s)")
+    print(f"  delivery time  p50 {report['p50_s']}s, p99 {report['p99_s']}s, mean {report['mean_s']}s")
+    print(f"  peak RSS       {report['peak_rss_mb']} MB")
+    print(f"  peak spool     {report['peak_disk_mb']} MB")
+    print(f"  stand-ins      {report['served']}")
+    for error in report["errors"]:
+        print(f"  error          {error}")
+
+
+async def _run_quietly(args, base_url: str):
+    if args.bot == "bot1":
+        import bot1  # noqa: F401
+    else:
+        import bot  # noqa: F401
+    logging.getLogger().setLevel(args.log_level.upper())
+    return await run(args, base_url)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+In-memory stand-in for the slice of the Motor API the bots use, so a
+benchmark measures the download/upload path rather than a database.
+
+Supports equality and ``$ne/$lt/$lte/$gt/$gte/$in/$nin/$exists/$mod``
+filters on dotted fields, ``$or/$and``, ``$set/$inc`` updates with upsert,
+``bulk_write`` of ``InsertOne`` and a ``$group`` count aggregation.
+``watch`` raises ``OperationFailure`` so change-stream consumers fall back
+to polling.
+"""
+import asyncio
+import copy
+import itertools
+from types import SimpleNamespace
+from pymongo.errors import OperationFailure
+
+_ids = itertools.count(1)
+
+
+def _matches(doc: dict, query: dict) -> bool:
+    for key, cond in query.items():
+        if key == "$or":
+            if not any(_matches(doc, q) for q in cond):
+                return False
+            continue
+        if key == "$and":
+            if not all(_matches(doc, q) for q in cond):
+                return False
+            continue
+        value = doc
+        for part in key.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        if isinstance(cond, dict) and any(op.startswith("$") for op in cond):
+            for op, arg in cond.items():
+                if op == "$ne" and value == arg:
+                    return False
+                if op == "$in" and value not in arg:
+                    return False
+                if op == "$nin" and value in arg:
+                    return False
+                if op == "$exists" and (value is not None) != bool(arg):
+                    return False
+                if op == "$mod" and (not isinstance(value, int) or value % arg[0] != arg[1]):
+                    return False
+                if op in ("$lt", "$lte", "$gt", "$gte"):
+                    if value is None:
+                        return False
+                    if op == "$lt" and not value < arg or op == "$lte" and not value <= arg:
+                        return False
+                    if op == "$gt" and not value > arg or op == "$gte" and not value >= arg:
+                        return False
+        elif value != cond:
+            return False
+    return True
+
+
+def _apply(doc: dict, update: dict):
+    for key, value in update.get("$set", {}).items():
+        doc[key] = value
+    for key, value in update.get("$inc", {}).items():
+        doc[key] = doc.get(key, 0) + value
+
+
+def _project(doc: dict, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    keep = {k for k, v in projection.items() if v}
+    return {k: copy.deepcopy(v) for k, v in doc.items() if k in keep or k == "_id"}
+
+
+class _Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+    async def to_list(self, length=None):
+        return self.docs[:length] if length else list(self.docs)
+
+
+class MemoryCollection:
+    def __init__(self, name: str):
+        self.name = name
+        self.docs = []
+        self.calls = 0
+
+    async def _tick(self):
+        self.calls += 1
+        # Yield like a real round trip would
+        await asyncio.sleep(0)
+
+    async def create_index(self, *args, **kwargs):
+        return "memory"
+
+    async def find_one(self, query: dict = None, projection=None):
+        await self._tick()
+        for doc in self.docs:
+            if _matches(doc, query or {}):
+                return _project(doc, projection)
+        return None
+
+    def find(self, query: dict = None, projection=None):
+        self.calls += 1
+        return _Cursor([_project(d, projection) for d in self.docs if _matches(d, query or {})])
+
+    async def insert_one(self, doc: dict):
+        await self._tick()
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", next(_ids))
+        self.docs.append(doc)
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def _update(self, query: dict, update: dict, many: bool, upsert: bool = False):
+        await self._tick()
+        matched = [d for d in self.docs if _matches(d, query)]
+        if not many:
+            matched = matched[:1]
+        for doc in matched:
+            _apply(doc, update)
+        if not matched and upsert:
+            doc = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+            doc.setdefault("_id", next(_ids))
+            _apply(doc, update)
+            self.docs.append(doc)
+        return SimpleNamespace(matched_count=len(matched), modified_count=len(matched))
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        return await self._update(query, update, many=False, upsert=upsert)
+
+    async def update_many(self, query: dict, update: dict, upsert: bool = False):
+        return await self._update(query, update, many=True, upsert=upsert)
+
+    async def delete_one(self, query: dict):
+        await self._tick()
+        for doc in self.docs:
+            if _matches(doc, query):
+                self.docs.remove(doc)
+                return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    async def find_one_and_update(self, query: dict, update: dict, sort=None, return_document=None, upsert=False):
+        await self._tick()
+        matched = [d for d in self.docs if _matches(d, query)]
+        for key, direction in reversed(sort or []):
+            matched.sort(key=lambda d: d.get(key), reverse=direction < 0)
+        if not matched:
+            return None
+        before = copy.deepcopy(matched[0])
+        _apply(matched[0], update)
+        return copy.deepcopy(matched[0]) if return_document else before
+
+    async def bulk_write(self, requests, ordered: bool = True):
+        await self._tick()
+        for request in requests:
+            # pymongo.InsertOne keeps the document in ``_doc``
+            doc = copy.deepcopy(request._doc)
+            doc.setdefault("_id", next(_ids))
+            self.docs.append(doc)
+        return SimpleNamespace(inserted_count=len(requests))
+
+    def aggregate(self, pipeline):
+        self.calls += 1
+        group = next(stage["$group"] for stage in pipeline if "$group" in stage)
+        field = group["_id"].lstrip("$")
+        # Only ``{"$sum": 1}`` accumulators are understood
+        outputs = [k for k in group if k != "_id"]
+        counts = {}
+        for doc in self.docs:
+            counts[doc.get(field)] = counts.get(doc.get(field), 0) + 1
+        return _Cursor([{"_id": k, **{out: v for out in outputs}} for k, v in counts.items()])
+
+
+class MemoryDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self.collections:
+            self.collections[name] = MemoryCollection(name)
+        return self.collections[name]
+
+    def watch(self, *args, **kwargs):
+        raise OperationFailure("change streams are not available in memory", code=40573)
@@ -0,0 +1,95 @@
+"""
+Benchmark for share link extraction on large, link-heavy channel posts.
+
+Compares ``share_key.extract_links`` with the lazy regex the bots used
+before (``https?://[^\\s]*?(domains)\\.[^\\s]+``):
+
+* typical posts: ``--posts`` messages of about 4096 characters mixing
+  text with links to ``--shares`` shares, each written with a random domain
+  and URL shape (``/s/1<id>``, ``?surl=<id>``, trailing punctuation...)
+* adversarial posts: one whitespace-free run of ``--adversarial-kb`` KB made
+  of ``https://`` prefixes that never reach a TeraBox domain, where the lazy
+  pattern rescans the rest of the run from every prefix
+
+    python -m benchmarks.share_keys --posts 2000 --adversarial-kb 64
+"""
+import argparse
+import random
+import re
+import string
+import time
+
+from share_key import DOMAINS, extract_links
+
+LEGACY_LINK_REGEX = re.compile(
+    r"https?://[^\s]*?(?:terabox|teraboxapp|teraboxshare|nephobox|1024tera|1024terabox|freeterabox|terasharefile|terasharelink|mirrobox|momerybox|teraboxlink|teraboxurl)\.[^\s]+",
+    re.IGNORECASE
+)
+POST_SIZE = 4096
+WORDS = ["new", "episode", "full", "hd", "watch", "now", "link", "👇", "🔥", "download", "join", "@channel", "#video"]
+
+
+def legacy_extract(text: str) -> list:
+    return list(dict.fromkeys(url.rstrip('.,!?') for url in LEGACY_LINK_REGEX.findall(text)))
+
+
+def share_url(rng: random.Random, share: str) -> str:
+    host = rng.choice(["", "www.", "dm."]) + rng.choice(DOMAINS) + rng.choice([".com", ".app", ".fun"])
+    shape = rng.choice([f"/s/1{share}", f"/sharing/link?surl={share}", f"/wap/share/filelist?surl={share}"])
+    return f"https://{host}{shape}" + rng.choice(["", "", ".", ",", "!", "?x=1"])
+
+
+def channel_post(rng: random.Random, shares: list) -> str:
+    parts = []
+    size = 0
+    while size < POST_SIZE:
+        part = share_url(rng, rng.choice(shares)) if rng.random() < 0.3 else rng.choice(WORDS)
+        parts.append(part)
+        size += len(part) + 1
+    return " ".join(parts)
+
+
+def adversarial_post(kb: int) -> str:
+    return ("https://x" * (kb * 1024 // 9 + 1))[:kb * 1024]
+
+
+def measure(extract, posts: list):
+    started = time.perf_counter()
+    links = [extract(post) for post in posts]
+    return time.perf_counter() - started, links
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Share link extraction benchmark")
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--shares", type=int, default=200, help="distinct shares the posts link to")
+    parser.add_argument("--adversarial-kb", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    shares = ["".join(rng.choices(string.ascii_letters + string.digits + "-_", k=22)) for _ in range(args.shares)]
+    posts = [channel_post(rng, shares) for _ in range(args.posts)]
+
+    legacy_time, legacy_links = measure(legacy_extract, posts)
+    new_time, new_links = measure(extract_links, posts)
+    legacy_count = sum(len(links) for links in legacy_links)
+    new_count = sum(len(links) for links in new_links)
+    legacy_distinct = len({url for links in legacy_links for url in links})
+    new_distinct = len({key for links in new_links for key, _ in links})
+    print(f"{args.posts} posts of ~{POST_SIZE} chars linking {args.shares} shares")
+    print(f"  legacy regex   {legacy_time * 1000:.1f} ms ({args.posts / legacy_time:.0f} posts/s), "
+          f"{legacy_count} links, {legacy_distinct} distinct cache keys")
+    print(f"  extract_links  {new_time * 1000:.1f} ms ({args.posts / new_time:.0f} posts/s), "
+          f"{new_count} links, {new_distinct} distinct cache keys")
+
+    post = adversarial_post(args.adversarial_kb)
+    legacy_time, _ = measure(legacy_extract, [post])
+    new_time, _ = measure(extract_links, [post])
+    print(f"{args.adversarial_kb} KB whitespace-free post of bare https:// prefixes")
+    print(f"  legacy regex   {legacy_time * 1000:.1f} ms")
+    print(f"  extract_links  {new_time * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Local stand-ins for the services the bots talk to, for offline benchmarks.
+
+* ``/api?url=<share>`` answers like the TeraBox resolver workers (``API_BASE``
+  in bot1.py, ``TERABOX_API`` in bot.py) with ``files_per_share`` videos
+  per share.
+* ``/cdn/<name>`` serves a deterministic body of the advertised size with
+  Range support, a per-connection bandwidth cap, first-byte latency and
+  failure injection.
+* ``/bot<token>/<method>`` is a Bot API that accepts sendVideo,
+  sendMediaGroup, sendMessage, editMessageText, deleteMessage and friends,
+  draining uploads without keeping them.
+
+Run standalone with ``python -m benchmarks.standins --port 8790``.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import re
+import time
+from aiohttp import web
+
+PATTERN = bytes(range(256)) * 4096  # 1 MiB, sliced by absolute offset
+SEND_CHUNK = 64 * 1024
+RANGE_REGEX = re.compile(r"bytes=(\d+)-(\d*)")
+SHARE_REGEX = re.compile(r"/s/1?([\w-]+)")
+
+
+class StandIns:
+    def __init__(self, file_mb: float = 50, bandwidth_mbps: float = 0, latency_ms: float = 0,
+                 fail_rate: float = 0, abort_rate: float = 0, ranges: bool = True,
+                 resolver_latency_ms: float = 0, upload_mbps: float = 0, proxy_bandwidth_mbps: float = 0,
+                 files_per_share: int = 1):
+        self.file_size = int(file_mb * 1024 * 1024)
+        self.bandwidth = bandwidth_mbps * 1024 * 1024 / 8
+        self.latency = latency_ms / 1000
+        self.fail_rate = fail_rate
+        self.abort_rate = abort_rate
+        self.ranges = ranges
+        self.resolver_latency = resolver_latency_ms / 1000
+        self.upload_rate = upload_mbps * 1024 * 1024 / 8
+        self.proxy_bandwidth = proxy_bandwidth_mbps * 1024 * 1024 / 8
+        self.files_per_share = max(1, files_per_share)
+        self.message_ids = itertools.count(1)
+        self.counts = {"resolve": 0, "cdn_requests": 0, "cdn_bytes": 0, "cdn_failures": 0,
+                       "uploads": 0, "upload_bytes": 0, "bot_calls": 0, "albums": 0}
+        self.base_url = ""
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=4 * 1024 ** 3)
+        app.router.add_get("/api", self.resolve)
+        app.router.add_get("/cdn/{name}", self.cdn)
+        app.router.add_post("/bot{token}/{method}", self.bot_api)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+    async def resolve(self, request):
+        self.counts["resolve"] += 1
+        if self.resolver_latency:
+            await asyncio.sleep(self.resolver_latency)
+        share = request.query.get("url", "")
+        match = SHARE_REGEX.search(share)
+        stem = match.group(1) if match else "video"
+        files = []
+        for i in range(self.files_per_share):
+            name = f"{stem}.mp4" if self.files_per_share == 1 else f"{stem}-{i + 1:02d}.mp4"
+            url = f"{self.base_url}/cdn/{name}?expires={int(time.time()) + 3600}"
+            files.append({
+                "file_name": name,
+                "size": f"{self.file_size / (1024 * 1024):.2f} MB",
+                "size_bytes": self.file_size,
+                "proxified_download_url": url + "&via=proxy",
+                "original_download_url": url,
+                "streaming_url": url + "&via=stream",
+                "download_url": url,
+            })
+        return web.json_response({"success": True, "files": files})
+
+    async def cdn(self, request):
+        self.counts["cdn_requests"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if random.random() < self.fail_rate:
+            self.counts["cdn_failures"] += 1
+            return web.Response(status=503, text="injected failure")
+        start, end = 0, self.file_size - 1
+        status = 200
+        headers = {"Content-Type": "video/mp4"}
+        match = RANGE_REGEX.match(request.headers.get("Range", ""))
+        if match and self.ranges:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else end, self.file_size - 1)
+            if start > end:
+                return web.Response(status=416)
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{self.file_size}"
+        if self.ranges:
+            headers["Accept-Ranges"] = "bytes"
+        headers["Content-Length"] = str(end - start + 1)
+        resp = web.StreamResponse(status=status, headers=headers)
+        await resp.prepare(request)
+        abort_at = end + 1
+        if end - start > SEND_CHUNK and random.random() < self.abort_rate:
+            abort_at = random.randint(start + SEND_CHUNK, end)
+        bandwidth = self.bandwidth
+        if request.query.get("via") == "proxy" and self.proxy_bandwidth:
+            bandwidth = self.proxy_bandwidth
+        pos = start
+        started = time.monotonic()
+        while pos <= end:
+            if pos >= abort_at:
+                self.counts["cdn_failures"] += 1
+                request.transport.close()
+                return resp
+            n = min(SEND_CHUNK, end - pos + 1)
+            offset = pos % len(PATTERN)
+            chunk = PATTERN[offset:offset + n]
+            if len(chunk) < n:
+                chunk += PATTERN[:n - len(chunk)]
+            await resp.write(chunk)
+            pos += n
+            self.counts["cdn_bytes"] += n
+            if bandwidth:
+                ahead = (pos - start) / bandwidth - (time.monotonic() - started)
+                if ahead > 0:
+                    await asyncio.sleep(ahead)
+        await resp.write_eof()
+        return resp
+
+    async def _read_params(self, request) -> dict:
+        """Form fields of a Bot API call; file parts are drained and only counted."""
+        params = {}
+        if request.content_type == "multipart/form-data":
+            reader = await request.multipart()
+            started = time.monotonic()
+            received = 0
+            async for part in reader:
+                if part.filename:
+                    self.counts["uploads"] += 1
+                    while True:
+                        chunk = await part.read_chunk(SEND_CHUNK)
+                        if not chunk:
+                            break
+                        received += len(chunk)
+                        if self.upload_rate:
+                            ahead = received / self.upload_rate - (time.monotonic() - started)
+                            if ahead > 0:
+                                await asyncio.sleep(ahead)
+                    continue
+                params[part.name] = await part.text()
+            self.counts["upload_bytes"] += received
+        elif request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        return params
+
+    async def bot_api(self, request):
+        self.counts["bot_calls"] += 1
+        method = request.match_info["method"].lower()
+        params = await self._read_params(request)
+        if method == "getme":
+            return _ok({"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"})
+        if method in ("deletemessage", "setmycommands", "answercallbackquery"):
+            return _ok(True)
+        chat_id = int(params.get("chat_id", 0) or 0)
+        if method == "sendmediagroup":
+            self.counts["albums"] += 1
+            media = params.get("media", "[]")
+            media = json.loads(media) if isinstance(media, str) else media
+            return _ok([self._video_message(chat_id, item.get("media", ""), item.get("caption", "")) for item in media])
+        if method == "sendvideo":
+            return _ok(self._video_message(chat_id, params.get("video", ""), params.get("caption", "")))
+        message = self._message(chat_id, params.get("message_id"))
+        message["text"] = params.get("text", "")
+        return _ok(message)
+
+    def _message(self, chat_id: int, message_id=None) -> dict:
+        return {
+            "message_id": int(message_id or next(self.message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "channel"},
+        }
+
+    def _video_message(self, chat_id: int, video: str, caption: str) -> dict:
+        message = self._message(chat_id)
+        file_id = video if video and not video.startswith(("attach://", "file://")) else f"BENCH{message['message_id']}"
+        message["video"] = {"file_id": file_id, "file_unique_id": file_id, "width": 1280, "height": 720, "duration": 60}
+        message["caption"] = caption
+        return message
+
+    async def stats(self, request):
+        return web.json_response(self.counts)
+
+
+def _ok(result):
+    return web.Response(text=json.dumps({"ok": True, "result": result}), content_type="application/json")
+
+
+async def serve(standins: StandIns, host: str, port: int):
+    standins.base_url = f"http://{host}:{port}"
+    runner = web.AppRunner(standins.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def run_forever(host: str, port: int, ready=None, **options):
+    """Process entry point: serve the stand-ins until terminated, setting ``ready`` once listening."""
+    standins = StandIns(**options)
+
+    async def run():
+        await serve(standins, host, port)
+        if ready is not None:
+            ready.set()
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--file-mb", type=float, default=50)
+    parser.add_argument("--bandwidth-mbps", type=float, default=0, help="per connection, 0 = unlimited")
+    parser.add_argument("--latency-ms", type=float, default=0, help="CDN first-byte latency")
+    parser.add_argument("--fail-rate", type=float, default=0, help="share of CDN requests answered 503")
+    parser.add_argument("--abort-rate", type=float, default=0, help="share of CDN bodies cut off midway")
+    parser.add_argument("--no-ranges", action="store_true", help="ignore Range headers")
+    parser.add_argument("--resolver-latency-ms", type=float, default=0)
+    parser.add_argument("--upload-mbps", type=float, default=0, help="Bot API ingest cap per upload, 0 = unlimited")
+    parser.add_argument("--proxy-bandwidth-mbps", type=float, default=0, help="per connection cap for proxified URLs")
+    parser.add_argument("--files-per-share", type=int, default=1, help="videos listed by every share")
+
+
+def options_from_args(args) -> dict:
+    return {
+        "file_mb": args.file_mb,
+        "bandwidth_mbps": args.bandwidth_mbps,
+        "latency_ms": args.latency_ms,
+        "fail_rate": args.fail_rate,
+        "abort_rate": args.abort_rate,
+        "ranges": not args.no_ranges,
+        "resolver_latency_ms": args.resolver_latency_ms,
+        "upload_mbps": args.upload_mbps,
+        "proxy_bandwidth_mbps": args.proxy_bandwidth_mbps,
+        "files_per_share": args.files_per_share,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8790)
+    add_arguments(parser)
+    args = parser.parse_args()
+    print(f"Stand-ins listening on http://{args.host}:{args.port}", flush=True)
+    run_forever(args.host, args.port, **options_from_args(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,23 @@
 import asyncio
-import re
 import os
+import time
 import logging
+from pathlib import Path
 import aiohttp
-import aiofiles
+import signal
+from aiohttp import web
 from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters, ContextTypes
+from http_client import get_session, close_session, META_TIMEOUT
+import downloader
+from resolver_cache import ResolverCache, signed_url_expiry
+from spool import Spool
+import local_api
+import mp4meta
+import webhook
+from source_health import SourceHealth, tracked_download
+from share_key import share_key, extract_links
 
 # ===== LOGGING =====
 log_dir = "logs"
@@ -28,15 +40,37 @@ TERABOX_API = "https://terabox-worker.robinkumarshakya103.workers.dev"
 MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024  # 2GB
 CONCURRENT_DOWNLOADS = 15
 DOWNLOAD_TIMEOUT = 300  # 5 minutes
-CHUNK_SIZE = 8192
-
-# TeraBox-specific URL regex
-LINK_REGEX = re.compile(
-    r"https?://[^\s]*?(?:terabox|teraboxapp|teraboxshare|nephobox|1024tera|1024terabox|freeterabox|terasharefile|terasharelink|mirrobox|momerybox|teraboxlink|teraboxurl)\.[^\s]+",
-    re.IGNORECASE
-)
 
 semaphore = asyncio.Semaphore(CONCURRENT_DOWNLOADS)
+spool = Spool()
+
+# ===== Resolver =====
+def download_candidates(file: dict):
+    # streaming_url first to avoid sign errors, until source health says otherwise
+    return [(kind, file.get(kind)) for kind in ("streaming_url", "download_url", "original_download_url") if file.get(kind)]
+
+async def fetch_file_info(link: str):
+    api_url = f"{TERABOX_API}/api?url={link}"
+    async with get_session().get(api_url, timeout=META_TIMEOUT) as resp:
+        if resp.status != 200:
+            logger.warning(f"API error {resp.status}")
+            return None
+        data = await resp.json()
+
+    # Validate response
+    if not data.get("success") or not data.get("files") or len(data["files"]) == 0:
+        logger.warning(f"Invalid API response")
+        return None
+    return data
+
+resolver = ResolverCache(
+    fetch_file_info,
+    url_expiry=lambda data: min(
+        (signed_url_expiry(url) for f in data["files"] for _, url in download_candidates(f)),
+        default=time.time()
+    )
+)
+health = SourceHealth()
 
 # ===== Commands =====
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -49,30 +83,51 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     await update.message.reply_text(msg, parse_mode="Markdown")
 
+# ===== Upload Function =====
+async def reply_video_file(update: Update, file_path: str, filename: str, caption: str, meta: dict = None) -> str:
+    """
+    Reply with a spooled video by local path when the Bot API server can read it, else multipart.
+    ``meta`` (from ``mp4meta.inspect``) supplies duration, dimensions and thumbnail.
+    """
+    meta = meta or {}
+    attributes = {k: meta[k] for k in ("duration", "width", "height") if meta.get(k)}
+    if meta.get("thumbnail"):
+        # Uploaded either way: only the video itself can be passed as a local path
+        attributes["thumbnail"] = Path(meta["thumbnail"])
+    uri = local_api.file_uri(file_path)
+    if uri:
+        try:
+            await update.message.reply_video(video=uri, caption=caption, parse_mode="Markdown", **attributes)
+            local_api.upload_modes["local"] += 1
+            return "local path"
+        except BadRequest as e:
+            local_api.upload_modes["fallback"] += 1
+            logger.warning(f"Local path upload rejected, falling back to multipart: {str(e)}")
+    with open(file_path, "rb") as video_file:
+        await update.message.reply_video(
+            video=video_file,
+            filename=filename,
+            caption=caption,
+            parse_mode="Markdown",
+            **attributes
+        )
+    local_api.upload_modes["multipart"] += 1
+    return "multipart"
+
 # ===== Download Function =====
-async def download_and_send(update: Update, link: str, failed_links: list, session: aiohttp.ClientSession):
+async def download_and_send(update: Update, link: str, failed_links: list):
     async with semaphore:
         file_path = None
+        reservation = None
         max_retries = 3
         retry_count = 0
         
         try:
             logger.warning(f"Processing: {link}")
 
-            # Get file info from Terabox API
-            api_url = f"{TERABOX_API}/api?url={link}"
-            
-            async with session.get(api_url, timeout=aiohttp.ClientTimeout(total=60)) as resp:
-                if resp.status != 200:
-                    logger.warning(f"API error {resp.status}")
-                    failed_links.append(link)
-                    return
-
-                data = await resp.json()
-
-            # Validate response
-            if not data.get("success") or not data.get("files") or len(data["files"]) == 0:
-                logger.warning(f"Invalid API response")
+            # Get file info from Terabox API (cached while its signed URLs are valid)
+            data = await resolver.get(link, key=share_key(link))
+            if not data:
                 failed_links.append(link)
                 return
 
@@ -81,10 +136,7 @@ async def download_and_send(update: Update, link: str, failed_links: list, sessi
             size_bytes = int(file.get("size_bytes", 0))
             file_size = file.get("size", "unknown")
             
-            # Prefer streaming_url to avoid sign errors
-            download_url = file.get("streaming_url") or file.get("download_url") or file.get("original_download_url")
-            
-            if not download_url:
+            if not download_candidates(file):
                 logger.warning(f"No download URL")
                 failed_links.append(link)
                 return
@@ -99,9 +151,9 @@ async def download_and_send(update: Update, link: str, failed_links: list, sessi
                 failed_links.append(link)
                 return
 
-            # Create temp directory if needed
-            os.makedirs("/tmp", exist_ok=True)
-            file_path = f"/tmp/{filename}"
+            # Reserve disk space for the file; waits while the spool budget is full
+            reservation = await spool.reserve(size_bytes, filename)
+            file_path = reservation.path
 
             # Headers for download
             headers = {
@@ -114,53 +166,47 @@ async def download_and_send(update: Update, link: str, failed_links: list, sessi
             # Retry loop with fresh URL generation
             while retry_count < max_retries:
                 try:
-                    # Get fresh download URL before each attempt
-                    async with session.get(api_url, timeout=aiohttp.ClientTimeout(total=60)) as resp:
-                        if resp.status != 200:
-                            break
-
-                        fresh_data = await resp.json()
-
-                    if not fresh_data.get("success") or not fresh_data.get("files"):
+                    # First attempt reuses the lookup above, retries force a fresh download URL
+                    fresh_data = await resolver.get(link, key=share_key(link), refresh=retry_count > 0)
+                    if not fresh_data:
                         break
 
-                    download_url = fresh_data["files"][0].get("streaming_url") or fresh_data["files"][0].get("download_url") or fresh_data["files"][0].get("original_download_url")
-                    if not download_url:
+                    # Best-scoring source; a failed one drops behind the others for the retry
+                    candidates = health.rank(download_candidates(fresh_data["files"][0]), size_bytes)
+                    if not candidates:
                         break
+                    kind, download_url = candidates[0]
 
                     # Download file with timeout
-                    async with session.get(download_url, headers=headers, timeout=aiohttp.ClientTimeout(total=DOWNLOAD_TIMEOUT)) as r:
-                        if r.status == 200:
-                            async with aiofiles.open(file_path, "wb") as f:
-                                async for chunk in r.content.iter_chunked(CHUNK_SIZE):
-                                    await f.write(chunk)
-                            
-                            logger.warning(f"✅ Downloaded: {filename}")
-                            break
+                    try:
+                        await asyncio.wait_for(
+                            tracked_download(health, kind, download_url, file_path, expected_size=size_bytes, headers=headers),
+                            timeout=DOWNLOAD_TIMEOUT
+                        )
+                        logger.warning(f"✅ Downloaded: {filename}")
+                        break
+                    except downloader.DownloadError as e:
+                        logger.warning(f"Download attempt failed: {str(e)}")
+                        retry_count += 1
+                        if retry_count < max_retries:
+                            await asyncio.sleep(2)
                         else:
-                            retry_count += 1
-                            if retry_count < max_retries:
-                                await asyncio.sleep(2)
-                            else:
-                                logger.warning(f"❌ Failed after {max_retries} attempts")
-                                failed_links.append(link)
-                                return
+                            logger.warning(f"❌ Failed after {max_retries} attempts")
+                            failed_links.append(link)
+                            return
 
                 except Exception as e:
                     retry_count += 1
                     if retry_count >= max_retries:
                         raise
 
-            # Send video
-            if os.path.exists(file_path):
+            # Send video only once every byte is on disk
+            if downloader.verify(file_path):
                 caption = f"🎬 *{filename}*\n📦 Size: {file_size}"
-                with open(file_path, "rb") as video_file:
-                    await update.message.reply_video(
-                        video=video_file,
-                        caption=caption,
-                        parse_mode="Markdown"
-                    )
-                logger.warning(f"📤 Sent: {filename}")
+                # Moov first so Telegram can stream it; a half-rewritten file raises Mp4Error
+                meta = await mp4meta.inspect(file_path)
+                mode = await reply_video_file(update, file_path, filename, caption, meta)
+                logger.warning(f"📤 Sent: {filename} ({mode})")
             else:
                 failed_links.append(link)
 
@@ -175,10 +221,10 @@ async def download_and_send(update: Update, link: str, failed_links: list, sessi
             logger.warning(f"❌ Error: {str(e)}")
             failed_links.append(link)
         finally:
-            # Clean up temp file
-            if file_path and os.path.exists(file_path):
+            # Clean up temp file and its resume manifest
+            if reservation:
                 try:
-                    os.remove(file_path)
+                    reservation.release()
                 except Exception:
                     pass
 
@@ -189,8 +235,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if not text:
             return
 
-        # Extract links using comprehensive regex
-        links = list(dict.fromkeys(LINK_REGEX.findall(text)))
+        # One link per share, however many domains or URL shapes it was pasted as
+        links = [url for _, url in extract_links(text)]
 
         if not links:
             return
@@ -199,12 +245,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         msg = await update.message.reply_text(f"🔍 Found {len(links)} link(s). Starting downloads...")
 
         failed_links = []
-        async with aiohttp.ClientSession() as session:
-            tasks = [
-                asyncio.create_task(download_and_send(update, link, failed_links, session))
-                for link in links
-            ]
-            await asyncio.gather(*tasks, return_exceptions=True)
+        tasks = [
+            asyncio.create_task(download_and_send(update, link, failed_links))
+            for link in links
+        ]
+        await asyncio.gather(*tasks, return_exceptions=True)
 
         # Report failures
         if failed_links:
@@ -219,11 +264,65 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ An error occurred. Try again.")
 
 # ===== Bot Launcher =====
+async def on_shutdown(app):
+    await close_session()
+
+async def serve_webhook(app):
+    """Receive updates over HTTP and queue them for the application, acknowledging each at once."""
+    secret = webhook.secret_token(BOT_TOKEN)
+
+    async def receive(request):
+        if not webhook.verify(request, secret):
+            return web.Response(status=401)
+        try:
+            update = Update.de_json(await request.json(), app.bot)
+        except ValueError:
+            return web.Response(status=400)
+        await app.update_queue.put(update)
+        return web.Response()
+
+    server = webhook.application()
+    server.router.add_post(webhook.WEBHOOK_PATH, receive)
+    await app.initialize()
+    await app.start()
+    runner = await webhook.start_server(server)
+    try:
+        await app.bot.set_webhook(
+            webhook.url(),
+            secret_token=secret,
+            allowed_updates=Update.ALL_TYPES,
+            max_connections=webhook.WEBHOOK_MAX_CONNECTIONS
+        )
+        logger.warning("🚀 Bot started (webhook)")
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+    finally:
+        # The webhook stays registered for the other replicas
+        await runner.cleanup()
+        await app.stop()
+        await app.shutdown()
+        await on_shutdown(app)
+
 def run_bot():
-    app = ApplicationBuilder().token(BOT_TOKEN).base_url(TELEGRAM_API_URL).build()
+    app = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .local_mode(local_api.LOCAL_MODE)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    spool.cleanup_orphans()
+    if webhook.ENABLED:
+        asyncio.run(serve_webhook(app))
+        return
     logger.warning("🚀 Bot started")
+    # Deletes any registered webhook before polling
     app.run_polling()
 
 if __name__ == "__main__":
@@ -1,19 +1,39 @@
 import asyncio
-import aiohttp
-import re
 import os
-import tempfile
+import signal
 import time
 import logging
 from aiogram import Bot, Dispatcher, Router, types
-from aiogram.types import Message, FSInputFile, BotCommand
+from aiogram.types import Message, FSInputFile, BotCommand, InputMediaVideo
 from aiogram.filters import Command
 from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.client.telegram import TelegramAPIServer
-from aiogram.exceptions import TelegramBadRequest
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure, PyMongoError
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from dotenv import load_dotenv
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+from http_client import get_session, close_session, META_TIMEOUT
+import downloader
+import disk_writer
+from resolver_cache import ResolverCache, signed_url_expiry
+from outbox import Outbox
+from pipeline import Stage, FairQueue
+from job_queue import JobQueue, JOB_GROUP_LIMIT, WORKER_SHARDS
+from broadcast_ledger import BroadcastLedger, content_key
+from spool import Spool
+import local_api
+import metrics
+import mp4meta
+import webhook
+from source_health import SourceHealth, tracked_download, HEDGE_DOWNLOADS, HEDGE_AFTER, HEDGE_FLOOR
+from share_key import share_key, extract_links
+from stream_upload import stream_upload, StreamUnavailable, STREAM_UPLOADS, STREAM_UPLOAD_TIMEOUT
 
 # Load .env file
 load_dotenv()
@@ -29,12 +49,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# TeraBox-specific URL regex
-LINK_REGEX = re.compile(
-    r"https?://[^\s]*?(?:terabox|teraboxapp|teraboxshare|nephobox|1024tera|teraboxurl|teraboxurl|1024terabox|freeterabox|terasharefile|terasharelink|mirrobox|momerybox|teraboxlink|teraboxurl)\.[^\s]+",
-    re.IGNORECASE
-)
-
 # Configuration
 BOT_TOKEN = os.getenv("BOT_TOKEN", "").strip()
 API_BASE = "https://teradll2.itxarshman.workers.dev"
@@ -42,11 +56,13 @@ SELF_HOSTED_API = "http://tgapi.arshman.space:8088"
 
 # MongoDB setup
 MONGO_URI = os.getenv("MONGO_URI", "")
-mongo = AsyncIOMotorClient(MONGO_URI)
+mongo = AsyncIOMotorClient(MONGO_URI, event_listeners=[metrics.MongoListener()])
 db = mongo["teradownloader"]
 config_col = db["config"]
 broadcast_col = db["broadcasted"]
 admins_col = db["admins"]
+file_cache_col = db["file_cache"]
+jobs_col = db["jobs"]
 
 # Default global config
 DEFAULT_CONFIG = {
@@ -65,19 +81,71 @@ if not MONGO_URI:
     logger.error("MONGO_URI is not set in environment variables")
     raise ValueError("MONGO_URI is required")
     
-session = AiohttpSession(api=TelegramAPIServer.from_base(SELF_HOSTED_API))
+session = AiohttpSession(api=TelegramAPIServer.from_base(SELF_HOSTED_API, is_local=local_api.LOCAL_MODE))
 bot = Bot(token=BOT_TOKEN, session=session)
 dp = Dispatcher()
+spool = Spool()
+outbox = Outbox(retry_after=lambda e: e.retry_after if isinstance(e, TelegramRetryAfter) else None)
+# Under the supervisor every job of a chat goes to the same worker, which runs them one at
+# a time so links are delivered in the order they were sent. SHARD_BY=share instead keeps
+# each share on one worker (better cache hits) and gives up per-chat ordering.
+SHARD_BY = os.getenv("SHARD_BY", "chat").lower()
+ORDERED_CHATS = WORKER_SHARDS > 1 and SHARD_BY == "chat"
+jobs = JobQueue(
+    jobs_col,
+    group_field="payload.chat_id",
+    group_limit=1 if ORDERED_CHATS else JOB_GROUP_LIMIT,
+    shard_key=(lambda p: share_key(p["source_url"]) or p["source_url"]) if SHARD_BY == "share" else (lambda p: p["chat_id"]),
+)
+broadcasts = BroadcastLedger(broadcast_col)
 router = Router(name="terabox_listener")
-sem = asyncio.Semaphore(50)
+# Stage sizing: resolver API calls, byte transfers, Telegram uploads
+RESOLVE_WORKERS = int(os.getenv("RESOLVE_WORKERS", "8"))
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "20"))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "6"))
+RESOLVE_QUEUE_SIZE = int(os.getenv("RESOLVE_QUEUE_SIZE", "1000"))
+DOWNLOAD_QUEUE_SIZE = int(os.getenv("DOWNLOAD_QUEUE_SIZE", "200"))
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", "10"))
+STATS_LOG_INTERVAL = 60
+# Resolve and download queues are per chat, served round-robin with these weights
+SOURCE_WEIGHTS = {
+    source: int(weight)
+    for source, weight in (item.split("=") for item in os.getenv("SOURCE_WEIGHTS", "admin=4,user=2,channel=1").split(","))
+}
+CHAT_MAX_DOWNLOADS = int(os.getenv("CHAT_MAX_DOWNLOADS", "5"))  # concurrent downloads per chat, 0 = no limit
+CHAT_BYTE_RATE = float(os.getenv("CHAT_BYTE_RATE_MBPS", "0")) * 1024 * 1024  # download quota per chat, 0 = no limit
+# "frontend" only takes Telegram updates and enqueues jobs, "worker" only runs jobs, "all" does both
+BOT_ROLE = os.getenv("BOT_ROLE", "all").lower()
+JOB_CONCURRENCY = int(os.getenv("JOB_CONCURRENCY", "50"))
+DRAIN_SECONDS = float(os.getenv("DRAIN_SECONDS", "60"))  # on SIGTERM, how long running jobs get to finish
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "5"))
+# Multi-file shares: one status message per share, videos sent as albums
+BATCH_DELIVERY = os.getenv("BATCH_DELIVERY", "1").lower() in ("1", "true", "yes")
+ALBUM_SIZE = 10  # Telegram's media group limit
+ALBUM_WINDOW = float(os.getenv("ALBUM_WINDOW", "20"))  # seconds a partial album waits for more files
+ALBUM_UPLOAD_TIMEOUT = int(os.getenv("ALBUM_UPLOAD_TIMEOUT", "3600"))
+BATCH_STATUS_LINES = 25
 pending_auth = {}
+# Process-local snapshot of the global config and admin set
+config_cache = {}
+admin_ids = set()
+cache_state = {"admins_loaded": False}
+CONFIG_POLL_INTERVAL = int(os.getenv("CONFIG_POLL_INTERVAL", "30"))
+background_tasks = []
+metrics_runner = None
+# Single-flight registry: file identity -> requesters waiting on the running download
+inflight_files = {}
+# File identity -> future resolved once the running download has been delivered
+file_done = {}
+# Spool path -> duration/width/height/thumbnail read from the downloaded file
+video_attributes = {}
 
-async def get_config():
+async def load_config():
     config = await config_col.find_one({"_id": "global"})
     if not config:
-        await config_col.insert_one(DEFAULT_CONFIG)
+        config = dict(DEFAULT_CONFIG)
+        await config_col.insert_one(config)
         logger.info("Inserted new global configuration.")
-        return DEFAULT_CONFIG
     needs_update = False
     for key, default_value in DEFAULT_CONFIG.items():
         if key not in config:
@@ -87,14 +155,30 @@ async def get_config():
     if needs_update:
         await config_col.update_one({"_id": "global"}, {"$set": {k: v for k, v in config.items() if k != "_id"}})
         logger.info("Updated existing global configuration with missing keys.")
-    return config
+    config_cache.clear()
+    config_cache.update(config)
+    return config_cache
+
+async def load_admins():
+    ids = {doc["user_id"] async for doc in admins_col.find({}, {"user_id": 1})}
+    admin_ids.clear()
+    admin_ids.update(ids)
+    cache_state["admins_loaded"] = True
+
+async def get_config():
+    # Served from the in-memory snapshot; sync_caches() keeps it fresh
+    if not config_cache:
+        await load_config()
+    return config_cache
 
 async def update_config(update: dict):
     await config_col.update_one({"_id": "global"}, {"$set": update})
+    config_cache.update(update)
 
 async def is_admin(user_id: int) -> bool:
-    admin = await admins_col.find_one({"user_id": user_id})
-    return admin is not None
+    if not cache_state["admins_loaded"]:
+        await load_admins()
+    return user_id in admin_ids
 
 async def add_admin(user_id: int, username: str = None, full_name: str = None):
     await admins_col.update_one(
@@ -107,13 +191,82 @@ async def add_admin(user_id: int, username: str = None, full_name: str = None):
         }},
         upsert=True
     )
+    admin_ids.add(user_id)
+
+async def poll_caches():
+    await load_config()
+    await load_admins()
+
+async def sync_caches():
+    """Keep the config/admin snapshot fresh via a change stream, polling when streams are unavailable."""
+    pipeline = [{"$match": {"ns.coll": {"$in": [config_col.name, admins_col.name]}}}]
+    while True:
+        try:
+            async with db.watch(pipeline) as stream:
+                logger.info("Watching config and admin changes via change stream")
+                # Catch anything written between the initial load and the stream opening
+                await poll_caches()
+                async for change in stream:
+                    if change["ns"]["coll"] == config_col.name:
+                        await load_config()
+                    else:
+                        await load_admins()
+        except asyncio.CancelledError:
+            raise
+        except OperationFailure as e:
+            logger.warning(f"Change streams unavailable ({e.code}), polling config every {CONFIG_POLL_INTERVAL}s")
+            while True:
+                await asyncio.sleep(CONFIG_POLL_INTERVAL)
+                try:
+                    await poll_caches()
+                except PyMongoError as e:
+                    logger.error(f"Config poll failed: {e}")
+        except PyMongoError as e:
+            logger.error(f"Config change stream error: {e}")
+            await asyncio.sleep(CONFIG_POLL_INTERVAL)
+            try:
+                await poll_caches()
+            except PyMongoError as e:
+                logger.error(f"Config poll failed: {e}")
+
+
+async def ensure_indexes():
+    await file_cache_col.create_index([("share_id", 1), ("name", 1), ("size_bytes", 1)], unique=True)
+    await jobs.ensure_indexes()
+    await broadcasts.ensure_indexes()
+
+def share_id(source_url: str) -> str:
+    # Same key for every domain and URL shape of a share: resolver cache, file_id cache, coalescing
+    return share_key(source_url) or source_url
+
+def file_identity(link: dict, source_url: str) -> dict:
+    return {
+        "share_id": share_id(source_url),
+        "name": link.get("name", "unknown"),
+        "size_bytes": link.get("size_bytes", 0),
+    }
+
+async def get_cached_file_id(identity: dict):
+    cached = await file_cache_col.find_one(identity)
+    return cached["file_id"] if cached else None
+
+async def cache_file_id(identity: dict, file_id: str):
+    await file_cache_col.update_one(
+        identity,
+        {"$set": {"file_id": file_id, "cached_at": time.time()}},
+        upsert=True
+    )
+
+async def forget_file_id(identity: dict):
+    await file_cache_col.delete_one(identity)
 
 async def set_bot_commands(user_id: int = None):
     is_user_admin = user_id and await is_admin(user_id)
     if is_user_admin:
         commands = [
             BotCommand(command="start", description="Start the bot"),
-            BotCommand(command="settings", description="Bot Settings (Admin Only)")
+            BotCommand(command="settings", description="Bot Settings (Admin Only)"),
+            BotCommand(command="stats", description="Pipeline Stats (Admin Only)")
         ]
         await bot.set_my_commands(commands, scope=types.BotCommandScopeChat(chat_id=user_id))
     if not user_id:
@@ -127,11 +280,20 @@ async def set_bot_commands(user_id: int = None):
         ]
         await bot.set_my_commands(commands, scope=types.BotCommandScopeChat(chat_id=user_id))
 
-async def get_links(source_url: str):
+async def get_links(source_url: str, need_urls: bool = True, refresh: bool = False):
+    """
+    Resolve a share through the resolver cache. Concurrent requests for the same
+    share make one API call; ``need_urls=False`` accepts a cached file list whose
+    signed URLs have expired and ``refresh=True`` forces a new lookup.
+    """
+    with metrics.GET_LINKS_SECONDS.time():
+        return await resolver.get(source_url, key=share_id(source_url), need_urls=need_urls, refresh=refresh)
+
+async def fetch_links(source_url: str):
     api_url = f"{API_BASE}/api?url={source_url}"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(api_url) as resp:
-            data = await resp.json()
+    session = get_session()
+    async with session.get(api_url, timeout=META_TIMEOUT) as resp:
+        data = await resp.json()
 
     if not data.get("success") or not data.get("files"):
         return None
@@ -143,251 +305,1052 @@ async def get_links(source_url: str):
         links.append({
             "name": f.get("file_name"),
             "size_mb": size_mb,
+            "size_bytes": int(f.get("size_bytes") or size_mb * 1024 * 1024),
             "proxified_url": f.get("proxified_download_url"),  # 🆕 primary URL
             "direct_url": f.get("original_download_url"),                # 🆕 fallback
+            # Only URLs that are there count; a file with none is stale right away
+            "expires_at": min(
+                (signed_url_expiry(url) for url in (f.get("proxified_download_url"), f.get("original_download_url")) if url),
+                default=time.time()
+            ),
         })
     return {"links": links}
 
+resolver = ResolverCache(fetch_links, url_expiry=lambda response: min(l["expires_at"] for l in response["links"]))
+health = SourceHealth()
+
 
-async def download_file(dl_url: str, filename: str, size_mb: float, status_message: Message, attempt: int = 0):
-    path = tempfile.NamedTemporaryFile(delete=False).name
-    downloaded = 0
+def queue_progress_edit(status_message: Message, text: str):
+    """Queue a status edit without waiting; an unsent older edit of the same message is dropped."""
+    chat_id = status_message.chat.id
+
+    async def edit():
+        try:
+            await bot.edit_message_text(
+                chat_id=chat_id,
+                message_id=status_message.message_id,
+                text=text,
+                parse_mode="Markdown"
+            )
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                logger.error(f"Telegram update error: {e}")
+
+    outbox.edit_nowait(chat_id, (chat_id, status_message.message_id), edit)
+
+def progress_reporter(status_message: Message, filename: str, size_mb: float, title: str = "Downloading"):
+    """Build an ``async (downloaded, total)`` callback that renders progress into the status message."""
     start_time = time.time()
-    last_update_time = 0
+
+    async def report_progress(downloaded: int, total: int):
+        total_mb = total / (1024 * 1024) if total else size_mb
+        elapsed = time.time() - start_time
+        speed_bps = (downloaded / elapsed) if elapsed > 0 else 0
+        speed_mbps = speed_bps / (1024 * 1024)
+        percent = (downloaded / (total_mb * 1024 * 1024)) * 100 if total_mb else 0
+        progress_text = (
+            f"📥 **{title}** `{filename}`\n"
+            f"📦 Size: **{total_mb:.2f} MB**\n"
+            f"⬇️ Progress: **{downloaded / (1024 * 1024):.2f}/{total_mb:.2f} MB** (**{percent:.0f}%**)\n"
+            f"⚡ Speed: **{speed_mbps:.2f} MB/s**"
+        )
+        queue_progress_edit(status_message, progress_text)
+
+    return report_progress if status_message else None
+
+async def download_file(dl_url: str, path: str, filename: str, size_mb: float, status_message: Message,
+                        attempt: int = 0, kind: str = "proxified", monitor: dict = None, report=None):
+    # Partial data in ``path`` is kept between attempts so retries only fetch the missing ranges
     logger.info(f"Starting download of {filename} from {dl_url} (attempt {attempt + 1})")
+    resumed_bytes = downloader.completed_bytes(path)
+    start_time = time.monotonic()
+    progress = report or progress_reporter(status_message, filename, size_mb)
+    if monitor is not None:
+        report = progress
+
+        async def progress(downloaded: int, total: int):
+            monitor["downloaded"] = downloaded
+            monitor["at"] = time.monotonic()
+            if report:
+                await report(downloaded, total)
     try:
-        async with sem:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(dl_url) as resp:
-                    if resp.status != 200:
-                        logger.error(f"Download failed for {filename}, status: {resp.status}")
-                        raise Exception(f"HTTP Status {resp.status}")
-                    content_length = int(resp.headers.get('Content-Length', 0))
-                    total_mb = content_length / (1024 * 1024) if content_length else size_mb
-                    async for chunk in resp.content.iter_chunked(5 * 1024 * 1024):
-                        with open(path, 'ab') as f:
-                            f.write(chunk)
-                        downloaded += len(chunk)
-                        if time.time() - last_update_time > 5 and status_message:
-                            elapsed = time.time() - start_time
-                            speed_bps = (downloaded / elapsed) if elapsed > 0 else 0
-                            speed_mbps = speed_bps / (1024 * 1024)
-                            percent = (downloaded / (total_mb * 1024 * 1024)) * 100 if total_mb else 0
-                            progress_text = (
-                                f"📥 **Downloading** `{filename}`\n"
-                                f"📦 Size: **{total_mb:.2f} MB**\n"
-                                f"⬇️ Progress: **{downloaded / (1024 * 1024):.2f}/{total_mb:.2f} MB** (**{percent:.0f}%**)\n"
-                                f"⚡ Speed: **{speed_mbps:.2f} MB/s**"
-                            )
-                            try:
-                                await bot.edit_message_text(
-                                    chat_id=status_message.chat.id,
-                                    message_id=status_message.message_id,
-                                    text=progress_text,
-                                    parse_mode="Markdown"
-                                )
-                                last_update_time = time.time()
-                            except TelegramBadRequest as e:
-                                if "message is not modified" not in str(e):
-                                    logger.error(f"Telegram update error: {e}")
-                    logger.info(f"Download completed for {filename}")
+        await tracked_download(
+            health,
+            kind,
+            dl_url,
+            path,
+            expected_size=int(size_mb * 1024 * 1024),
+            progress=progress,
+        )
+        logger.info(f"Download completed for {filename}")
     except Exception as e:
         logger.error(f"Download error for {filename}: {str(e)}")
-        if os.path.exists(path):
-            os.unlink(path)
+        metrics.DOWNLOAD_BYTES.labels(kind).inc(max(0, downloader.completed_bytes(path) - resumed_bytes))
+        metrics.FAILURES.labels("download_attempt").inc()
         if attempt < 2:
             backoff = 2 ** attempt
             logger.info(f"Retrying download for {filename} after {backoff}s")
             await asyncio.sleep(backoff)
-            return await download_file(dl_url, filename, size_mb, status_message, attempt + 1)
+            return await download_file(dl_url, path, filename, size_mb, status_message, attempt + 1, kind, monitor, report)
         if status_message:
             try:
-                await status_message.edit_text(f"❌ Failed to download `{filename}` after {attempt+1} attempts.", parse_mode="Markdown")
+                await outbox.call(status_message.chat.id, lambda: status_message.edit_text(
+                    f"❌ Failed to download `{filename}` after {attempt+1} attempts.", parse_mode="Markdown"))
             except:
                 pass
         return False, None
-    if status_message:
-        try:
-            await bot.delete_message(status_message.chat.id, status_message.message_id)
-        except:
-            pass
+    fetched = max(0, downloader.completed_bytes(path) - resumed_bytes)
+    metrics.DOWNLOAD_BYTES.labels(kind).inc(fetched)
+    elapsed = time.monotonic() - start_time
+    if fetched and elapsed > 0:
+        metrics.DOWNLOAD_THROUGHPUT.labels(kind).observe(fetched / elapsed)
+    await delete_status_message(status_message)
     return True, path
 
-async def broadcast_video(file_path: str, video_name: str, broadcast_type: str):
+def video_kwargs(file_path: str) -> dict:
+    """
+    send_video / InputMediaVideo fields for a spooled file, so Telegram shows the real length and preview.
+    The thumbnail is always uploaded: aiogram only takes an InputFile there, even in local mode.
+    """
+    attributes = dict(video_attributes.get(file_path, {}))
+    thumb = attributes.pop("thumbnail", None)
+    if thumb:
+        attributes["thumbnail"] = FSInputFile(thumb)
+    return attributes
+
+async def upload_video(chat_id: int, file_path: str, video_name: str, **kwargs):
+    """Upload a spooled file: by local path when the Bot API server can read it, else multipart."""
+    uri = local_api.file_uri(file_path)
+    if uri:
+        try:
+            local_kwargs = {**video_kwargs(file_path), **kwargs}
+            with metrics.UPLOAD_SECONDS.labels("local").time():
+                sent = await outbox.call(chat_id, lambda: bot.send_video(chat_id=chat_id, video=uri, **local_kwargs))
+            local_api.upload_modes["local"] += 1
+            logger.info(f"📤 Sent {video_name} to chat {chat_id} (local path)")
+            return sent
+        except TelegramBadRequest as e:
+            local_api.upload_modes["fallback"] += 1
+            logger.warning(f"Local path upload rejected for {video_name}, falling back to multipart: {str(e)[:100]}")
+    input_file = FSInputFile(file_path, filename=video_name)
+    kwargs = {**video_kwargs(file_path), **kwargs}
+    with metrics.UPLOAD_SECONDS.labels("multipart").time():
+        sent = await outbox.call(chat_id, lambda: bot.send_video(chat_id=chat_id, video=input_file, **kwargs))
+    local_api.upload_modes["multipart"] += 1
+    logger.info(f"📤 Sent {video_name} to chat {chat_id} (multipart)")
+    return sent
+
+async def send_broadcast_copy(bc_chat_id: int, video, video_name: str):
+    # Flood control is handled by the outbox, which re-queues the call
+    return await outbox.call(bc_chat_id, lambda: bot.send_video(chat_id=bc_chat_id, video=video, supports_streaming=True))
+
+class StaleFileId(Exception):
+    """A cached file_id that Telegram no longer accepts."""
+
+async def broadcast_video(identity: dict, file_path: str, video_name: str, broadcast_type: str, file_id: str = None,
+                          check_stale: bool = False):
+    """
+    Broadcast a video to every configured chat, once per file identity. The file is
+    uploaded at most once (skipped entirely when ``file_id`` is given) and the
+    remaining chats receive the captured file_id concurrently. Returns the file_id
+    that was broadcast, or None. With ``check_stale``, a given file_id that every
+    chat rejects raises :class:`StaleFileId` so the caller can download it again.
+    """
     config = await get_config()
     if broadcast_type == 'admin' and not config["admin_broadcast_enabled"]:
         logger.info(f"Admin broadcast disabled - skipping {video_name}")
-        return False
+        return None
     if broadcast_type == 'channel' and not config["channel_broadcast_enabled"]:
         logger.info(f"Channel broadcast disabled - skipping {video_name}")
-        return False
-    if await broadcast_col.find_one({"name": video_name}):
-        logger.info(f"Duplicate broadcast skipped: {video_name}")
-        return False
-    chats = config.get("broadcast_chats", [])
+        return None
+    chats = list(config.get("broadcast_chats", []))
     if not chats:
         logger.warning("No broadcast chats configured")
-        return False
-    broadcast_count = 0
-    for bc_chat_id in chats:
+        return None
+    key = content_key(identity)
+    if not await broadcasts.claim(key):
+        logger.info(f"Duplicate broadcast skipped: {video_name}")
+        return None
+    try:
+        return await fan_out_broadcast(key, chats, file_path, video_name, file_id, check_stale)
+    finally:
+        broadcasts.release(key)
+
+async def fan_out_broadcast(key: str, chats: list, file_path: str, video_name: str, file_id: str = None,
+                            check_stale: bool = False):
+    """Send to every chat under a claimed ledger key and record the per-chat outcome."""
+    results = {}
+    known_file_id = file_id
+    rejected = set()
+    # Upload once; try the next chat as uploader if one rejects the file
+    while not file_id and chats:
+        bc_chat_id = chats.pop(0)
         try:
-            input_file = FSInputFile(file_path, filename=video_name)
-            await bot.send_video(chat_id=bc_chat_id, video=input_file, supports_streaming=True)
-            await broadcast_col.insert_one({"name": video_name, "chat_id": bc_chat_id, "timestamp": time.time()})
-            broadcast_count += 1
+            sent = await upload_video(bc_chat_id, file_path, video_name, supports_streaming=True)
+            results[bc_chat_id] = None
+            file_id = sent.video.file_id if sent.video else None
             logger.info(f"📤 Broadcasted {video_name} to chat {bc_chat_id}")
         except Exception as e:
+            results[bc_chat_id] = str(e)[:100]
+            metrics.FAILURES.labels("broadcast").inc()
             logger.error(f"❌ Broadcast failed for chat {bc_chat_id}: {str(e)[:100]}")
+    if not file_id:
+        chats = []
+
+    limiter = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def fan_out(bc_chat_id: int):
+        async with limiter:
+            try:
+                await send_broadcast_copy(bc_chat_id, file_id, video_name)
+                results[bc_chat_id] = None
+                logger.info(f"📤 Broadcasted {video_name} to chat {bc_chat_id}")
+            except Exception as e:
+                results[bc_chat_id] = str(e)[:100]
+                if isinstance(e, TelegramBadRequest):
+                    rejected.add(bc_chat_id)
+                metrics.FAILURES.labels("broadcast").inc()
+                logger.error(f"❌ Broadcast failed for chat {bc_chat_id}: {str(e)[:100]}")
+
+    await asyncio.gather(*(fan_out(bc_chat_id) for bc_chat_id in chats))
+
+    await broadcasts.record(key, video_name, results)
+    broadcast_count = sum(1 for error in results.values() if error is None)
     if broadcast_count > 0:
-        logger.info(f"✅ Broadcast complete: {broadcast_count}/{len(chats)} chats")
-        return True
-    return False
+        logger.info(f"✅ Broadcast complete: {broadcast_count}/{len(results)} chats")
+        return file_id
+    if check_stale and known_file_id and chats and len(rejected) == len(chats):
+        metrics.FAILURES.labels("stale_file_id").inc()
+        raise StaleFileId(f"file_id rejected by all {len(chats)} broadcast chat(s)")
+    return None
+
+async def broadcast_for_source(source_type: str, config: dict, identity: dict, file_path: str, video_name: str, file_id: str = None,
+                               check_stale: bool = False):
+    if source_type == "admin":
+        return await broadcast_video(identity, file_path, video_name, 'admin', file_id=file_id, check_stale=check_stale)
+    elif source_type == "channel" and config["channel_broadcast_enabled"]:
+        return await broadcast_video(identity, file_path, video_name, 'channel', file_id=file_id, check_stale=check_stale)
+    return None
 
 async def send_video_to_user(file_path: str, video_name: str, chat_id: int, reply_to_message_id: int = None):
+    """Upload the video and return its Telegram file_id (None on failure)."""
     try:
-        input_file = FSInputFile(file_path, filename=video_name)
-        await bot.send_video(
-            chat_id=chat_id,
-            video=input_file,
+        sent = await upload_video(
+            chat_id,
+            file_path,
+            video_name,
             supports_streaming=True,
             caption=video_name,
             reply_to_message_id=reply_to_message_id,
             parse_mode="Markdown"
         )
-        logger.info(f"📤 Sent {video_name} to chat {chat_id}")
-        return True
+        return sent.video.file_id if sent.video else None
     except Exception as e:
+        metrics.FAILURES.labels("upload").inc()
         logger.error(f"❌ Failed to send to chat {chat_id}: {str(e)[:100]}")
-        await bot.send_message(chat_id, f"❌ Failed to send `{video_name}`: {str(e)[:100]}", parse_mode="Markdown")
+        await outbox.call(chat_id, lambda: bot.send_message(chat_id, f"❌ Failed to send `{video_name}`: {str(e)[:100]}", parse_mode="Markdown"))
+        return None
+
+async def send_cached_video(file_id: str, video_name: str, chat_id: int, reply_to_message_id: int = None):
+    try:
+        await outbox.call(chat_id, lambda: bot.send_video(
+            chat_id=chat_id,
+            video=file_id,
+            supports_streaming=True,
+            caption=video_name,
+            reply_to_message_id=reply_to_message_id,
+            parse_mode="Markdown"
+        ))
+        logger.info(f"⚡ Sent cached {video_name} to chat {chat_id}")
+        return True
+    except TelegramBadRequest as e:
+        metrics.FAILURES.labels("stale_file_id").inc()
+        logger.warning(f"Cached file_id rejected for {video_name}: {str(e)[:100]}")
         return False
 
+async def delete_status_message(status_message: Message):
+    if status_message:
+        try:
+            await outbox.call(status_message.chat.id, lambda: bot.delete_message(status_message.chat.id, status_message.message_id))
+        except:
+            pass
+
+async def notify_failure(requester: dict, config: dict, text: str):
+    if requester["batch"]:
+        # Shown in the share's status message instead of a message of its own
+        requester["batch"].fail(requester["batch_file"], text)
+        return
+    if requester["status_message"] or requester["source_type"] != "channel" or config["channel_broadcast_enabled"]:
+        await outbox.call(requester["chat_id"], lambda: bot.send_message(requester["chat_id"], text, parse_mode="Markdown"))
+
+async def deliver_video(requester: dict, name: str, config: dict, identity: dict, file_path: str, file_id: str = None):
+    """Deliver a downloaded file to one requester, reusing ``file_id`` when given; returns the file_id to reuse."""
+    source_type = requester["source_type"]
+    reply_to_message_id = requester["reply_to_message_id"]
+    if source_type == "user" or source_type == "admin":
+        if not (file_id and await send_cached_video(file_id, name, requester["chat_id"], reply_to_message_id)):
+            file_id = await send_video_to_user(file_path, name, requester["chat_id"], reply_to_message_id=reply_to_message_id)
+            if file_id:
+                await cache_file_id(identity, file_id)
+    broadcast_file_id = await broadcast_for_source(source_type, config, identity, file_path, name, file_id=file_id)
+    if broadcast_file_id and not file_id:
+        file_id = broadcast_file_id
+        await cache_file_id(identity, file_id)
+    return file_id
+
+class ShareBatch:
+    """
+    Delivery state of a multi-file share: one status message listing every
+    file, and finished videos collected into albums of up to ``ALBUM_SIZE``.
+
+    An album goes out once it is full, once no file of the share is still
+    downloading, or when the spool has reservations waiting for the disk the
+    collected files hold; a partial album never waits longer than
+    ``ALBUM_WINDOW`` seconds. ``finished`` resolves when every file is
+    delivered or has failed.
+    """
+    ICONS = {"queued": "⏳", "waiting": "⏳", "downloading": "📥", "uploading": "📤", "done": "✅", "failed": "❌"}
+
+    def __init__(self, chat_id: int, reply_to_message_id: int, links: list):
+        self.chat_id = chat_id
+        self.reply_to_message_id = reply_to_message_id
+        self.files = [
+            {"name": link.get("name", "unknown"), "state": "queued", "downloaded": 0,
+             "total": link.get("size_bytes", 0), "error": None}
+            for link in links
+        ]
+        self.status_message = None
+        self.pending = []
+        self.window = None
+        self.lock = asyncio.Lock()
+        self.tasks = set()
+        self.started = time.time()
+        self.finished = asyncio.get_running_loop().create_future()
+
+    async def open(self):
+        self.status_message = await outbox.call(self.chat_id, lambda: bot.send_message(
+            self.chat_id, self.render(), parse_mode="Markdown", reply_to_message_id=self.reply_to_message_id))
+
+    def render(self) -> str:
+        count = len(self.files)
+        delivered = sum(1 for f in self.files if f["state"] == "done")
+        failed = [f for f in self.files if f["state"] == "failed"]
+        if delivered + len(failed) == count:
+            text = f"✅ **Delivered {delivered}/{count} videos**"
+            if failed:
+                text += "\n" + "\n".join(f"❌ `{f['name']}`" for f in failed[:BATCH_STATUS_LINES])
+            return text
+
+        total = sum(f["total"] for f in self.files)
+        downloaded = sum(f["total"] if f["state"] in ("uploading", "done") else f["downloaded"] for f in self.files)
+        fetched = sum(f["downloaded"] for f in self.files)
+        elapsed = time.time() - self.started
+        speed_mbps = fetched / elapsed / (1024 * 1024) if elapsed > 0 else 0
+        percent = downloaded / total * 100 if total else 0
+        lines = [f"📦 **{count} videos** · {delivered} sent" + (f" · {len(failed)} failed" if failed else "")]
+        for f in self.files[:BATCH_STATUS_LINES]:
+            line = f"{self.ICONS[f['state']]} `{f['name']}`"
+            if f["state"] == "downloading" and f["total"]:
+                line += f" {f['downloaded'] / f['total'] * 100:.0f}%"
+            lines.append(line)
+        if count > BATCH_STATUS_LINES:
+            lines.append(f"… and {count - BATCH_STATUS_LINES} more")
+        lines.append(
+            f"⬇️ **{downloaded / (1024 * 1024):.2f}/{total / (1024 * 1024):.2f} MB** (**{percent:.0f}%**) "
+            f"⚡ **{speed_mbps:.2f} MB/s**"
+        )
+        return "\n".join(lines)
+
+    def refresh(self):
+        if self.status_message:
+            queue_progress_edit(self.status_message, self.render())
+
+    def set_state(self, index: int, state: str):
+        self.files[index]["state"] = state
+        self.refresh()
+
+    def progress(self, index: int):
+        """``async (downloaded, total)`` download callback for file ``index``."""
+        async def report_progress(downloaded: int, total: int):
+            entry = self.files[index]
+            entry["downloaded"] = downloaded
+            entry["total"] = total or entry["total"]
+            entry["state"] = "downloading"
+            self.refresh()
+
+        return report_progress
+
+    def outstanding(self) -> int:
+        return sum(1 for f in self.files if f["state"] in ("queued", "waiting", "downloading"))
+
+    def fail(self, index: int, error: str):
+        self.files[index]["error"] = error
+        self.settle(index, False)
+
+    def settle(self, index: int, ok: bool):
+        self.set_state(index, "done" if ok else "failed")
+        self._kick()
+
+    def _due(self) -> bool:
+        return bool(self.pending) and (len(self.pending) >= ALBUM_SIZE or not self.outstanding() or bool(spool.waiters))
+
+    def _queue(self, job: dict):
+        self.pending.append(job)
+        self.set_state(job["requester"]["batch_file"], "uploading")
+        if self.window is None and not self._due():
+            self.window = asyncio.create_task(self._flush_later())
+
+    async def add(self, job: dict):
+        """Collect a finished file; sends the album from the calling upload worker once it is due."""
+        self._queue(job)
+        if self._due():
+            await self.flush()
+
+    def add_nowait(self, job: dict):
+        """Like :meth:`add` for callers outside the upload stage; a due album is sent from a task."""
+        self._queue(job)
+        self._kick()
+
+    def refetch(self, job: dict):
+        """Download a file again whose cached file_id was rejected; from a task, so no upload worker waits on the download stage."""
+        index = job["requester"]["batch_file"]
+        self.set_state(index, "queued")
+
+        async def run():
+            try:
+                await process_file(job["link"], job["source_url"], self.chat_id, job["requester"]["source_type"],
+                                   reply_to_message_id=self.reply_to_message_id, batch=self, batch_file=index)
+            except Exception as e:
+                self.fail(index, f"❌ Error processing `{job['name']}`: {str(e)[:100]}")
+
+        task = asyncio.create_task(run())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _kick(self):
+        if self._due():
+            task = asyncio.create_task(self.flush())
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        self._maybe_finish()
+
+    async def _flush_later(self):
+        await asyncio.sleep(ALBUM_WINDOW)
+        self.window = None
+        await self.flush()
+
+    async def flush(self):
+        """Send everything collected so far; only the first album is sent regardless of being due."""
+        async with self.lock:
+            if self.window:
+                self.window.cancel()
+                self.window = None
+            while self.pending:
+                items, self.pending = self.pending[:ALBUM_SIZE], self.pending[ALBUM_SIZE:]
+                try:
+                    await send_album(self, items)
+                except Exception as e:
+                    # send_album settles what it got to; nothing of this album may stay "uploading"
+                    for job in items:
+                        if self.files[job["requester"]["batch_file"]]["state"] == "uploading":
+                            self.fail(job["requester"]["batch_file"], str(e)[:100])
+                if not self._due():
+                    break
+            if self.pending and self.window is None:
+                self.window = asyncio.create_task(self._flush_later())
+        self._maybe_finish()
+
+    def _maybe_finish(self):
+        if not self.finished.done() and all(f["state"] in ("done", "failed") for f in self.files):
+            self.finished.set_result(None)
+            self.refresh()
+
+async def send_album(batch: ShareBatch, items: list):
+    """Send finished files of a share as one media group, falling back to one message each."""
+    if len(items) > 1:
+        try:
+            media = []
+            for job in items:
+                extra = {}
+                if job.get("file_id"):
+                    video = job["file_id"]
+                else:
+                    video = local_api.file_uri(job["file_path"]) or FSInputFile(job["file_path"], filename=job["name"])
+                    extra = video_kwargs(job["file_path"])
+                media.append(InputMediaVideo(media=video, caption=job["name"], parse_mode="Markdown", supports_streaming=True, **extra))
+            with metrics.UPLOAD_SECONDS.labels("album").time():
+                sent = await outbox.call(batch.chat_id, lambda: bot.send_media_group(
+                    chat_id=batch.chat_id,
+                    media=media,
+                    reply_to_message_id=batch.reply_to_message_id,
+                    request_timeout=ALBUM_UPLOAD_TIMEOUT
+                ))
+            for job, message in zip(items, sent):
+                job["delivered"] = True
+                if message.video and not job.get("file_id"):
+                    job["file_id"] = message.video.file_id
+                    job["cache_file_id"] = True
+            logger.info(f"📤 Sent album of {len(items)} to chat {batch.chat_id}")
+        except Exception as e:
+            metrics.FAILURES.labels("album").inc()
+            logger.warning(f"Album of {len(items)} rejected for chat {batch.chat_id}, sending one by one: {str(e)[:100]}")
+    # Broadcasts, coalesced waiters and spool cleanup; sends whatever the album did not deliver
+    for job in items:
+        file_id = None
+        try:
+            # Outside the album's try: a failure here must not send delivered items again
+            if job.pop("cache_file_id", False):
+                try:
+                    await cache_file_id(job["identity"], job["file_id"])
+                except Exception as e:
+                    logger.warning(f"Could not cache file_id of {job['name']}: {str(e)[:100]}")
+            file_id = await complete_upload(job)
+        except Exception as e:
+            metrics.FAILURES.labels("pipeline").inc()
+            logger.error(f"Error completing {job['name']}: {str(e)[:100]}")
+        finally:
+            if not job.get("requeued"):
+                batch.settle(job["requester"]["batch_file"], bool(file_id or job.get("delivered")))
+
 async def process_file(link: dict, source_url: str, original_chat_id: int = None,
                        source_type: str = "user", status_message: Message = None,
-                       original_message: Message = None):
+                       reply_to_message_id: int = None, batch: "ShareBatch" = None, batch_file: int = None):
+    """
+    Deliver one file of a share. Returns a future that resolves once the file has
+    been delivered (or has failed), or None when nothing was left running.
+    Files of a ``batch`` report into its status message and are sent as albums.
+    """
     name = link.get("name", "unknown")
     size_mb = link.get("size_mb", 0)
     size_gb = size_mb / 1024
     logger.info(f"Processing file: {name}, size: {size_mb} MB, source: {source_type}")
 
     config = await get_config()
+    requester = {
+        "chat_id": original_chat_id,
+        "source_type": source_type,
+        "status_message": status_message,
+        "reply_to_message_id": reply_to_message_id,
+        "batch": batch,
+        "batch_file": batch_file,
+    }
 
+    if batch:
+        if size_gb > 2:
+            batch.fail(batch_file, f"too large ({size_gb:.2f} GB, max 2 GB)")
+            return
     # Notify user before download
-    if status_message and source_type != "channel":
+    elif status_message and source_type != "channel":
         if size_gb > 2:
-            await status_message.edit_text(
+            await outbox.call(original_chat_id, lambda: status_message.edit_text(
                 f"❌ File `{name}` is too large (**{size_gb:.2f} GB**). Max 2 GB.",
                 parse_mode="Markdown",
-            )
+            ))
             return
         if not name.lower().endswith(('.mp4', '.mkv', '.avi', '.mov', '.webm')):
-            await status_message.edit_text(
+            await outbox.call(original_chat_id, lambda: status_message.edit_text(
                 f"ℹ️ Skipped non-video file: `{name}`. Only video files are processed.",
                 parse_mode="Markdown",
-            )
+            ))
             return
-        await status_message.edit_text(f"📥 Found: `{name}`. Starting download...", parse_mode="Markdown")
+        queue_progress_edit(status_message, f"📥 Found: `{name}`. Starting download...")
+
+    # Re-send a previously uploaded copy instead of downloading again
+    identity = file_identity(link, source_url)
+    cached_file_id = await get_cached_file_id(identity)
+    if cached_file_id and batch:
+        batch.add_nowait(cached_item(requester, name, identity, cached_file_id, link, source_url))
+        return
+    if cached_file_id:
+        delivered = True
+        if source_type == "user" or source_type == "admin":
+            delivered = await send_cached_video(
+                cached_file_id,
+                name,
+                original_chat_id,
+                reply_to_message_id=reply_to_message_id
+            )
+        if delivered:
+            try:
+                # A channel post has no requester to try the file_id on, so the broadcast does
+                await broadcast_for_source(source_type, config, identity, None, name, file_id=cached_file_id,
+                                           check_stale=source_type == "channel")
+                await delete_status_message(status_message)
+                return
+            except StaleFileId as e:
+                logger.warning(f"Cached file_id rejected for {name}: {e}")
+        await forget_file_id(identity)
+
+    # Attach to an identical download that is already running
+    key = (identity["share_id"], identity["name"], identity["size_bytes"])
+    if key in inflight_files:
+        logger.info(f"Coalescing {name} for {source_type} {original_chat_id} onto in-flight download")
+        inflight_files[key].append(requester)
+        if batch:
+            batch.set_state(batch_file, "waiting")
+        elif status_message:
+            queue_progress_edit(status_message, f"⏳ `{name}` is already downloading for another request. Waiting...")
+        return file_done.get(key)
+    inflight_files[key] = []
+    done = file_done[key] = asyncio.get_running_loop().create_future()
+    await download_stage.put({
+        "link": link,
+        "source_url": source_url,
+        "name": name,
+        "size_mb": size_mb,
+        "identity": identity,
+        "key": key,
+        "requester": requester,
+    })
+    return done
+
+async def stream_to_requester(job: dict, link: dict):
+    """
+    Pipe the file from TeraBox straight into send_video without spooling.
+    Returns (streamed, file_id); streamed=False means the caller should spool instead.
+    """
+    name = job["name"]
+    requester = job["requester"]
+    chat_id = requester["chat_id"]
+    reply_to_message_id = requester["reply_to_message_id"]
+    dl_url = link.get("proxified_url") or link.get("direct_url")
+    if not dl_url:
+        return False, None
+
+    async def send(video):
+        return await outbox.call(chat_id, lambda: bot.send_video(
+            chat_id=chat_id,
+            video=video,
+            supports_streaming=True,
+            caption=name,
+            reply_to_message_id=reply_to_message_id,
+            parse_mode="Markdown",
+            request_timeout=STREAM_UPLOAD_TIMEOUT
+        ))
+
+    try:
+        with metrics.UPLOAD_SECONDS.labels("stream").time():
+            sent = await stream_upload(
+                dl_url,
+                name,
+                send,
+                progress=progress_reporter(requester["status_message"], name, job["size_mb"], title="Streaming"),
+            )
+    except StreamUnavailable as e:
+        logger.info(f"Streaming not possible for {name} ({e}), spooling instead")
+        return False, None
+    except Exception as e:
+        metrics.FAILURES.labels("stream").inc()
+        logger.warning(f"Streaming upload of {name} failed, spooling instead: {str(e)[:100]}")
+        return False, None
+    logger.info(f"📤 Sent {name} to chat {chat_id} (streamed)")
+    await delete_status_message(requester["status_message"])
+    file_id = sent.video.file_id if sent.video else None
+    if file_id:
+        await cache_file_id(job["identity"], file_id)
+    return True, file_id
+
+async def download_hedged(job: dict, kind: str, dl_url: str, alternate, reservation):
+    """
+    Download from ``dl_url`` into the job's spool file. With HEDGE_DOWNLOADS, if
+    the source is still below HEDGE_FLOOR after HEDGE_AFTER seconds, the
+    ``alternate`` (kind, url) races it into a second spool file and the loser is
+    cancelled. Returns (success, file_path, reservation backing the file).
+    """
+    name = job["name"]
+    size_mb = job["size_mb"]
+    requester = job["requester"]
+    status_message = requester["status_message"]
+    report = requester["batch"].progress(requester["batch_file"]) if requester["batch"] else None
+    monitor = {}
+    baseline = downloader.completed_bytes(reservation.path)
+    started = time.monotonic()
+    primary = asyncio.create_task(
+        download_file(dl_url, reservation.path, name, size_mb, status_message, kind=kind, monitor=monitor, report=report))
+    hedge_reservation = None
+    winner = None
+    pending = {primary}
+    try:
+        if HEDGE_DOWNLOADS and alternate:
+            await asyncio.wait(pending, timeout=HEDGE_AFTER)
+        if not primary.done():
+            elapsed = monitor.get("at", started) - started
+            rate = max(0, monitor.get("downloaded", baseline) - baseline) / elapsed if elapsed > 0 else 0
+            if HEDGE_DOWNLOADS and alternate and rate < HEDGE_FLOOR:
+                hedge_reservation = spool.try_reserve(reservation.size, name)
+                if not hedge_reservation:
+                    logger.info(f"No spool room to hedge {name}, staying on {kind}")
+            if hedge_reservation:
+                alt_kind, alt_url = alternate
+                logger.info(f"{kind.capitalize()} source for {name} at {rate / (1024 * 1024):.2f} MB/s, hedging with {alt_kind}")
+                pending.add(asyncio.create_task(
+                    download_file(alt_url, hedge_reservation.path, name, size_mb, None, kind=alt_kind)))
+        # First source to finish successfully wins; a failed one leaves the race to the other
+        while pending and not winner:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = next((task for task in done if task.result()[0]), None)
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if hedge_reservation and (winner is None or winner is primary):
+            hedge_reservation.release()
+    if winner is None:
+        return False, None, reservation
+    if hedge_reservation:
+        metrics.HEDGES.labels("primary" if winner is primary else "hedge").inc()
+    if winner is primary:
+        return True, reservation.path, reservation
+    logger.info(f"Hedged {alternate[0]} download of {name} finished first")
+    reservation.release()
+    await delete_status_message(status_message)
+    return True, hedge_reservation.path, hedge_reservation
+
+async def download_job(job: dict):
+    """Download stage: fetch the file, then hand it to the upload stage."""
+    link = job["link"]
+    source_url = job["source_url"]
+    name = job["name"]
+    size_mb = job["size_mb"]
+    key = job["key"]
+    requester = job["requester"]
+    status_message = requester["status_message"]
+    config = await get_config()
+    if requester["batch"]:
+        requester["batch"].set_state(requester["batch_file"], "downloading")
 
     file_path = None
     new_link = None
+    handed_off = False
+    reservation = job["reservation"] = None
 
-    async with sem:
-        try:
-            for attempt in range(4):
-                # Attempt sequence: proxified → direct → refreshed proxified → refreshed direct
-                if attempt == 0:
-                    dl_url = link.get("proxified_url")
-                    label = "proxified"
-                elif attempt == 1:
-                    dl_url = link.get("direct_url")
-                    label = "direct fallback"
-                elif attempt == 2:
-                    logger.info(f"Refreshing links for {name}")
-                    new_resp = await get_links(source_url)
-                    if not new_resp or "links" not in new_resp:
-                        logger.error(f"Failed to refresh links for {name}")
-                        break
-                    new_link = next((l for l in new_resp["links"] if l.get("name") == name), None)
-                    if not new_link:
-                        logger.error(f"File {name} not found in refreshed links")
-                        break
-                    dl_url = new_link.get("proxified_url")
-                    label = "refreshed proxified"
-                elif attempt == 3 and new_link:
-                    dl_url = new_link.get("direct_url")
-                    label = "refreshed direct"
-                else:
-                    break
+    try:
+        # The file list may have come from cache with expired signed URLs
+        if link.get("expires_at", 0) <= time.time():
+            fresh_resp = await get_links(source_url)
+            link = next((l for l in (fresh_resp or {}).get("links", []) if l.get("name") == name), link)
+
+        # Album members need a spooled file, streaming only serves single sends
+        if STREAM_UPLOADS and not requester["batch"] and (requester["source_type"] == "user" or requester["source_type"] == "admin"):
+            streamed, file_id = await stream_to_requester(job, link)
+            if streamed:
+                job["delivered"] = True
+                job["file_id"] = file_id
+                await upload_stage.put(job)
+                handed_off = True
+                return
+
+        # Waits here while the disk budget is used up. One spool path per file:
+        # every URL attempt resumes into the same partial download.
+        reservation = job["reservation"] = await spool.reserve(link.get("size_bytes", 0), name)
 
-                if not dl_url:
-                    logger.warning(f"⚠️ Missing URL for {label} attempt of {name}")
-                    continue
+        for refreshed in (False, True):
+            if refreshed:
+                logger.info(f"Refreshing links for {name}")
+                new_resp = await get_links(source_url, refresh=True)
+                if not new_resp or "links" not in new_resp:
+                    logger.error(f"Failed to refresh links for {name}")
+                    break
+                new_link = next((l for l in new_resp["links"] if l.get("name") == name), None)
+                if not new_link:
+                    logger.error(f"File {name} not found in refreshed links")
+                    break
+                link = new_link
+            # Best-scoring source first; proxified → direct until there is data to go on
+            candidates = health.rank(
+                [("proxified", link.get("proxified_url")), ("direct", link.get("direct_url"))],
+                link.get("size_bytes", 0),
+            )
+            if not candidates:
+                logger.warning(f"⚠️ No download URLs for {name}")
+                continue
 
+            for i, (kind, dl_url) in enumerate(candidates):
+                label = f"refreshed {kind}" if refreshed else kind
                 logger.info(f"Attempting {label} download for {name}")
-                success, file_path = await download_file(dl_url, name, size_mb, status_message)
+                alternate = candidates[i + 1] if i + 1 < len(candidates) else None
+                success, file_path, reservation = await download_hedged(job, kind, dl_url, alternate, reservation)
+                job["reservation"] = reservation
+                if success and not downloader.verify(file_path):
+                    metrics.FAILURES.labels("verify").inc()
+                    logger.warning(f"Size check failed for {name}, missing ranges will be re-fetched")
+                    success, file_path = False, None
                 if success:
                     break
                 logger.warning(f"{label.capitalize()} failed for {name}, retrying...")
+            if file_path:
+                break
 
-            if not file_path:
-                logger.error(f"File {name} failed to download after all retries")
-                if status_message or source_type != "channel" or config["channel_broadcast_enabled"]:
-                    await bot.send_message(
-                        original_chat_id,
-                        f"❌ Failed to download `{name}` from `{source_url}` after all attempts.",
-                        parse_mode="Markdown"
-                    )
-                return
+        if not file_path:
+            metrics.FAILURES.labels("download").inc()
+            logger.error(f"File {name} failed to download after all retries")
+            for r in [requester] + inflight_files.pop(key, []):
+                await notify_failure(r, config, f"❌ Failed to download `{name}` from `{source_url}` after all attempts.")
+            return
 
-            # Send video to appropriate destination
-            if source_type == "user" or source_type == "admin":
-                await send_video_to_user(
-                    file_path,
-                    name,
-                    original_chat_id,
-                    reply_to_message_id=original_message.message_id if original_message else None
-                )
-            if source_type == "admin":
-                await broadcast_video(file_path, name, 'admin')
-            elif source_type == "channel" and config["channel_broadcast_enabled"]:
-                await broadcast_video(file_path, name, 'channel')
+        job["file_path"] = file_path
+        try:
+            # Moves moov to the front and reads duration/size/thumbnail, off the event loop
+            meta = await mp4meta.inspect(file_path)
+        except mp4meta.Mp4Error as e:
+            metrics.FAILURES.labels("remux").inc()
+            logger.error(f"Giving up on {name}: {e}")
+            for r in [requester] + inflight_files.pop(key, []):
+                await notify_failure(r, config, f"❌ Failed to prepare `{name}` for upload.")
+            return
+        if meta.get("faststart"):
+            # The bytes moved, the old ranges no longer describe the file
+            size = os.path.getsize(file_path)
+            downloader.save_manifest(file_path, size, [(0, size - 1)])
+            metrics.REMUXES.inc()
+        video_attributes[file_path] = {k: meta[k] for k in ("duration", "width", "height", "thumbnail") if meta.get(k)}
+        # Waits while the upload stage is saturated, which holds back further downloads
+        await upload_stage.put(job)
+        handed_off = True
 
-        except Exception as e:
-            logger.error(f"Error processing {name}: {str(e)}")
-            if status_message or source_type != "channel" or config["channel_broadcast_enabled"]:
-                await bot.send_message(
-                    original_chat_id,
-                    f"❌ Error processing `{name}`: {str(e)[:100]}",
-                    parse_mode="Markdown"
-                )
-        finally:
-            if file_path and os.path.exists(file_path):
-                logger.debug(f"Cleaning up temporary file: {file_path}")
-                os.unlink(file_path)
+    except Exception as e:
+        metrics.FAILURES.labels("pipeline").inc()
+        logger.error(f"Error processing {name}: {str(e)}")
+        for r in [requester] + inflight_files.pop(key, []):
+            await notify_failure(r, config, f"❌ Error processing `{name}`: {str(e)[:100]}")
+    finally:
+        if not handed_off:
+            inflight_files.pop(key, None)
+            finish_file(key)
+            video_attributes.pop(file_path, None)
+            if reservation:
+                logger.debug(f"Cleaning up temporary file: {reservation.path}")
+                reservation.release()
 
+async def upload_job(job: dict):
+    """Upload stage: deliver a downloaded file to its requester and every coalesced waiter."""
+    batch = job["requester"]["batch"]
+    if batch and not job.get("delivered"):
+        # Goes out with the share's next album; whoever sends it completes the job
+        await batch.add(job)
+        return
+    await complete_upload(job)
 
+async def complete_upload(job: dict):
+    """
+    Deliver a finished file to its requester (unless an album or stream already
+    did), broadcast it, serve coalesced waiters and free its spool file.
+    Returns the file_id, or None when the requester could not be served.
+    """
+    name = job["name"]
+    key = job["key"]
+    identity = job["identity"]
+    requester = job["requester"]
+    file_path = job.get("file_path")
+    file_id = job.get("file_id")
+    config = await get_config()
+    try:
+        # Send video to appropriate destination
+        if job.get("delivered"):
+            # The requester already has it, only broadcasts remain
+            await broadcast_for_source(requester["source_type"], config, identity, file_path, name, file_id=file_id)
+        elif not file_path:
+            # A cached copy whose album failed
+            if await send_cached_video(file_id, name, requester["chat_id"], requester["reply_to_message_id"]):
+                await broadcast_for_source(requester["source_type"], config, identity, None, name, file_id=file_id)
+            else:
+                await forget_file_id(identity)
+                file_id = None
+                if job.get("link"):
+                    # Stale file_id: download the file again, as a single cached send does
+                    job["requeued"] = True
+                    requester["batch"].refetch(job)
+        else:
+            file_id = await deliver_video(requester, name, config, identity, file_path)
+
+        # Later requests hit the file_id cache; everyone who attached meanwhile is served now
+        waiters = inflight_files.pop(key, [])
+        if waiters:
+            logger.info(f"Delivering {name} to {len(waiters)} coalesced request(s)")
+        for waiter in waiters:
+            if waiter["batch"] and file_id:
+                waiter["batch"].add_nowait(cached_item(waiter, name, identity, file_id))
+                continue
+            await delete_status_message(waiter["status_message"])
+            waiter_file_id = await deliver_video(waiter, name, config, identity, file_path, file_id)
+            if waiter["batch"]:
+                waiter["batch"].settle(waiter["batch_file"], waiter_file_id is not None)
+            file_id = waiter_file_id or file_id
+        return file_id
+
+    except Exception as e:
+        metrics.FAILURES.labels("pipeline").inc()
+        logger.error(f"Error processing {name}: {str(e)}")
+        for r in [requester] + inflight_files.pop(key, []):
+            await notify_failure(r, config, f"❌ Error processing `{name}`: {str(e)[:100]}")
+    finally:
+        inflight_files.pop(key, None)
+        finish_file(key)
+        video_attributes.pop(file_path, None)
+        if job.get("reservation"):
+            logger.debug(f"Cleaning up temporary file: {job['reservation'].path}")
+            job["reservation"].release()
 
+def cached_item(requester: dict, name: str, identity: dict, file_id: str, link: dict = None, source_url: str = None) -> dict:
+    """
+    Upload-stage job for a file that only needs its known file_id sent; with
+    ``link`` and ``source_url`` it is downloaded again if the file_id is stale.
+    """
+    return {"name": name, "key": None, "identity": identity, "requester": requester, "file_id": file_id,
+            "link": link, "source_url": source_url}
 
-async def process_url(source_url: str, chat_id: int, source_type: str = "user", original_message: Message = None):
+def finish_file(key):
+    done = file_done.pop(key, None)
+    if done and not done.done():
+        done.set_result(None)
+
+async def process_url(source_url: str, chat_id: int, source_type: str = "user", reply_to_message_id: int = None):
+    """Route every video of a share into the pipeline; returns futures for the files still running."""
     logger.info(f"Processing URL: {source_url} from {source_type} {chat_id}")
     config = await get_config()
-    response = await get_links(source_url)
+    response = await get_links(source_url, need_urls=False)
     if not response or "links" not in response:
+        metrics.FAILURES.labels("resolve").inc()
         logger.error(f"Failed to retrieve links for {source_url}")
         if source_type != "channel" or config["channel_broadcast_enabled"]:
-            await bot.send_message(chat_id, f"❌ Failed to retrieve links for `{source_url}`", parse_mode="Markdown")
-        return
+            await outbox.call(chat_id, lambda: bot.send_message(chat_id, f"❌ Failed to retrieve links for `{source_url}`", parse_mode="Markdown"))
+        return []
     links = [link for link in response["links"] if link.get("name", "").lower().endswith(('.mp4', '.mkv', '.avi', '.mov', '.webm'))]
     if not links:
         logger.info(f"No video files found for {source_url}")
         if source_type != "channel" or config["channel_broadcast_enabled"]:
-            await bot.send_message(chat_id, f"⚠️ No video files found in `{source_url}`", parse_mode="Markdown")
-        return
-    for link in links:
+            await outbox.call(chat_id, lambda: bot.send_message(chat_id, f"⚠️ No video files found in `{source_url}`", parse_mode="Markdown"))
+        return []
+    batch = None
+    if BATCH_DELIVERY and len(links) > 1 and (source_type == "user" or source_type == "admin"):
+        # One status message for the whole share, videos delivered as albums
+        batch = ShareBatch(chat_id, reply_to_message_id, links)
+        await batch.open()
+    pending = []
+    for index, link in enumerate(links):
         status_message = None
-        if source_type != "channel" or config["channel_broadcast_enabled"]:
+        if not batch and (source_type != "channel" or config["channel_broadcast_enabled"]):
             name = link.get("name", "unknown")
-            status_message = await bot.send_message(chat_id, f"🔍 **Processing:** `{name}`. Initializing...", parse_mode="Markdown")
-        asyncio.create_task(process_file(link, source_url, chat_id, source_type, status_message, original_message))
+            status_message = await outbox.call(chat_id, lambda: bot.send_message(chat_id, f"🔍 **Processing:** `{name}`. Initializing...", parse_mode="Markdown"))
+        done = await process_file(link, source_url, chat_id, source_type, status_message, reply_to_message_id,
+                                  batch=batch, batch_file=index)
+        if done:
+            pending.append(done)
+    if batch:
+        pending.append(batch.finished)
+    return pending
+
+async def resolve_job(job: dict):
+    """Resolve stage: look up the share and route each file to the download stage."""
+    try:
+        pending = await process_url(job["source_url"], job["chat_id"], job["source_type"], job["message_id"])
+    except Exception as e:
+        job["resolved"].set_exception(e)
+        return
+    job["resolved"].set_result(pending)
+
+async def run_url_job(payload: dict):
+    """Durable job handler: push a request through the pipeline and wait until all of its files are finished."""
+    resolved = asyncio.get_running_loop().create_future()
+    await resolve_stage.put({**payload, "resolved": resolved})
+    pending = await resolved
+    await asyncio.gather(*pending)
+
+# Resolve → download → upload, each with its own worker pool and bounded queue
+resolve_stage = Stage("resolve", resolve_job, RESOLVE_WORKERS, RESOLVE_QUEUE_SIZE, queue=FairQueue(
+    key=lambda job: job["chat_id"],
+    weight=lambda job: SOURCE_WEIGHTS.get(job["source_type"], 1),
+    maxsize=RESOLVE_QUEUE_SIZE,
+))
+download_stage = Stage("download", download_job, DOWNLOAD_WORKERS, DOWNLOAD_QUEUE_SIZE, queue=FairQueue(
+    key=lambda job: job["requester"]["chat_id"],
+    weight=lambda job: SOURCE_WEIGHTS.get(job["requester"]["source_type"], 1),
+    maxsize=DOWNLOAD_QUEUE_SIZE,
+    max_active=CHAT_MAX_DOWNLOADS,
+    byte_rate=CHAT_BYTE_RATE,
+    cost=lambda job: job["link"].get("size_bytes", 0),
+))
+upload_stage = Stage("upload", upload_job, UPLOAD_WORKERS, UPLOAD_QUEUE_SIZE)
+stages = [resolve_stage, download_stage, upload_stage]
+
+def pipeline_stats() -> dict:
+    return {stage.name: stage.stats() for stage in stages}
+
+def spool_disk_bytes() -> int:
+    # Allocated blocks: spool files are sized to their full length before data arrives
+    total = 0
+    for entry in os.scandir(spool.directory):
+        try:
+            total += entry.stat().st_blocks * 512
+        except OSError:
+            pass
+    return total
+
+metrics.gauge("teradl_stage_queued", "Jobs waiting in each pipeline stage", ["stage"],
+              lambda: [([name], st["queued"]) for name, st in pipeline_stats().items()])
+metrics.gauge("teradl_stage_active", "Busy workers in each pipeline stage", ["stage"],
+              lambda: [([name], st["active"]) for name, st in pipeline_stats().items()])
+metrics.gauge("teradl_stage_workers", "Worker pool size of each pipeline stage", ["stage"],
+              lambda: [([name], st["workers"]) for name, st in pipeline_stats().items()])
+metrics.gauge("teradl_stage_waiting_chats", "Chats with jobs waiting in each fair-queued stage", ["stage"],
+              lambda: [([name], st["chats"]) for name, st in pipeline_stats().items() if st["chats"] is not None])
+metrics.gauge("teradl_spool_reserved_bytes", "Bytes reserved in the download spool", [],
+              lambda: [([], spool.stats()["reserved"])])
+metrics.gauge("teradl_spool_disk_bytes", "Bytes actually on disk in the download spool", [],
+              lambda: [([], spool_disk_bytes())])
+metrics.gauge("teradl_spool_waiting", "Downloads waiting for spool budget", [],
+              lambda: [([], spool.stats()["waiting"])])
+metrics.gauge("teradl_inflight_files", "Distinct files being downloaded or uploaded", [],
+              lambda: [([], len(inflight_files))])
+metrics.gauge("teradl_outbox_pending", "Telegram calls waiting in the outbox", [],
+              lambda: [([], outbox.pending())])
+metrics.gauge("teradl_jobs_held", "Durable jobs leased by this process", [],
+              lambda: [([], len(jobs.held))])
+metrics.counter("teradl_jobs", "Durable job transitions in this process", ["event"],
+                lambda: [([event], n) for event, n in jobs.counts.items()])
+metrics.counter("teradl_resolver_cache", "Resolver cache lookups", ["result"],
+                lambda: [(["hit"], resolver.hits), (["miss"], resolver.misses)])
+metrics.gauge("teradl_source_throughput_bytes_per_second", "Smoothed throughput per download source", ["kind", "host"],
+              lambda: [([r["kind"], r["host"]], r["throughput"]) for r in health.snapshot()])
+metrics.gauge("teradl_source_error_ratio", "Smoothed error rate per download source", ["kind", "host"],
+              lambda: [([r["kind"], r["host"]], r["error_rate"]) for r in health.snapshot()])
+metrics.counter("teradl_uploads", "Uploads by transport", ["mode"],
+                lambda: [([mode], n) for mode, n in local_api.upload_modes.items()])
+metrics.counter("teradl_broadcast_ledger", "Broadcast dedup checks and records written", ["event"],
+                lambda: [([event], n) for event, n in broadcasts.counts.items()])
+metrics.counter("teradl_disk_write_bytes", "Bytes written to the spool by the disk writer", [],
+                lambda: [([], disk_writer.stats["bytes"])])
+metrics.counter("teradl_disk_writes", "pwrite calls made by the disk writer", [],
+                lambda: [([], disk_writer.stats["writes"])])
+metrics.counter("teradl_disk_write_seconds", "Time spent inside pwrite", [],
+                lambda: [([], disk_writer.stats["write_seconds"])])
+metrics.counter("teradl_disk_write_lag_seconds", "Time writes waited for a disk writer thread", [],
+                lambda: [([], disk_writer.stats["lag_seconds"])])
+metrics.gauge("teradl_disk_write_pending_bytes", "Bytes handed to the disk writer and not yet written", [],
+              lambda: [([], disk_writer.stats["pending"])])
+
+def start_pipeline():
+    for stage in stages:
+        stage.start()
+
+async def sync_broadcast_ledger():
+    # Broadcasts made by other workers only reach this Bloom filter through here
+    while True:
+        await asyncio.sleep(CONFIG_POLL_INTERVAL)
+        try:
+            await broadcasts.sync()
+        except PyMongoError as e:
+            logger.error(f"Broadcast ledger sync failed: {e}")
+
+async def log_pipeline_stats():
+    while True:
+        await asyncio.sleep(STATS_LOG_INTERVAL)
+        stats = pipeline_stats()
+        if any(st["queued"] or st["active"] for st in stats.values()):
+            logger.info("Pipeline: " + ", ".join(
+                f"{name} {st['active']}/{st['workers']} busy, {st['queued']}/{st['capacity']} queued"
+                for name, st in stats.items()
+            ))
 
 @router.message(Command("start"))
 async def start(message: Message):
@@ -411,6 +1374,51 @@ async def settings_command(message: Message):
         pending_auth[user_id] = "awaiting_password"
         await message.answer("🔐 Enter admin password to access settings:")
 
+@router.message(Command("stats"))
+async def stats_command(message: Message):
+    if not await is_admin(message.from_user.id):
+        return
+    lines = ["📊 **Pipeline**\n"]
+    for name, st in pipeline_stats().items():
+        queued = f"{st['queued']}/{st['capacity']} queued" if st["chats"] is None else f"{st['queued']} queued from {st['chats']} chat(s)"
+        lines.append(
+            f"• {name.capitalize()}: {st['active']}/{st['workers']} busy, "
+            f"{queued}, {st['processed']} done"
+        )
+    sp = spool.stats()
+    lines.append(
+        f"\n💾 Spool: {sp['files']} file(s), {sp['reserved'] / (1024 ** 3):.2f}/{sp['budget'] / (1024 ** 3):.2f} GB reserved, "
+        f"{sp['waiting']} waiting"
+    )
+    dw = disk_writer.stats
+    if dw["writes"]:
+        lines.append(
+            f"🖴 Disk writes: {dw['bytes'] / max(dw['write_seconds'], 1e-9) / (1024 * 1024):.0f} MB/s while busy, "
+            f"{dw['bytes'] / dw['writes'] / (1024 * 1024):.1f} MB each, "
+            f"lag {dw['lag_seconds'] / dw['writes'] * 1000:.1f} ms avg / {dw['max_lag'] * 1000:.0f} ms max, "
+            f"{dw['pending'] / (1024 * 1024):.0f} MB pending"
+        )
+    modes = local_api.upload_modes
+    lines.append(f"📤 Uploads: {modes['local']} local path, {modes['multipart']} multipart, {modes['fallback']} fallbacks")
+    lines.append(f"📨 Outbox: {outbox.pending()} pending, {outbox.superseded} edits coalesced")
+    bc = broadcasts.counts
+    lines.append(
+        f"📡 Broadcast dedup: {bc['lru_hits']} LRU hits, {bc['bloom_misses']} Bloom misses, "
+        f"{bc['lookups']} lookups, {bc['duplicates']} skipped"
+    )
+    for row in health.snapshot():
+        if row["host"] == "*":
+            lines.append(
+                f"🌐 {row['kind'].capitalize()}: {row['throughput'] / (1024 * 1024):.2f} MB/s, "
+                f"TTFB {row['ttfb']:.2f}s, {row['error_rate'] * 100:.0f}% errors"
+            )
+    js = await jobs.stats()
+    lines.append(
+        f"🗂 Jobs: {js['queued']} queued, {js['running']} running ({js['held']} here), "
+        f"{js['done']} done, {js['failed']} failed"
+    )
+    await message.answer("\n".join(lines), parse_mode="Markdown")
+
 async def show_settings(message: Message):
     config = await get_config()
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -521,17 +1529,16 @@ async def handle_message(message: Message):
                 await message.answer("❌ Invalid format. Please enter numeric chat IDs separated by commas.")
                 del pending_auth[user_id]
             return
-    urls = LINK_REGEX.findall(text)
-    if not urls:
+    links = extract_links(text)
+    if not links:
         return
     chat_id = message.chat.id
     user_is_admin = await is_admin(user_id)
     source_type = "admin" if user_is_admin else "user"
     logger.info(f"{source_type.capitalize()} {user_id} sent TeraBox URL(s)")
-    for url in urls:
-        url = url.rstrip('.,!?')
+    for _, url in links:
         logger.info(f"Processing {source_type} URL: {url}")
-        asyncio.create_task(process_url(url, chat_id, source_type, message))
+        await jobs.enqueue({"source_url": url, "chat_id": chat_id, "source_type": source_type, "message_id": message.message_id})
 
 @router.channel_post()
 async def handle_channel_post(message: Message):
@@ -540,23 +1547,100 @@ async def handle_channel_post(message: Message):
         logger.debug("Channel broadcast disabled - ignoring channel post")
         return
     text = (message.text or message.caption or "")
-    urls = LINK_REGEX.findall(text)
-    if not urls:
+    links = extract_links(text)
+    if not links:
         return
     chat_id = message.chat.id
     logger.info(f"🔔 Detected TeraBox URL(s) in channel {chat_id}")
-    for url in urls:
-        url = url.rstrip('.,!?')
+    for _, url in links:
         logger.info(f"📥 Processing channel URL: {url}")
-        asyncio.create_task(process_url(url, chat_id, "channel", message))
+        await jobs.enqueue({"source_url": url, "chat_id": chat_id, "source_type": "channel", "message_id": message.message_id})
+
+async def on_shutdown():
+    if BOT_ROLE in ("worker", "all"):
+        # Stop claiming; whatever is still running afterwards is released below
+        await jobs.drain(DRAIN_SECONDS)
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    for stage in stages:
+        await stage.stop()
+    await outbox.close()
+    # Stopped stages have waited out their last pwrite
+    disk_writer.shutdown()
+    await broadcasts.close()
+    # Unfinished jobs go back to the queue for the next worker instead of waiting out their lease
+    await jobs.release()
+    if metrics_runner:
+        await metrics_runner.cleanup()
+    await close_session()
 
 # Attach router
 dp.include_router(router)
+dp.shutdown.register(on_shutdown)
+
+async def wait_for_stop():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+async def serve_webhook():
+    """
+    Take updates from Telegram over HTTP instead of polling. Each update is
+    acknowledged at once and dispatched to the router in the background, so
+    several frontends can serve the same URL behind a load balancer.
+    """
+    secret = webhook.secret_token(BOT_TOKEN)
+    app = webhook.application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret).register(app, path=webhook.WEBHOOK_PATH)
+    # Runs on_shutdown (via dp.shutdown) and closes the bot session on cleanup
+    setup_application(app, dp, bot=bot)
+    runner = await webhook.start_server(app)
+    try:
+        await bot.set_webhook(
+            webhook.url(),
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=webhook.WEBHOOK_MAX_CONNECTIONS
+        )
+        logger.info(f"🚀 Starting TeraDownloader bot ({BOT_ROLE}, webhook)")
+        await wait_for_stop()
+    finally:
+        # The webhook stays registered: other replicas keep receiving updates
+        await runner.cleanup()
 
 if __name__ == "__main__":
     async def main():
         await get_config()
+        await load_admins()
+        await ensure_indexes()
+        background_tasks.append(asyncio.create_task(sync_caches()))
+        global metrics_runner
+        metrics_runner = await metrics.start_server()
+        if BOT_ROLE in ("worker", "all"):
+            spool.cleanup_orphans()
+            await broadcasts.load()
+            start_pipeline()
+            background_tasks.append(asyncio.create_task(jobs.run(run_url_job, JOB_CONCURRENCY)))
+            background_tasks.append(asyncio.create_task(log_pipeline_stats()))
+            background_tasks.append(asyncio.create_task(sync_broadcast_ledger()))
+        if BOT_ROLE == "worker":
+            logger.info(f"🚀 Starting TeraDownloader worker {jobs.owner} (shard {jobs.shard_index + 1}/{jobs.shards})")
+            try:
+                await wait_for_stop()
+            finally:
+                await on_shutdown()
+                await bot.session.close()
+            return
         await set_bot_commands()
-        logger.info("🚀 Starting TeraDownloader bot")
+        if webhook.ENABLED:
+            await serve_webhook()
+            return
+        # getUpdates is refused while a webhook is registered
+        await bot.delete_webhook()
+        logger.info(f"🚀 Starting TeraDownloader bot ({BOT_ROLE})")
         await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
-    asyncio.run(main())
+    # uvloop when installed; it is not available on every platform
+    (uvloop.run if uvloop else asyncio.run)(main())
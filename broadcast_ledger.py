@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import math
+import os
+import time
+import logging
+from collections import OrderedDict
+from pymongo import InsertOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# ===== Broadcast dedup =====
+LEDGER_LRU_SIZE = int(os.getenv("BROADCAST_LRU_SIZE", "10000"))
+LEDGER_BLOOM_CAPACITY = int(os.getenv("BROADCAST_BLOOM_CAPACITY", "1000000"))
+LEDGER_BLOOM_ERROR = float(os.getenv("BROADCAST_BLOOM_ERROR", "0.001"))
+LEDGER_FLUSH_INTERVAL = float(os.getenv("BROADCAST_FLUSH_INTERVAL", "2"))
+LEDGER_BATCH_SIZE = 500
+
+
+def content_key(identity: dict) -> str:
+    """Dedup key of a file: the same identity that keys the file_id cache, not just its name."""
+    return f"{identity['share_id']}:{identity['size_bytes']}:{identity['name']}"
+
+
+class BloomFilter:
+    def __init__(self, capacity: int = LEDGER_BLOOM_CAPACITY, error_rate: float = LEDGER_BLOOM_ERROR):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        # Double hashing: k positions from two 64-bit halves
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class BroadcastLedger:
+    """
+    Which files have been broadcast, and to which chats.
+
+    Checks go through an LRU of recently confirmed keys and a Bloom filter of
+    every key broadcast so far (loaded at startup, topped up by :meth:`sync`
+    for broadcasts made by other processes). A Bloom miss means the file was
+    never broadcast, so only keys the filter claims to know cost an indexed
+    lookup. Per-chat records are buffered and written with ``bulk_write``
+    every ``flush_interval`` seconds or ``LEDGER_BATCH_SIZE`` records.
+    """
+
+    def __init__(self, collection, lru_size: int = LEDGER_LRU_SIZE, bloom_capacity: int = LEDGER_BLOOM_CAPACITY,
+                 error_rate: float = LEDGER_BLOOM_ERROR, flush_interval: float = LEDGER_FLUSH_INTERVAL):
+        self.col = collection
+        self.lru_size = lru_size
+        self.recent = OrderedDict()
+        self.bloom = BloomFilter(bloom_capacity, error_rate)
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.flusher = None
+        self.inflight = set()
+        self.synced_at = 0.0
+        self.counts = {"lru_hits": 0, "bloom_misses": 0, "lookups": 0, "duplicates": 0, "written": 0}
+
+    async def ensure_indexes(self):
+        await self.col.create_index([("content_key", 1), ("ok", 1)])
+        await self.col.create_index("timestamp")
+
+    async def load(self):
+        """Fill the Bloom filter from every successful broadcast on record."""
+        self.synced_at = time.time()
+        loaded = 0
+        async for doc in self.col.find({"ok": True, "content_key": {"$exists": True}}, {"content_key": 1}):
+            self.bloom.add(doc["content_key"])
+            loaded += 1
+        logger.info(f"Broadcast ledger loaded {loaded} record(s)")
+
+    async def sync(self):
+        """Add broadcasts recorded since the last load or sync (by this or other processes)."""
+        since = self.synced_at
+        self.synced_at = time.time()
+        async for doc in self.col.find({"timestamp": {"$gt": since - self.flush_interval}, "ok": True}, {"content_key": 1}):
+            if doc.get("content_key"):
+                self.bloom.add(doc["content_key"])
+
+    def _remember(self, key: str):
+        self.recent[key] = True
+        self.recent.move_to_end(key)
+        while len(self.recent) > self.lru_size:
+            self.recent.popitem(last=False)
+
+    async def seen(self, key: str) -> bool:
+        if key in self.recent:
+            self.recent.move_to_end(key)
+            self.counts["lru_hits"] += 1
+            return True
+        if key not in self.bloom:
+            self.counts["bloom_misses"] += 1
+            return False
+        self.counts["lookups"] += 1
+        if await self.col.find_one({"content_key": key, "ok": True}, {"_id": 1}):
+            self._remember(key)
+            return True
+        # Bloom false positive, or a record still buffered by another process
+        return False
+
+    async def claim(self, key: str) -> bool:
+        """True when ``key`` has not been broadcast and no other task here is broadcasting it."""
+        if key in self.inflight or await self.seen(key):
+            self.counts["duplicates"] += 1
+            return False
+        self.inflight.add(key)
+        return True
+
+    def release(self, key: str):
+        self.inflight.discard(key)
+
+    async def record(self, key: str, name: str, results: dict):
+        """Queue one record per chat (``results`` maps chat_id to an error or None) and release the claim."""
+        now = time.time()
+        self.buffer.extend(
+            InsertOne({"content_key": key, "name": name, "chat_id": chat_id, "ok": error is None, "error": error, "timestamp": now})
+            for chat_id, error in results.items()
+        )
+        if any(error is None for error in results.values()):
+            self.bloom.add(key)
+            self._remember(key)
+        self.release(key)
+        if len(self.buffer) >= LEDGER_BATCH_SIZE:
+            await self.flush()
+        elif self.buffer and (self.flusher is None or self.flusher.done()):
+            self.flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        requests, self.buffer = self.buffer, []
+        if not requests:
+            return
+        try:
+            await self.col.bulk_write(requests, ordered=False)
+            self.counts["written"] += len(requests)
+        except PyMongoError as e:
+            logger.error(f"Failed to write {len(requests)} broadcast record(s): {e}")
+
+    async def close(self):
+        if self.flusher:
+            self.flusher.cancel()
+        await self.flush()
@@ -0,0 +1,170 @@
+import asyncio
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# ===== Disk writer =====
+# Downloads hand received bytes to a FileWriter instead of writing on the event
+# loop. Each byte range coalesces what the socket delivers (often 16-64 KB at a
+# time) into COALESCE_BYTES buffers written with one pwrite on a small thread
+# pool, so a slow disk flush never stalls the loop or the other transfers.
+WRITER_THREADS = int(os.getenv("DISK_WRITER_THREADS", "4"))
+COALESCE_BYTES = int(float(os.getenv("DISK_WRITE_COALESCE_MB", "2")) * 1024 * 1024)
+
+# Process-wide counters, sampled by /stats and /metrics
+stats = {"bytes": 0, "writes": 0, "write_seconds": 0.0, "lag_seconds": 0.0, "max_lag": 0.0, "pending": 0}
+
+_pool = None
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=WRITER_THREADS, thread_name_prefix="disk-writer")
+    return _pool
+
+
+def _pwrite(fd: int, view: memoryview, offset: int, submitted: float):
+    started = time.monotonic()
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+    return started - submitted, time.monotonic() - started
+
+
+def _allocate(fd: int, size: int):
+    os.ftruncate(fd, size)
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError as e:
+            # Not supported by every filesystem; the file stays sparse
+            logger.debug(f"fallocate failed, keeping a sparse file: {e}")
+
+
+class SegmentWriter:
+    """
+    Sequential writer for one byte range of a :class:`FileWriter`.
+
+    At most one buffer is being written while the next one fills, so a
+    range holds up to twice ``COALESCE_BYTES`` and :meth:`write` only waits
+    when the disk has fallen a whole buffer behind the network.
+    ``written`` is the offset up to which bytes have reached the file.
+    After a failed write the segment is poisoned: ``written`` stays at the
+    last good offset and every later write or flush re-raises the error,
+    so nothing is ever written past a hole.
+    """
+
+    def __init__(self, file, offset: int, coalesce: int = COALESCE_BYTES):
+        self.file = file
+        self.coalesce = coalesce
+        self.written = offset
+        # Two buffers, allocated on first use and swapped rather than reallocated
+        self.buffers = []
+        self.filled = 0
+        self.inflight = None
+        self.error = None
+
+    async def _settle(self):
+        if self.inflight is None:
+            return
+        future, size = self.inflight
+        # asyncio.wait never cancels the future: the thread may still be using the fd
+        await asyncio.wait([future])
+        self.inflight = None
+        stats["pending"] -= size
+        try:
+            lag, seconds = future.result()
+        except OSError as e:
+            self.error = e
+            self.filled = 0
+            raise
+        stats["bytes"] += size
+        stats["writes"] += 1
+        stats["write_seconds"] += seconds
+        stats["lag_seconds"] += lag
+        stats["max_lag"] = max(stats["max_lag"], lag)
+        self.written += size
+
+    async def _submit(self):
+        # The other buffer is reused next, so its write has to be done first
+        await self._settle()
+        if self.error:
+            raise self.error
+        if not self.filled:
+            return
+        data = memoryview(self.buffers[0])[:self.filled]
+        self.buffers.reverse()
+        size, self.filled = self.filled, 0
+        stats["pending"] += size
+        future = asyncio.get_running_loop().run_in_executor(
+            _executor(), _pwrite, self.file.fd, data, self.written, time.monotonic())
+        self.inflight = (future, size)
+
+    async def write(self, data: bytes):
+        if self.error:
+            raise self.error
+        if not self.buffers:
+            self.buffers = [bytearray(self.coalesce), bytearray(self.coalesce)]
+        view = memoryview(data)
+        while view:
+            n = min(len(view), self.coalesce - self.filled)
+            self.buffers[0][self.filled:self.filled + n] = view[:n]
+            self.filled += n
+            view = view[n:]
+            if self.filled == self.coalesce:
+                await self._submit()
+
+    async def flush(self):
+        """Write everything buffered and wait for it to reach the file."""
+        await self._submit()
+        await self._settle()
+
+    async def close(self):
+        """Flush; when cancelled, still wait out the running pwrite so the fd can be closed."""
+        if self.error:
+            return
+        try:
+            await self.flush()
+        except asyncio.CancelledError:
+            await self._settle()
+            raise
+
+
+class FileWriter:
+    """One file descriptor per download, shared by all of its byte ranges."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    async def preallocate(self, size: int):
+        """Size the file to ``size`` bytes, reserving its blocks up front when the filesystem supports it."""
+        future = asyncio.get_running_loop().run_in_executor(_executor(), _allocate, self.fd, size)
+        await asyncio.wait([future])
+        future.result()
+
+    def segment(self, offset: int) -> SegmentWriter:
+        return SegmentWriter(self, offset)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
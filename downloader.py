@@ -0,0 +1,263 @@
+import asyncio
+import json
+import os
+import re
+import time
+import logging
+from http_client import get_session, TRANSFER_TIMEOUT
+from disk_writer import FileWriter
+
+logger = logging.getLogger(__name__)
+
+# ===== Engine tuning =====
+SEGMENTS = int(os.getenv("DOWNLOAD_SEGMENTS", "8"))
+MIN_SEGMENT_SIZE = int(os.getenv("DOWNLOAD_MIN_SEGMENT_MB", "8")) * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 5
+MANIFEST_INTERVAL = 2
+MANIFEST_SUFFIX = ".parts"
+
+CONTENT_RANGE_REGEX = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+|\*)")
+
+
+class DownloadError(Exception):
+    pass
+
+
+def _request_headers(headers: dict = None, byte_range: tuple = None) -> dict:
+    merged = dict(headers or {})
+    # Compressed bodies make byte offsets meaningless, always ask for raw bytes
+    merged["Accept-Encoding"] = "identity"
+    if byte_range:
+        start, end = byte_range
+        merged["Range"] = f"bytes={start}-{end}"
+    return merged
+
+
+# ===== Range bookkeeping =====
+def merge_ranges(ranges) -> list:
+    """Merge inclusive (start, end) ranges into a sorted, non-overlapping list."""
+    merged = []
+    for start, end in sorted(r for r in ranges if r[1] >= r[0]):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(r) for r in merged]
+
+
+def missing_ranges(done, total: int) -> list:
+    missing = []
+    cursor = 0
+    for start, end in merge_ranges(done):
+        if start > cursor:
+            missing.append((cursor, start - 1))
+        cursor = max(cursor, end + 1)
+    if cursor < total:
+        missing.append((cursor, total - 1))
+    return missing
+
+
+def plan_segments(missing, segments: int = SEGMENTS) -> list:
+    """Split the missing ranges into at most ``segments`` roughly even pieces."""
+    remaining = sum(end - start + 1 for start, end in missing)
+    if not remaining:
+        return []
+    size = max(MIN_SEGMENT_SIZE, -(-remaining // max(1, segments)))
+    plan = []
+    for start, end in missing:
+        while start <= end:
+            piece_end = min(start + size, end + 1) - 1
+            # Never leave a tail much smaller than a segment on its own
+            if end - piece_end < size // 2:
+                piece_end = end
+            plan.append((start, piece_end))
+            start = piece_end + 1
+    return plan
+
+
+# ===== Sidecar manifest =====
+def manifest_path(path: str) -> str:
+    return path + MANIFEST_SUFFIX
+
+
+def load_manifest(path: str):
+    try:
+        with open(manifest_path(path)) as f:
+            manifest = json.load(f)
+        return {"total": int(manifest["total"]), "done": [tuple(r) for r in manifest["done"]]}
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_manifest(path: str, total: int, done):
+    tmp = manifest_path(path) + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"total": total, "done": merge_ranges(done)}, f)
+    os.replace(tmp, manifest_path(path))
+
+
+def verify(path: str) -> bool:
+    """True when ``path`` holds every byte its manifest expects."""
+    manifest = load_manifest(path)
+    if not manifest or not os.path.exists(path):
+        return False
+    return not missing_ranges(manifest["done"], manifest["total"]) and os.path.getsize(path) == manifest["total"]
+
+
+def completed_bytes(path: str) -> int:
+    """Bytes of ``path`` its manifest records as downloaded."""
+    manifest = load_manifest(path)
+    if not manifest:
+        return 0
+    return sum(end - start + 1 for start, end in merge_ranges(manifest["done"]))
+
+
+def discard(path: str):
+    for p in (path, manifest_path(path)):
+        if p and os.path.exists(p):
+            os.unlink(p)
+
+
+async def _report(progress, state: dict):
+    while True:
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        try:
+            await progress(state["downloaded"], state["total"])
+        except Exception as e:
+            logger.debug(f"Progress callback failed: {e}")
+
+
+def _checkpoint(path: str, state: dict):
+    # Only bytes the disk writer has put in the file, not those still buffered
+    done = list(state["done"]) + [(start, seg.written - 1) for start, seg in state["active"].values() if seg.written > start]
+    save_manifest(path, state["total"], done)
+    state["saved_at"] = time.time()
+
+
+async def _fetch_segment(url: str, path: str, file: FileWriter, byte_range: tuple, headers: dict, state: dict):
+    start, end = byte_range
+    pos = start
+    segment = file.segment(start)
+    session = get_session()
+    try:
+        async with session.get(url, headers=_request_headers(headers, byte_range), timeout=TRANSFER_TIMEOUT) as resp:
+            if resp.status != 206:
+                raise DownloadError(f"Range {start}-{end} returned HTTP {resp.status}")
+            # Bytes from any other offset would be written in the wrong place and recorded as done
+            match = CONTENT_RANGE_REGEX.match(resp.headers.get("Content-Range", ""))
+            if (not match or int(match.group(1)) != start or int(match.group(2)) > end
+                    or match.group(3) not in ("*", str(state["total"]))):
+                raise DownloadError(f"Range {start}-{end} answered with Content-Range {resp.headers.get('Content-Range')!r}")
+            state["active"][byte_range] = (start, segment)
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                chunk = chunk[:end + 1 - pos]
+                await segment.write(chunk)
+                pos += len(chunk)
+                state["downloaded"] += len(chunk)
+                if time.time() - state["saved_at"] > MANIFEST_INTERVAL:
+                    _checkpoint(path, state)
+        if pos != end + 1:
+            raise DownloadError(f"Range {start}-{end} ended early at byte {pos}")
+    finally:
+        # Whatever arrived is kept: flushed to the file before the range is recorded as done
+        try:
+            await segment.close()
+        finally:
+            state["active"].pop(byte_range, None)
+            if segment.written > start:
+                state["done"].append((start, segment.written - 1))
+
+
+async def _stream(resp, path: str, size: int, state: dict):
+    with FileWriter(path) as file:
+        # Content-Length when the server sent one; an empty file otherwise
+        await file.preallocate(size)
+        segment = file.segment(0)
+        try:
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                await segment.write(chunk)
+                state["downloaded"] += len(chunk)
+        finally:
+            await segment.close()
+
+
+async def download(url: str, path: str, expected_size: int = 0, progress=None,
+                   headers: dict = None, segments: int = SEGMENTS, timings: dict = None) -> int:
+    """
+    Download ``url`` into ``path`` and return the file size.
+
+    The server is probed with a one-byte range request. When it answers 206 the
+    bytes still missing according to the ``.parts`` manifest next to ``path``
+    are fetched as concurrent byte ranges, so a retry (even against a
+    refreshed or alternate URL for the same file) only transfers what is left.
+    Otherwise the probe response itself is consumed as a single stream.
+    The manifest is kept on failure and on success; use :func:`verify` before
+    handing the file on and :func:`discard` to remove both.
+    ``progress`` is an optional ``async (downloaded, total)`` callback invoked
+    every few seconds from a separate task so slow status updates never stall
+    the transfer. ``timings``, when given, receives ``ttfb``: seconds until the
+    probe's response headers arrived.
+    """
+    state = {"downloaded": 0, "total": expected_size, "done": [], "active": {}, "saved_at": 0}
+    reporter = asyncio.create_task(_report(progress, state)) if progress else None
+    start_time = time.time()
+    try:
+        session = get_session()
+        async with session.get(url, headers=_request_headers(headers, (0, 0)), timeout=TRANSFER_TIMEOUT) as resp:
+            if timings is not None:
+                timings["ttfb"] = time.time() - start_time
+            match = CONTENT_RANGE_REGEX.match(resp.headers.get("Content-Range", ""))
+            if resp.status == 206 and match and match.group(3) != "*":
+                total = int(match.group(3))
+            elif resp.status == 206:
+                raise DownloadError(f"Partial response without a usable total size (Content-Range {resp.headers.get('Content-Range')!r})")
+            elif resp.status == 200:
+                total = int(resp.headers.get("Content-Length", 0))
+                state["total"] = total or expected_size
+                logger.info(f"Ranges unsupported, single-stream download of {url}")
+                discard(path)
+                await _stream(resp, path, total, state)
+                if total and state["downloaded"] != total:
+                    raise DownloadError(f"Stream ended early at byte {state['downloaded']} of {total}")
+                save_manifest(path, state["downloaded"], [(0, state["downloaded"] - 1)])
+                return state["downloaded"]
+            else:
+                raise DownloadError(f"HTTP Status {resp.status}")
+
+        manifest = load_manifest(path)
+        if manifest and manifest["total"] == total and os.path.exists(path) and os.path.getsize(path) == total:
+            state["done"] = manifest["done"]
+            state["downloaded"] = sum(end - start + 1 for start, end in merge_ranges(manifest["done"]))
+            if state["downloaded"]:
+                logger.info(f"Resuming download at {state['downloaded']}/{total} bytes")
+        else:
+            if manifest:
+                logger.warning(f"Discarding partial data for {path}: size changed to {total}")
+        with FileWriter(path) as file:
+            if not state["done"]:
+                # Blocks reserved up front: no ENOSPC halfway through, and less fragmentation
+                await file.preallocate(total)
+            state["total"] = total
+            _checkpoint(path, state)
+
+            plan = plan_segments(missing_ranges(state["done"], total), segments)
+            logger.info(f"Segmented download of {total} bytes in {len(plan)} range(s)")
+            tasks = [asyncio.create_task(_fetch_segment(url, path, file, r, headers, state)) for r in plan]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                # Every segment has flushed (or waited out its last write) before the fd closes
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            finally:
+                _checkpoint(path, state)
+        return total
+    finally:
+        if reporter:
+            reporter.cancel()
+        elapsed = time.time() - start_time
+        if elapsed > 0 and state["downloaded"]:
+            logger.debug(f"Transferred {state['downloaded']} bytes at {state['downloaded'] / elapsed / (1024 * 1024):.2f} MB/s")
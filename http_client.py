@@ -0,0 +1,43 @@
+import os
+import logging
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# ===== Connection pool tuning =====
+POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", "200"))
+POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "32"))
+DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", "300"))
+KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "60"))
+
+# ===== Timeout profiles =====
+# Metadata calls (resolver APIs) should fail fast; bulk transfers may run for a
+# long time but must not hang on a stalled socket.
+META_TIMEOUT = aiohttp.ClientTimeout(total=60, connect=10, sock_read=30)
+TRANSFER_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=15, sock_read=60)
+
+_session = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Return the process-wide pooled session, creating it on first use."""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=POOL_LIMIT,
+            limit_per_host=POOL_LIMIT_PER_HOST,
+            use_dns_cache=True,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+        )
+        _session = aiohttp.ClientSession(connector=connector, timeout=META_TIMEOUT)
+        logger.info(f"Opened pooled HTTP client (limit={POOL_LIMIT}, per_host={POOL_LIMIT_PER_HOST})")
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+        logger.info("Closed pooled HTTP client")
+    _session = None
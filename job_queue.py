@@ -0,0 +1,292 @@
+import asyncio
+import os
+import socket
+import time
+import zlib
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from pipeline import wait_event
+
+logger = logging.getLogger(__name__)
+
+# ===== Durable job queue =====
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_BACKOFF = int(os.getenv("JOB_RETRY_BACKOFF", "30"))
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", "7"))
+JOB_GROUP_LIMIT = int(os.getenv("JOB_CHAT_CONCURRENCY", "3"))   # jobs per chat held by one worker, 0 = no limit
+# Set by the supervisor: this worker only claims jobs whose shard hash falls on WORKER_SHARD
+WORKER_SHARDS = int(os.getenv("WORKER_SHARDS", "1"))
+WORKER_SHARD = int(os.getenv("WORKER_SHARD", "0"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueue:
+    """
+    Jobs persisted in a Mongo collection so they survive restarts and can be
+    shared by several worker processes.
+
+    A worker claims a job atomically by moving it from ``queued`` to ``running``
+    under a lease it owns. One heartbeat per process extends the leases of every
+    job it holds. A job whose lease runs out (the worker died) is claimed again
+    by whichever worker gets to it first, up to ``max_attempts`` claims.
+
+    With ``group_field`` set (a dotted path such as ``payload.chat_id``) a
+    worker holds at most ``group_limit`` jobs of the same group and claims
+    past the rest, so one chat's backlog cannot take every slot.
+
+    With ``shard_key`` set, each job is stamped with a stable hash of
+    ``shard_key(payload)`` and a worker only claims jobs where that hash
+    modulo ``shards`` is ``shard_index``. Jobs of one key always land on the
+    same worker, in order, whatever process enqueued them; jobs enqueued
+    before sharding was enabled go to shard 0.
+    """
+
+    def __init__(self, collection, owner: str = None, lease: int = JOB_LEASE_SECONDS,
+                 poll_interval: float = JOB_POLL_INTERVAL, max_attempts: int = JOB_MAX_ATTEMPTS,
+                 group_field: str = None, group_limit: int = JOB_GROUP_LIMIT,
+                 shard_key=None, shards: int = WORKER_SHARDS, shard_index: int = WORKER_SHARD):
+        self.col = collection
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.group_field = group_field
+        self.group_limit = group_limit
+        self.shard_key = shard_key
+        self.shards = max(1, shards)
+        self.shard_index = shard_index
+        self.held = {}  # job id -> group
+        self.wakeup = asyncio.Event()
+        self.draining = False
+        self.counts = {"claimed": 0, "completed": 0, "retried": 0, "failed": 0, "lost": 0}
+
+    async def ensure_indexes(self):
+        await self.col.create_index([("state", 1), ("available_at", 1)])
+        await self.col.create_index([("state", 1), ("lease_expires", 1)])
+        if self.shards > 1:
+            await self.col.create_index([("shard", 1), ("state", 1), ("available_at", 1)])
+        # Finished jobs are only kept for inspection
+        await self.col.create_index("finished_at", expireAfterSeconds=JOB_RETENTION_DAYS * 86400)
+
+    async def enqueue(self, payload: dict):
+        now = time.time()
+        doc = {
+            "payload": payload,
+            "state": QUEUED,
+            "attempts": 0,
+            "available_at": now,
+            "lease_owner": None,
+            "lease_expires": 0,
+            "created_at": now,
+            "updated_at": now,
+        }
+        if self.shard_key:
+            # crc32 rather than hash(): it must agree across processes and restarts
+            doc["shard"] = zlib.crc32(str(self.shard_key(payload)).encode())
+        result = await self.col.insert_one(doc)
+        self.wakeup.set()
+        return result.inserted_id
+
+    def _group(self, job: dict):
+        value = job
+        for part in self.group_field.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        return value
+
+    def saturated(self) -> list:
+        """Groups this worker already holds ``group_limit`` jobs of."""
+        if not self.group_field or not self.group_limit:
+            return []
+        counts = Counter(self.held.values())
+        return [group for group, n in counts.items() if n >= self.group_limit]
+
+    async def claim(self):
+        """Take the oldest runnable job (queued, or running under an expired lease) or return None."""
+        if self.draining:
+            return None
+        now = time.time()
+        query = {"$or": [
+            {"state": QUEUED, "available_at": {"$lte": now}},
+            {"state": RUNNING, "lease_expires": {"$lt": now}, "attempts": {"$lt": self.max_attempts}},
+        ]}
+        if self.shards > 1:
+            mine = [{"shard": {"$mod": [self.shards, self.shard_index]}}]
+            if self.shard_index == 0:
+                mine.append({"shard": {"$exists": False}})
+            query["$and"] = [{"$or": mine}]
+        saturated = self.saturated()
+        if saturated:
+            query[self.group_field] = {"$nin": saturated}
+        job = await self.col.find_one_and_update(
+            query,
+            {
+                "$set": {"state": RUNNING, "lease_owner": self.owner, "lease_expires": now + self.lease, "updated_at": now},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("available_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if job:
+            self.held[job["_id"]] = self._group(job) if self.group_field else None
+            self.counts["claimed"] += 1
+            if job["attempts"] > 1:
+                logger.info(f"Claimed job {job['_id']} (attempt {job['attempts']}/{self.max_attempts})")
+        return job
+
+    async def renew(self):
+        """Extend the lease on every held job and drop the ones another worker has taken over."""
+        ids = list(self.held)
+        if not ids:
+            return
+        now = time.time()
+        result = await self.col.update_many(
+            {"_id": {"$in": ids}, "lease_owner": self.owner, "state": RUNNING},
+            {"$set": {"lease_expires": now + self.lease, "updated_at": now}},
+        )
+        if result.matched_count == len(ids):
+            return
+        owned = {doc["_id"] async for doc in self.col.find(
+            {"_id": {"$in": ids}, "lease_owner": self.owner, "state": RUNNING}, {"_id": 1})}
+        for job_id in ids:
+            # Jobs completed since the snapshot are no longer held, they were not lost
+            if job_id in self.held and job_id not in owned:
+                self.held.pop(job_id, None)
+                self.counts["lost"] += 1
+                logger.warning(f"Lost lease on job {job_id}, another worker has reclaimed it")
+
+    async def reap(self):
+        """Fail running jobs whose lease expired on their last allowed attempt."""
+        now = time.time()
+        result = await self.col.update_many(
+            {"state": RUNNING, "lease_expires": {"$lt": now}, "attempts": {"$gte": self.max_attempts}},
+            {"$set": {"state": FAILED, "error": "lease expired", "finished_at": datetime.now(timezone.utc), "updated_at": now}},
+        )
+        if result.modified_count:
+            self.counts["failed"] += result.modified_count
+            logger.error(f"Gave up on {result.modified_count} job(s) after {self.max_attempts} expired leases")
+
+    async def complete(self, job: dict):
+        self.held.pop(job["_id"], None)
+        await self.col.update_one(
+            {"_id": job["_id"], "lease_owner": self.owner},
+            {"$set": {"state": DONE, "lease_expires": 0, "finished_at": datetime.now(timezone.utc), "updated_at": time.time()}},
+        )
+        self.counts["completed"] += 1
+
+    async def fail(self, job: dict, error: str):
+        """Re-queue the job with backoff, or mark it failed once its attempts are used up."""
+        self.held.pop(job["_id"], None)
+        now = time.time()
+        if job["attempts"] >= self.max_attempts:
+            update = {"state": FAILED, "error": error, "finished_at": datetime.now(timezone.utc)}
+            self.counts["failed"] += 1
+        else:
+            backoff = JOB_RETRY_BACKOFF * 2 ** (job["attempts"] - 1)
+            update = {"state": QUEUED, "error": error, "available_at": now + backoff, "lease_owner": None}
+            self.counts["retried"] += 1
+        update["updated_at"] = now
+        await self.col.update_one({"_id": job["_id"], "lease_owner": self.owner}, {"$set": update})
+
+    async def release(self):
+        """Hand every held job back to the queue without counting the attempt (graceful shutdown)."""
+        ids = list(self.held)
+        self.held.clear()
+        if not ids:
+            return
+        await self.col.update_many(
+            {"_id": {"$in": ids}, "lease_owner": self.owner, "state": RUNNING},
+            {
+                "$set": {"state": QUEUED, "available_at": time.time(), "lease_owner": None, "lease_expires": 0},
+                "$inc": {"attempts": -1},
+            },
+        )
+        logger.info(f"Released {len(ids)} unfinished job(s) back to the queue")
+
+    async def drain(self, timeout: float) -> int:
+        """
+        Stop claiming and give the jobs already held up to ``timeout`` seconds
+        to finish. Returns how many are still held; :meth:`release` hands
+        those back.
+        """
+        self.draining = True
+        deadline = time.monotonic() + timeout
+        if self.held:
+            logger.info(f"Draining {len(self.held)} job(s), up to {timeout:.0f}s")
+        while self.held and time.monotonic() < deadline:
+            await asyncio.sleep(min(1, max(0, deadline - time.monotonic())))
+        return len(self.held)
+
+    async def stats(self) -> dict:
+        counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        async for row in self.col.aggregate([{"$group": {"_id": "$state", "n": {"$sum": 1}}}]):
+            counts[row["_id"]] = row["n"]
+        counts["held"] = len(self.held)
+        return counts
+
+    async def run(self, handler, concurrency: int):
+        """
+        Claim jobs while fewer than ``concurrency`` are held and run
+        ``await handler(payload)`` for each. The job is completed when the
+        handler returns and re-queued (or failed) when it raises.
+        """
+        slots = asyncio.Semaphore(concurrency)
+        tasks = set()
+        heartbeat = asyncio.create_task(self._heartbeat())
+        logger.info(f"Job worker {self.owner} running with {concurrency} slot(s)")
+        try:
+            while True:
+                await slots.acquire()
+                try:
+                    job = await self.claim()
+                except PyMongoError as e:
+                    logger.error(f"Job claim failed: {e}")
+                    job = None
+                if not job:
+                    slots.release()
+                    self.wakeup.clear()
+                    await wait_event(self.wakeup, self.poll_interval)
+                    continue
+                task = asyncio.create_task(self._execute(job, handler, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            heartbeat.cancel()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(heartbeat, *tasks, return_exceptions=True)
+
+    async def _execute(self, job: dict, handler, slots: asyncio.Semaphore):
+        try:
+            await handler(job["payload"])
+        except asyncio.CancelledError:
+            # Left held so release() can hand it back on shutdown
+            raise
+        except Exception as e:
+            logger.error(f"Job {job['_id']} failed: {e}", exc_info=True)
+            if job["_id"] in self.held:
+                await self.fail(job, str(e)[:200])
+        else:
+            if job["_id"] in self.held:
+                await self.complete(job)
+        finally:
+            slots.release()
+            # A freed slot may unblock a group the last claim had to skip
+            self.wakeup.set()
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await self.renew()
+                await self.reap()
+            except PyMongoError as e:
+                logger.error(f"Job lease heartbeat failed: {e}")
@@ -0,0 +1,36 @@
+import os
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# ===== Local Bot API server =====
+# When the self-hosted Bot API server runs with --local and can read our spool
+# (put SPOOL_DIR on a volume shared with it), uploads pass a file:// path
+# instead of streaming the whole file over multipart.
+LOCAL_MODE = os.getenv("BOT_API_LOCAL_MODE", "").lower() in ("1", "true", "yes")
+SHARED_DIR = os.getenv("BOT_API_SHARED_DIR", "")  # shared volume as mounted in this container
+SERVER_DIR = os.getenv("BOT_API_SERVER_DIR", "")  # same volume as mounted in the Bot API container
+
+upload_modes = {"local": 0, "multipart": 0, "fallback": 0}
+
+
+def server_path(path: str):
+    """Path under which the Bot API server sees ``path``, or None if it cannot see it."""
+    if not LOCAL_MODE or not path:
+        return None
+    real = os.path.realpath(path)
+    if not SHARED_DIR:
+        # No shared volume configured: the server runs on the same filesystem
+        return real
+    shared = os.path.realpath(SHARED_DIR)
+    rel = os.path.relpath(real, shared)
+    if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+        return None
+    return os.path.join(SERVER_DIR or shared, rel)
+
+
+def file_uri(path: str):
+    """file:// URI to hand the local Bot API server, or None to fall back to multipart."""
+    target = server_path(path)
+    return Path(target).as_uri() if target else None
@@ -0,0 +1,98 @@
+import os
+import logging
+from aiohttp import web
+from prometheus_client import Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# ===== Metrics endpoint =====
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))  # 0 disables the endpoint
+
+MB = 1024 * 1024
+
+GET_LINKS_SECONDS = Histogram(
+    "teradl_get_links_seconds", "Latency of share resolution, including resolver cache hits",
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+DOWNLOAD_THROUGHPUT = Histogram(
+    "teradl_download_throughput_bytes_per_second", "Throughput of completed download attempts",
+    ["kind"], buckets=tuple(b * MB for b in (0.25, 0.5, 1, 2, 5, 10, 20, 50, 100)),
+)
+DOWNLOAD_BYTES = Counter("teradl_download_bytes_total", "Bytes fetched from TeraBox", ["kind"])
+UPLOAD_SECONDS = Histogram(
+    "teradl_upload_seconds", "Duration of send_video calls carrying file data",
+    ["mode"], buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600),
+)
+MONGO_SECONDS = Histogram(
+    "teradl_mongo_seconds", "Latency of MongoDB commands",
+    ["command"], buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+FAILURES = Counter("teradl_failures_total", "Failures by reason", ["reason"])
+HEDGES = Counter("teradl_hedges_total", "Hedged downloads by the source that finished first", ["winner"])
+REMUXES = Counter("teradl_remuxes_total", "Downloads whose moov atom was moved to the front before upload")
+
+
+class MongoListener(monitoring.CommandListener):
+    """Feeds every command's server round trip into ``teradl_mongo_seconds``."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_SECONDS.labels(event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_SECONDS.labels(event.command_name).observe(event.duration_micros / 1e6)
+        FAILURES.labels("mongo").inc()
+
+
+class _Sampled:
+    """Collector for in-process state (queue depth, spool usage...) read at scrape time."""
+
+    def __init__(self):
+        self.sources = []
+
+    def collect(self):
+        for kind, name, documentation, labelnames, sample in self.sources:
+            family_type = CounterMetricFamily if kind == "counter" else GaugeMetricFamily
+            family = family_type(name, documentation, labels=labelnames)
+            try:
+                for labels, value in sample():
+                    family.add_metric(labels, value)
+            except Exception as e:
+                logger.debug(f"Sampling {name} failed: {e}")
+            yield family
+
+
+_sampled = _Sampled()
+REGISTRY.register(_sampled)
+
+
+def gauge(name: str, documentation: str, labelnames, sample):
+    """Register a gauge whose ``(label_values, value)`` pairs come from ``sample()`` on each scrape."""
+    _sampled.sources.append(("gauge", name, documentation, list(labelnames), sample))
+
+
+def counter(name: str, documentation: str, labelnames, sample):
+    """Like :func:`gauge` for monotonically increasing counts kept elsewhere."""
+    _sampled.sources.append(("counter", name, documentation, list(labelnames), sample))
+
+
+async def _handle_metrics(request):
+    return web.Response(body=generate_latest(REGISTRY), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """Serve ``/metrics`` on the running loop; returns the runner to clean up, or None when disabled."""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,330 @@
+"""
+MP4 preparation before upload: move the ``moov`` atom in front of ``mdat``
+(faststart) in place, read duration and dimensions from the container
+headers, and grab a thumbnail with ffmpeg when it is installed.
+
+The work runs in a child process (``python mp4meta.py PATH``, JSON on
+stdout) so multi-GB rewrites never touch the event loop; :func:`inspect` is
+the async entry point and bounds how many run at once.
+"""
+import asyncio
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ===== Video preparation =====
+MP4_WORKERS = int(os.getenv("MP4_WORKERS", "2"))
+MP4_TIMEOUT = int(os.getenv("MP4_TIMEOUT", "1800"))
+FASTSTART = os.getenv("MP4_FASTSTART", "1").lower() in ("1", "true", "yes")
+THUMBNAILS = os.getenv("MP4_THUMBNAILS", "1").lower() in ("1", "true", "yes")
+THUMBNAIL_SIZE = 320            # Telegram's limit for either side
+THUMBNAIL_MAX_BYTES = 200 * 1024
+MAX_MOOV_SIZE = 256 * 1024 * 1024
+COPY_CHUNK = 8 * 1024 * 1024
+REMUX_MARKER = ".remux"         # exists next to the file while it is being rewritten
+
+CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts"}
+
+
+class Mp4Error(Exception):
+    pass
+
+
+# ===== Atom parsing =====
+def _header(data: bytes, offset: int, end: int, room: int = None):
+    """Kind, total size and header length of the atom at ``offset``; ``room`` bounds its size (default: up to ``end``)."""
+    room = end - offset if room is None else room
+    if end - offset < 8:
+        raise Mp4Error(f"Truncated atom header at {offset}")
+    size, kind = struct.unpack_from(">I4s", data, offset)
+    header = 8
+    if size == 1:
+        if end - offset < 16:
+            raise Mp4Error(f"Truncated atom header at {offset}")
+        size = struct.unpack_from(">Q", data, offset + 8)[0]
+        header = 16
+    elif size == 0:
+        size = room
+    if size < header or size > room:
+        raise Mp4Error(f"Bad size {size} for {kind!r} at {offset}")
+    return kind, size, header
+
+
+def top_level_atoms(f, file_size: int) -> list:
+    """``(kind, offset, size)`` of every top-level atom, reading only their headers."""
+    atoms = []
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        head = f.read(16)
+        kind, size, _ = _header(head, 0, len(head), file_size - offset)
+        atoms.append((kind, offset, size))
+        offset += size
+    return atoms
+
+
+def parse_boxes(data: bytes, offset: int = 0, end: int = None) -> list:
+    """Nested ``[kind, payload]`` list; containers hold a child list instead of bytes."""
+    end = len(data) if end is None else end
+    boxes = []
+    while offset < end:
+        kind, size, header = _header(data, offset, end)
+        body_start, body_end = offset + header, offset + size
+        if kind in CONTAINERS:
+            boxes.append([kind, parse_boxes(data, body_start, body_end)])
+        else:
+            boxes.append([kind, data[body_start:body_end]])
+        offset = body_end
+    return boxes
+
+
+def serialize_boxes(boxes: list) -> bytes:
+    parts = []
+    for kind, body in boxes:
+        payload = serialize_boxes(body) if isinstance(body, list) else body
+        size = len(payload) + 8
+        if size > 0xFFFFFFFF:
+            parts.append(struct.pack(">I4sQ", 1, kind, size + 8))
+        else:
+            parts.append(struct.pack(">I4s", size, kind))
+        parts.append(payload)
+    return b"".join(parts)
+
+
+def _find(boxes: list, kind: bytes):
+    return next((body for k, body in boxes if k == kind), None)
+
+
+def _walk(boxes: list, kinds: tuple):
+    """Every box of ``kinds`` anywhere under ``boxes``, as the ``[kind, body]`` list itself."""
+    for box in boxes:
+        if box[0] in kinds:
+            yield box
+        if isinstance(box[1], list):
+            yield from _walk(box[1], kinds)
+
+
+# ===== Metadata =====
+def _fixed16(value: int) -> int:
+    return value >> 16
+
+
+def read_metadata(moov: list) -> dict:
+    """Duration in seconds and display width/height of the first video track."""
+    meta = {}
+    mvhd = _find(moov, b"mvhd")
+    if mvhd:
+        if mvhd[0] == 1:
+            timescale, duration = struct.unpack_from(">IQ", mvhd, 20)
+        else:
+            timescale, duration = struct.unpack_from(">II", mvhd, 12)
+        if timescale and duration and duration != 0xFFFFFFFF:
+            meta["duration"] = round(duration / timescale)
+    for kind, trak in moov:
+        if kind != b"trak":
+            continue
+        mdia = _find(trak, b"mdia") or []
+        hdlr = _find(mdia, b"hdlr")
+        if not hdlr or hdlr[8:12] != b"vide":
+            continue
+        tkhd = _find(trak, b"tkhd")
+        if tkhd and len(tkhd) >= 84:
+            width, height = (_fixed16(v) for v in struct.unpack_from(">II", tkhd, len(tkhd) - 8))
+            # Matrix a/b: a 90° or 270° rotation shows the frame on its side
+            a, b = struct.unpack_from(">ii", tkhd, len(tkhd) - 44)
+            if a == 0 and b != 0:
+                width, height = height, width
+            if width and height:
+                meta["width"], meta["height"] = width, height
+        mdhd = _find(mdia, b"mdhd")
+        if "duration" not in meta and mdhd:
+            if mdhd[0] == 1:
+                timescale, duration = struct.unpack_from(">IQ", mdhd, 20)
+            else:
+                timescale, duration = struct.unpack_from(">II", mdhd, 12)
+            if timescale and duration:
+                meta["duration"] = round(duration / timescale)
+        break
+    return meta
+
+
+# ===== Faststart =====
+def _shift_offsets(moov: list, delta: int):
+    """Add ``delta`` to every chunk offset, widening ``stco`` to ``co64`` where 32 bits no longer fit."""
+    for box in _walk(moov, (b"stco", b"co64")):
+        kind, body = box
+        count = struct.unpack_from(">I", body, 4)[0]
+        wide = kind == b"co64"
+        offsets = struct.unpack_from(f">{count}{'Q' if wide else 'I'}", body, 8)
+        shifted = [o + delta for o in offsets]
+        if not wide and shifted and max(shifted) > 0xFFFFFFFF:
+            kind, wide = b"co64", True
+        box[0] = kind
+        box[1] = body[:8] + struct.pack(f">{count}{'Q' if wide else 'I'}", *shifted)
+
+
+def _move_forward(f, start: int, end: int, delta: int):
+    """Copy ``[start, end)`` to ``start + delta``, last chunk first so nothing is overwritten before it is read."""
+    pos = end
+    while pos > start:
+        size = min(COPY_CHUNK, pos - start)
+        pos -= size
+        f.seek(pos)
+        chunk = f.read(size)
+        f.seek(pos + delta)
+        f.write(chunk)
+
+
+def faststart(path: str) -> bool:
+    """
+    Move ``moov`` in front of the first ``mdat`` in place; returns False when
+    it already is (or the file is fragmented). The space the new layout needs
+    is allocated before any data moves, and ``path + REMUX_MARKER`` exists
+    for as long as the file is inconsistent.
+    """
+    file_size = os.path.getsize(path)
+    with open(path, "r+b") as f:
+        atoms = top_level_atoms(f, file_size)
+        kinds = [kind for kind, _, _ in atoms]
+        if b"moov" not in kinds or b"mdat" not in kinds or b"moof" in kinds:
+            return False
+        moov_index = kinds.index(b"moov")
+        mdat_index = kinds.index(b"mdat")
+        if moov_index < mdat_index:
+            return False
+        _, moov_offset, moov_size = atoms[moov_index]
+        if moov_size > MAX_MOOV_SIZE:
+            raise Mp4Error(f"moov of {moov_size} bytes is too large to relocate")
+        f.seek(moov_offset)
+        moov = parse_boxes(f.read(moov_size))[0][1]
+        if _find(moov, b"cmov") is not None:
+            return False
+
+        # Chunk offsets grow by the relocated moov's size, which grows if stco has to become co64.
+        # A rewrite smaller than that size is padded with a free atom so the offsets stay right.
+        insert_at = atoms[mdat_index][1]
+        new_size = moov_size
+        while True:
+            candidate = parse_boxes(serialize_boxes(moov))
+            _shift_offsets(candidate, new_size)
+            data = serialize_boxes([[b"moov", candidate]])
+            if 8 <= new_size - len(data) <= 0xFFFFFFFF:
+                data += struct.pack(">I4s", new_size - len(data), b"free") + b"\0" * (new_size - len(data) - 8)
+            if len(data) == new_size:
+                break
+            new_size = len(data) if len(data) > new_size else new_size + 8
+
+        growth = new_size - moov_size
+        tail_start = moov_offset + moov_size
+        if growth:
+            os.posix_fallocate(f.fileno(), file_size, growth)
+        marker = path + REMUX_MARKER
+        open(marker, "w").close()
+        # [head][mdat..][moov][tail] → [head][moov'][mdat..][tail]
+        _move_forward(f, tail_start, file_size, growth)
+        _move_forward(f, insert_at, moov_offset, new_size)
+        f.seek(insert_at)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.unlink(marker)
+    return True
+
+
+# ===== Thumbnails =====
+def thumbnail(path: str, output: str, duration: int = 0):
+    """JPEG thumbnail of a frame near the start, or None without ffmpeg or on failure."""
+    ffmpeg = shutil.which("ffmpeg")
+    if not ffmpeg:
+        return None
+    at = min(10, duration // 10) if duration else 0
+    command = [
+        ffmpeg, "-v", "error", "-y", "-ss", str(at), "-i", path, "-frames:v", "1",
+        "-vf", f"scale='min({THUMBNAIL_SIZE},iw)':'min({THUMBNAIL_SIZE},ih)':force_original_aspect_ratio=decrease",
+        "-q:v", "5", output,
+    ]
+    try:
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=120, check=True)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if not os.path.exists(output) or not 0 < os.path.getsize(output) <= THUMBNAIL_MAX_BYTES:
+        return None
+    return output
+
+
+def prepare(path: str, relocate: bool = True, with_thumbnail: bool = True) -> dict:
+    """
+    Everything the upload needs from the file: ``duration``, ``width``,
+    ``height`` and ``thumbnail`` (each only when known) plus ``faststart``,
+    True when ``moov`` was moved.
+    """
+    result = {"faststart": False}
+    try:
+        if relocate:
+            result["faststart"] = faststart(path)
+        with open(path, "rb") as f:
+            atoms = top_level_atoms(f, os.path.getsize(path))
+            moov = next(((offset, size) for kind, offset, size in atoms if kind == b"moov"), None)
+            if moov and moov[1] <= MAX_MOOV_SIZE:
+                f.seek(moov[0])
+                result.update(read_metadata(parse_boxes(f.read(moov[1]))[0][1]))
+    except (Mp4Error, struct.error, IndexError) as e:
+        # Not an MP4 we understand (mkv, webm...): upload it as it is
+        result["error"] = str(e)
+    if with_thumbnail:
+        thumb = thumbnail(path, path + ".thumb.jpg", result.get("duration", 0))
+        if thumb:
+            result["thumbnail"] = thumb
+    return result
+
+
+# ===== Async entry point =====
+_slots = None
+
+
+async def inspect(path: str, relocate: bool = FASTSTART, with_thumbnail: bool = THUMBNAILS,
+                  timeout: float = MP4_TIMEOUT) -> dict:
+    """
+    Run :func:`prepare` on ``path`` in a child process, at most ``MP4_WORKERS``
+    at a time. Raises :class:`Mp4Error` when the file may have been left
+    half-rewritten; any other failure just returns no metadata.
+    """
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(MP4_WORKERS)
+    command = [sys.executable, os.path.abspath(__file__), path]
+    if not relocate:
+        command.append("--no-faststart")
+    if not with_thumbnail:
+        command.append("--no-thumbnail")
+    async with _slots:
+        proc = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except BaseException:
+            proc.kill()
+            await proc.wait()
+            if os.path.exists(path + REMUX_MARKER):
+                raise Mp4Error(f"Interrupted while relocating moov in {path}")
+            raise
+    if os.path.exists(path + REMUX_MARKER):
+        raise Mp4Error(f"Relocating moov failed for {path}: {stderr.decode(errors='replace')[-200:]}")
+    if proc.returncode != 0:
+        logger.warning(f"Video preparation failed for {path}: {stderr.decode(errors='replace')[-200:]}")
+        return {}
+    try:
+        return json.loads(stdout)
+    except ValueError:
+        return {}
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    print(json.dumps(prepare(args[0], "--no-faststart" not in args, "--no-thumbnail" not in args)))
@@ -0,0 +1,185 @@
+import asyncio
+import os
+import time
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# ===== Telegram flood limits =====
+GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "25"))        # calls per second across all chats
+PRIVATE_CHAT_RATE = float(os.getenv("OUTBOX_PRIVATE_RATE", "1"))  # calls per second per private chat
+GROUP_CHAT_RATE = float(os.getenv("OUTBOX_GROUP_RATE", "0.33"))   # ~20 calls per minute per group/channel
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float = 1) -> float:
+        """Seconds until ``amount`` tokens are available (0 when they are available now)."""
+        self._refill()
+        return 0 if self.tokens >= amount else (amount - self.tokens) / self.rate
+
+    def take(self, amount: float = 1):
+        """Spend ``amount`` tokens; the balance may go negative, delaying later takers."""
+        self._refill()
+        self.tokens -= amount
+
+
+class Outbox:
+    """
+    Single outbound scheduler for Telegram calls.
+
+    Calls are queued per chat and released round-robin under a global and a
+    per-chat token bucket; they then run concurrently, so a long upload never
+    holds up other chats. Flood-control errors pause the chat for the requested
+    time and re-queue the call. Edits submitted with :meth:`edit_nowait` are
+    keyed by message: a newer edit replaces one that has not been sent yet.
+
+    ``call_factory`` arguments are zero-argument callables returning a fresh
+    awaitable, so a call can be retried after ``retry_after``.
+    """
+
+    def __init__(self, retry_after=lambda error: None, global_rate: float = GLOBAL_RATE,
+                 private_rate: float = PRIVATE_CHAT_RATE, group_rate: float = GROUP_CHAT_RATE):
+        self.retry_after = retry_after
+        self.global_bucket = TokenBucket(global_rate)
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.chat_buckets = {}
+        self.queues = {}
+        self.edits = {}
+        self.paused_until = {}
+        self.wakeup = asyncio.Event()
+        self.dispatcher = None
+        # Running calls; the loop only keeps weak references to tasks
+        self.tasks = set()
+        self.superseded = 0
+
+    def pending(self) -> int:
+        return sum(len(q) for q in self.queues.values())
+
+    async def call(self, chat_id: int, call_factory):
+        """Queue a call for ``chat_id`` and wait for its result."""
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(chat_id, {"factory": call_factory, "future": future, "key": None})
+        return await future
+
+    def edit_nowait(self, chat_id: int, key, call_factory):
+        """Queue a fire-and-forget edit, superseding any unsent edit with the same key."""
+        job = self.edits.get(key)
+        if job:
+            job["factory"] = call_factory
+            self.superseded += 1
+            return
+        job = {"factory": call_factory, "future": None, "key": key}
+        self.edits[key] = job
+        self._enqueue(chat_id, job)
+
+    def _enqueue(self, chat_id: int, job: dict, front: bool = False):
+        queue = self.queues.setdefault(chat_id, deque())
+        if front:
+            queue.appendleft(job)
+        else:
+            queue.append(job)
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self._dispatch())
+        self.wakeup.set()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            rate = self.private_rate if chat_id and chat_id > 0 else self.group_rate
+            bucket = self.chat_buckets[chat_id] = TokenBucket(rate, capacity=max(1.0, rate * 3))
+        return bucket
+
+    async def _dispatch(self):
+        while True:
+            wait = None
+            dispatched = False
+            now = time.monotonic()
+            for chat_id in list(self.queues):
+                queue = self.queues[chat_id]
+                if not queue:
+                    del self.queues[chat_id]
+                    continue
+                bucket = self._chat_bucket(chat_id)
+                chat_wait = max(self.paused_until.get(chat_id, 0) - now, bucket.wait_time())
+                if chat_wait > 0:
+                    wait = chat_wait if wait is None else min(wait, chat_wait)
+                    continue
+                global_wait = self.global_bucket.wait_time()
+                if global_wait > 0:
+                    wait = global_wait if wait is None else min(wait, global_wait)
+                    break
+                bucket.take()
+                self.global_bucket.take()
+                job = queue.popleft()
+                if job["key"] is not None:
+                    self.edits.pop(job["key"], None)
+                # Rotate the served chat to the back for round-robin fairness
+                self.queues[chat_id] = self.queues.pop(chat_id)
+                task = asyncio.create_task(self._run(chat_id, job))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+                dispatched = True
+            if dispatched:
+                await asyncio.sleep(0)
+                continue
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self):
+        """Stop dispatching, cancel running calls and fail every call still queued."""
+        running = list(self.tasks)
+        if self.dispatcher:
+            running.append(self.dispatcher)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        for queue in self.queues.values():
+            for job in queue:
+                if job["future"] is not None and not job["future"].done():
+                    job["future"].cancel()
+        self.queues.clear()
+        self.edits.clear()
+
+    async def _run(self, chat_id: int, job: dict):
+        try:
+            result = await job["factory"]()
+        except asyncio.CancelledError:
+            if job["future"] is not None and not job["future"].done():
+                job["future"].cancel()
+            raise
+        except Exception as e:
+            retry_after = self.retry_after(e)
+            if retry_after is not None:
+                logger.warning(f"Flood control for chat {chat_id}, pausing {retry_after}s")
+                self.paused_until[chat_id] = time.monotonic() + retry_after
+                if job["key"] is not None and job["key"] in self.edits:
+                    # A newer edit for the same message is already queued
+                    return
+                if job["key"] is not None:
+                    self.edits[job["key"]] = job
+                self._enqueue(chat_id, job, front=True)
+                return
+            if job["future"] is not None:
+                if not job["future"].done():
+                    job["future"].set_exception(e)
+            else:
+                logger.debug(f"Outbox edit for chat {chat_id} failed: {e}")
+            return
+        if job["future"] is not None and not job["future"].done():
+            job["future"].set_result(result)
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+from collections import deque
+from outbox import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+async def wait_event(event: asyncio.Event, timeout: float = None) -> bool:
+    """
+    Wait up to ``timeout`` seconds for ``event``; True once it is set.
+
+    Unlike ``asyncio.wait_for``, which cancels its inner wait on timeout and
+    may then swallow a cancellation arriving at the same moment (Python
+    < 3.12), ``asyncio.wait`` leaves the waiter alone, so a cancel of the
+    caller always propagates.
+    """
+    waiter = asyncio.ensure_future(event.wait())
+    try:
+        await asyncio.wait([waiter], timeout=timeout)
+    finally:
+        waiter.cancel()
+    return event.is_set()
+
+
+class _KeyQueue:
+    def __init__(self):
+        self.jobs = deque()
+        self.active = 0
+        self.weight = 1
+        self.credit = 0
+        self.bucket = None
+
+
+class FairQueue:
+    """
+    Drop-in for the ``asyncio.Queue`` of a :class:`Stage` that keeps one queue
+    per key (a chat) and serves them by weighted round-robin: a key takes up
+    to ``weight(job)`` jobs in a row before the next key gets its turn.
+
+    ``maxsize`` bounds each key's queue, so one key filling up only makes its
+    own ``put`` wait. A key is skipped while it has ``max_active`` jobs
+    running (0 = no limit) or, with ``byte_rate`` set, while its byte budget
+    is overdrawn: every job spends ``cost(job)`` bytes from a per-key token
+    bucket refilled at ``byte_rate`` bytes per second.
+    """
+
+    def __init__(self, key, weight=lambda job: 1, maxsize: int = 0, max_active: int = 0,
+                 byte_rate: float = 0, cost=lambda job: 0):
+        self.key = key
+        self.weight = weight
+        self.maxsize = maxsize
+        self.max_active = max_active
+        self.byte_rate = byte_rate
+        self.cost = cost
+        self.keys = {}
+        self.order = deque()
+        self.wakeup = asyncio.Event()
+        self.space = asyncio.Condition()
+
+    def qsize(self) -> int:
+        return sum(len(q.jobs) for q in self.keys.values())
+
+    def backlog(self) -> int:
+        """Keys with jobs waiting."""
+        return len(self.order)
+
+    async def put(self, job):
+        key = self.key(job)
+        async with self.space:
+            while True:
+                queue = self.keys.setdefault(key, _KeyQueue())
+                if not self.maxsize or len(queue.jobs) < self.maxsize:
+                    break
+                await self.space.wait()
+        queue.jobs.append(job)
+        queue.weight = max(1, self.weight(job))
+        if key not in self.order:
+            self.order.append(key)
+            queue.credit = queue.weight
+        self.wakeup.set()
+
+    async def get(self):
+        while True:
+            job, delay = self._take()
+            if job is not None:
+                return job
+            self.wakeup.clear()
+            await wait_event(self.wakeup, delay)
+
+    def task_done(self, job):
+        key = self.key(job)
+        queue = self.keys.get(key)
+        if queue:
+            queue.active -= 1
+            self._forget(key)
+        self.wakeup.set()
+
+    def _take(self):
+        """Next job by weighted round-robin, or ``(None, seconds until a byte budget refills)``."""
+        delay = None
+        for _ in range(len(self.order)):
+            key = self.order[0]
+            queue = self.keys[key]
+            if self.max_active and queue.active >= self.max_active:
+                self.order.rotate(-1)
+                continue
+            if self.byte_rate:
+                if queue.bucket is None:
+                    queue.bucket = TokenBucket(self.byte_rate)
+                wait = queue.bucket.wait_time()
+                if wait > 0:
+                    delay = wait if delay is None else min(delay, wait)
+                    self.order.rotate(-1)
+                    continue
+            job = queue.jobs.popleft()
+            queue.active += 1
+            queue.credit -= 1
+            if queue.bucket:
+                queue.bucket.take(self.cost(job))
+            if not queue.jobs:
+                self.order.popleft()
+            elif queue.credit <= 0:
+                queue.credit = queue.weight
+                self.order.rotate(-1)
+            if self.maxsize:
+                asyncio.ensure_future(self._notify_space())
+            return job, None
+        return None, delay
+
+    async def _notify_space(self):
+        async with self.space:
+            self.space.notify_all()
+
+    def _forget(self, key):
+        queue = self.keys[key]
+        # An overdrawn byte budget is kept so the quota survives idle gaps
+        if not queue.jobs and not queue.active and (queue.bucket is None or queue.bucket.wait_time(queue.bucket.capacity) == 0):
+            del self.keys[key]
+
+
+class Stage:
+    """
+    One pipeline stage: a bounded queue drained by a fixed pool of workers.
+
+    ``put`` waits while the queue is full, so a slow downstream stage pushes
+    back on whoever feeds it instead of piling up work in memory.
+    """
+
+    def __init__(self, name: str, handler, workers: int, queue_size: int, queue=None):
+        self.name = name
+        self.handler = handler
+        self.workers = workers
+        self.queue = queue or asyncio.Queue(maxsize=queue_size)
+        self.active = 0
+        self.processed = 0
+        self.tasks = []
+
+    async def put(self, job):
+        await self.queue.put(job)
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+            logger.info(f"Started {self.name} stage with {self.workers} workers (queue {self.queue.maxsize})")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def stats(self) -> dict:
+        fair = isinstance(self.queue, FairQueue)
+        return {
+            "queued": self.queue.qsize(),
+            "capacity": self.queue.maxsize,
+            "active": self.active,
+            "workers": self.workers,
+            "processed": self.processed,
+            # Chats with work waiting; capacity is then per chat
+            "chats": self.queue.backlog() if fair else None,
+        }
+
+    async def _work(self):
+        while True:
+            job = await self.queue.get()
+            self.active += 1
+            try:
+                await self.handler(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Unhandled error in {self.name} stage: {e}", exc_info=True)
+            finally:
+                self.active -= 1
+                self.processed += 1
+                if isinstance(self.queue, FairQueue):
+                    self.queue.task_done(job)
+                else:
+                    self.queue.task_done()
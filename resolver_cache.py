@@ -0,0 +1,110 @@
+import asyncio
+import os
+import re
+import math
+import time
+import logging
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+# ===== Cache tuning =====
+MAX_ENTRIES = int(os.getenv("RESOLVER_CACHE_SIZE", "2048"))
+META_TTL = int(os.getenv("RESOLVER_META_TTL", "3600"))
+URL_TTL = int(os.getenv("RESOLVER_URL_TTL", "600"))
+EXPIRY_MARGIN = 60
+
+DURATION_REGEX = re.compile(r"^(\d+)([smhd]?)$", re.IGNORECASE)
+DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def signed_url_expiry(url: str, default_ttl: int = URL_TTL) -> float:
+    """
+    Best-effort expiry timestamp of a signed download URL.
+
+    Understands absolute ``expires``/``Expires`` epochs, TeraBox style relative
+    ``expires=8h`` anchored on the ``time`` parameter and S3 style
+    ``X-Amz-Date`` + ``X-Amz-Expires``. Unknown URLs get ``default_ttl``.
+    A missing URL never expires, so it does not drag down the minimum over
+    a file's URLs; callers decide what having no URL at all means.
+    """
+    if not url:
+        return math.inf
+    now = time.time()
+    query = {k.lower(): v[0] for k, v in parse_qs(urlparse(url).query).items()}
+    expires = query.get("expires") or query.get("x-expires")
+    if expires:
+        match = DURATION_REGEX.match(expires.strip())
+        if match:
+            value = int(match.group(1))
+            if value > 1_000_000_000 and not match.group(2):
+                return value - EXPIRY_MARGIN
+            issued = int(query["time"]) if query.get("time", "").isdigit() else now
+            return issued + value * DURATION_UNITS[match.group(2).lower()] - EXPIRY_MARGIN
+    if query.get("x-amz-expires", "").isdigit() and query.get("x-amz-date"):
+        try:
+            issued = time.mktime(time.strptime(query["x-amz-date"], "%Y%m%dT%H%M%SZ")) - time.timezone
+            return issued + int(query["x-amz-expires"]) - EXPIRY_MARGIN
+        except ValueError:
+            pass
+    return now + default_ttl
+
+
+class ResolverCache:
+    """
+    Bounded LRU cache in front of a share resolver.
+
+    Entries keep the file list for ``meta_ttl`` seconds but the signed download
+    URLs inside them only until ``url_expiry(value)``. Concurrent misses for
+    the same key share a single ``fetch`` call.
+    """
+
+    def __init__(self, fetch, url_expiry, max_entries: int = MAX_ENTRIES, meta_ttl: int = META_TTL):
+        self.fetch = fetch
+        self.url_expiry = url_expiry
+        self.max_entries = max_entries
+        self.meta_ttl = meta_ttl
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, source_url: str, key: str = None, need_urls: bool = True, refresh: bool = False):
+        key = key or source_url
+        if refresh:
+            self.invalidate(key)
+        entry = self.entries.get(key)
+        now = time.time()
+        if entry and now < entry["meta_expires"] and (not need_urls or now < entry["url_expires"]):
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry["value"]
+        self.misses += 1
+        return await self._load(source_url, key)
+
+    def invalidate(self, key: str):
+        self.entries.pop(key, None)
+
+    async def _load(self, source_url: str, key: str):
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch_and_store(source_url, key))
+            self.inflight[key] = task
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _fetch_and_store(self, source_url: str, key: str):
+        value = await self.fetch(source_url)
+        if value:
+            now = time.time()
+            self.entries[key] = {
+                "value": value,
+                "meta_expires": now + self.meta_ttl,
+                "url_expires": self.url_expiry(value),
+            }
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                evicted, _ = self.entries.popitem(last=False)
+                logger.debug(f"Evicted resolver cache entry {evicted}")
+        return value
@@ -0,0 +1,40 @@
+import re
+
+# ===== TeraBox share links =====
+# Every domain TeraBox serves shares from; matched as the registrable part of the host
+DOMAINS = (
+    "terabox", "teraboxapp", "teraboxshare", "teraboxlink", "teraboxurl", "terasharefile", "terasharelink",
+    "1024tera", "1024terabox", "freeterabox", "nephobox", "mirrobox", "momerybox", "4funbox", "terafileshare",
+)
+
+# The host is matched label by label, so a scan never runs past the first "/" looking for a
+# domain (the old lazy ``https?://[^\s]*?(...)`` retried every position of the rest of the word)
+LINK_REGEX = re.compile(
+    r"https?://(?:[a-z0-9-]+\.)*(?:" + "|".join(DOMAINS) + r")(?:\.[a-z]{2,})+(?:[/?#][^\s<>\"']*)?",
+    re.IGNORECASE,
+)
+# "/s/1<id>" and "?surl=<id>" name the same share; the "1" prefix only appears in the path form.
+# Any case matches ("/S/1..."), but the id keeps its own: share ids are case-sensitive
+SHARE_KEY_REGEX = re.compile(r"(?:/s/1?|[?&]surl=)([\w-]+)", re.IGNORECASE)
+TRAILING_PUNCTUATION = ".,!?;:)]}'\"*`"  # never "_" or "-", share ids may end in them
+
+
+def share_key(url: str):
+    """Canonical share id of a TeraBox link, identical across domains and URL shapes; None if it has none."""
+    match = SHARE_KEY_REGEX.search(url)
+    return match.group(1) if match else None
+
+
+def extract_links(text: str) -> list:
+    """
+    TeraBox links in ``text`` as ``(key, url)`` pairs, first occurrence per
+    share only. Trailing punctuation is trimmed from each URL; a link without
+    a recognisable share id is keyed by its URL.
+    """
+    links = {}
+    for match in LINK_REGEX.finditer(text):
+        url = match.group(0).rstrip(TRAILING_PUNCTUATION)
+        key = share_key(url) or url
+        if key not in links:
+            links[key] = url
+    return list(links.items())
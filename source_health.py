@@ -0,0 +1,149 @@
+import asyncio
+import os
+import time
+import logging
+from urllib.parse import urlsplit
+import downloader
+
+logger = logging.getLogger(__name__)
+
+# ===== Source selection =====
+HEALTH_ALPHA = float(os.getenv("SOURCE_HEALTH_ALPHA", "0.3"))        # weight of the newest sample
+HEALTH_TTL = int(os.getenv("SOURCE_HEALTH_TTL", "900"))              # forget sources not used for this long
+HEDGE_DOWNLOADS = os.getenv("HEDGE_DOWNLOADS", "").lower() in ("1", "true", "yes")
+HEDGE_AFTER = float(os.getenv("HEDGE_AFTER", "15"))                  # seconds before judging the first source
+HEDGE_FLOOR = float(os.getenv("HEDGE_FLOOR_MBPS", "1")) * 1024 * 1024  # bytes/s below which a second source starts
+MIN_SUCCESS_RATE = 0.05
+
+
+class SourceStats:
+    def __init__(self):
+        self.throughput = None  # bytes/s, EWMA over successful attempts
+        self.ttfb = None        # seconds, EWMA over every attempt that got a response
+        self.error_rate = 0.0   # EWMA of 0 (success) / 1 (failure)
+        self.samples = 0
+        self.updated = 0.0
+
+    def expected_seconds(self, size: int):
+        """Expected time to fetch ``size`` bytes including retries, or None without throughput data."""
+        if not self.throughput:
+            return None
+        attempt = (self.ttfb or 0) + size / self.throughput
+        return attempt / max(MIN_SUCCESS_RATE, 1 - self.error_rate)
+
+
+def _ewma(old, new: float, alpha: float) -> float:
+    return new if old is None else alpha * new + (1 - alpha) * old
+
+
+class SourceHealth:
+    """
+    Scores download sources on recent throughput, time-to-first-byte and error
+    rate, per kind ("proxified", "direct"...) and per (kind, host).
+
+    :meth:`rank` orders candidates by expected transfer time; sources without
+    data are ranked like the best known one, so the configured order decides
+    until there is something to go on and new hosts still get tried.
+    """
+
+    def __init__(self, alpha: float = HEALTH_ALPHA, ttl: int = HEALTH_TTL):
+        self.alpha = alpha
+        self.ttl = ttl
+        self.sources = {}
+
+    @staticmethod
+    def host(url: str) -> str:
+        return urlsplit(url or "").hostname or ""
+
+    def _stats(self, key) -> SourceStats:
+        stats = self.sources.get(key)
+        if stats is None or time.time() - stats.updated > self.ttl:
+            stats = self.sources[key] = SourceStats()
+        return stats
+
+    def _keys(self, kind: str, url: str):
+        return [(kind, self.host(url)), (kind, "*")]
+
+    def record_success(self, kind: str, url: str, size: int, seconds: float, ttfb: float = None):
+        if size <= 0 or seconds <= 0:
+            return
+        for key in self._keys(kind, url):
+            stats = self._stats(key)
+            stats.throughput = _ewma(stats.throughput, size / seconds, self.alpha)
+            if ttfb is not None:
+                stats.ttfb = _ewma(stats.ttfb, ttfb, self.alpha)
+            stats.error_rate = _ewma(stats.error_rate, 0.0, self.alpha)
+            stats.samples += 1
+            stats.updated = time.time()
+
+    def record_failure(self, kind: str, url: str, ttfb: float = None):
+        for key in self._keys(kind, url):
+            stats = self._stats(key)
+            if ttfb is not None:
+                stats.ttfb = _ewma(stats.ttfb, ttfb, self.alpha)
+            stats.error_rate = _ewma(stats.error_rate, 1.0, self.alpha)
+            stats.samples += 1
+            stats.updated = time.time()
+
+    def expected_seconds(self, kind: str, url: str, size: int):
+        for key in self._keys(kind, url):
+            stats = self.sources.get(key)
+            if stats and time.time() - stats.updated <= self.ttl:
+                if stats.throughput:
+                    return stats.expected_seconds(size)
+                if stats.error_rate > 0:
+                    # Only failures so far: rank behind untried and delivering sources
+                    return float("inf")
+        return None
+
+    def rank(self, candidates, size: int = 0) -> list:
+        """Sort ``(kind, url)`` candidates best first; URL-less candidates are dropped."""
+        candidates = [(kind, url) for kind, url in candidates if url]
+        size = size or 100 * 1024 * 1024
+        estimates = [self.expected_seconds(kind, url, size) for kind, url in candidates]
+        known = [e for e in estimates if e is not None]
+        best = min(known) if known else 0
+        order = sorted(range(len(candidates)), key=lambda i: best if estimates[i] is None else estimates[i])
+        ranked = [candidates[i] for i in order]
+        if ranked and ranked[0] != candidates[0]:
+            logger.info(f"Source health prefers {ranked[0][0]} ({self.host(ranked[0][1])}) over {candidates[0][0]}")
+        return ranked
+
+    def snapshot(self) -> list:
+        """Per-kind and per-host stats, freshest first, for /stats and metrics."""
+        rows = []
+        for (kind, host), stats in self.sources.items():
+            if time.time() - stats.updated > self.ttl:
+                continue
+            rows.append({
+                "kind": kind,
+                "host": host,
+                "throughput": stats.throughput or 0,
+                "ttfb": stats.ttfb or 0,
+                "error_rate": stats.error_rate,
+                "samples": stats.samples,
+                "updated": stats.updated,
+            })
+        rows.sort(key=lambda r: r["updated"], reverse=True)
+        return rows
+
+
+async def tracked_download(health: SourceHealth, kind: str, url: str, path: str, **kwargs) -> int:
+    """:func:`downloader.download` that feeds the attempt's outcome into ``health``."""
+    timings = {}
+    resumed = downloader.completed_bytes(path)
+    started = time.monotonic()
+    try:
+        total = await downloader.download(url, path, timings=timings, **kwargs)
+    except asyncio.CancelledError:
+        # Lost a hedge race: what it managed so far is still a throughput sample
+        fetched = downloader.completed_bytes(path) - resumed
+        if fetched > 0:
+            health.record_success(kind, url, fetched, time.monotonic() - started, timings.get("ttfb"))
+        raise
+    except Exception:
+        health.record_failure(kind, url, timings.get("ttfb"))
+        raise
+    fetched = downloader.completed_bytes(path) - resumed
+    health.record_success(kind, url, fetched, time.monotonic() - started, timings.get("ttfb"))
+    return total
@@ -0,0 +1,224 @@
+import asyncio
+import fcntl
+import os
+import re
+import shutil
+import socket
+import tempfile
+import uuid
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# ===== Spool configuration =====
+SPOOL_DIR = os.getenv("SPOOL_DIR", os.path.join(tempfile.gettempdir(), "teraspool"))
+SPOOL_BUDGET_MB = int(os.getenv("SPOOL_BUDGET_MB", "20480"))
+SPOOL_MIN_FREE_MB = int(os.getenv("SPOOL_MIN_FREE_MB", "1024"))
+
+SUFFIX_REGEX = re.compile(r"^\.[A-Za-z0-9]{1,8}$")
+# Per-process directories, "spool-<host>-<pid>", each with a "<dir>.lock" its owner holds locked.
+# Host and lock keep processes of several containers on one shared volume apart: their pids may collide.
+DIRECTORY_REGEX = re.compile(r"^spool-[A-Za-z0-9._-]+-\d+(\.lock)?$")
+
+
+def directory_name() -> str:
+    """Spool directory name of this process."""
+    host = re.sub(r"[^A-Za-z0-9._-]", "_", socket.gethostname()) or "host"
+    return f"spool-{host}-{os.getpid()}"
+
+
+def disk_usage(path: str) -> int:
+    """Allocated bytes of ``path`` (``st_blocks``), 0 when it is missing."""
+    try:
+        return os.stat(path).st_blocks * 512
+    except OSError:
+        return 0
+
+
+class Reservation:
+    def __init__(self, spool, path: str, size: int):
+        self.spool = spool
+        self.path = path
+        self.size = size
+        self.released = False
+
+    def written(self) -> int:
+        """Bytes the file occupies on disk. Not its size: downloads size the file before any data arrives."""
+        return disk_usage(self.path)
+
+    def release(self):
+        """Delete the spooled file (and anything sharing its name) and return the bytes to the budget."""
+        if self.released:
+            return
+        self.released = True
+        for name in os.listdir(self.spool.directory):
+            if name.startswith(os.path.basename(self.path)):
+                try:
+                    os.unlink(os.path.join(self.spool.directory, name))
+                except OSError:
+                    pass
+        self.spool._release(self)
+
+
+class Spool:
+    """
+    Disk spool for downloads.
+
+    Every file gets a unique path under a per-process directory and must
+    reserve its expected size first. Reservations wait in FIFO order while the
+    byte budget is used up or the disk is short of free space. A file larger
+    than the whole budget is admitted only when nothing else is reserved.
+
+    The directory stays locked while the process lives, so
+    :meth:`cleanup_orphans` only removes directories whose owner is gone and
+    never touches anything else under ``root``.
+    """
+
+    def __init__(self, root: str = SPOOL_DIR, budget_mb: int = SPOOL_BUDGET_MB, min_free_mb: int = SPOOL_MIN_FREE_MB):
+        self.root = root
+        self.directory = os.path.join(root, directory_name())
+        self.budget = budget_mb * 1024 * 1024
+        self.min_free = min_free_mb * 1024 * 1024
+        self.reservations = set()
+        self.waiters = deque()
+        os.makedirs(root, exist_ok=True)
+        # Locked before the directory exists and held until exit; the kernel drops it when we die
+        self.lock_fd = _hold(self.directory + ".lock")
+        os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def reserved(self) -> int:
+        return sum(r.size for r in self.reservations)
+
+    def cleanup_orphans(self):
+        """Remove spool directories of processes that are gone (and files of an earlier run under our name)."""
+        removed = 0
+        owners = {entry.removesuffix(".lock") for entry in os.listdir(self.root) if DIRECTORY_REGEX.match(entry)}
+        for entry in owners:
+            entry_path = os.path.join(self.root, entry)
+            if entry_path == self.directory:
+                if not self.reservations:
+                    removed += _clear(entry_path)
+                continue
+            try:
+                lock_fd = _lock(entry_path + ".lock", wait=False)
+            except OSError:
+                continue
+            if lock_fd is None:
+                continue
+            try:
+                if os.path.isdir(entry_path):
+                    removed += _clear(entry_path)
+                    shutil.rmtree(entry_path, ignore_errors=True)
+                os.unlink(entry_path + ".lock")
+            except OSError:
+                pass
+            finally:
+                os.close(lock_fd)
+        if removed:
+            logger.info(f"Removed {removed} orphaned spool file(s) from {self.root}")
+
+    def _fits(self, size: int) -> bool:
+        if not self.reservations:
+            return True
+        if self.reserved + size > self.budget:
+            return False
+        unwritten = sum(max(0, r.size - r.written()) for r in self.reservations)
+        free = shutil.disk_usage(self.directory).free
+        return free - unwritten - size >= self.min_free
+
+    def _new_path(self, filename: str) -> str:
+        suffix = os.path.splitext(filename or "")[1]
+        if not SUFFIX_REGEX.match(suffix):
+            suffix = ""
+        return os.path.join(self.directory, f"{uuid.uuid4().hex}{suffix}")
+
+    def try_reserve(self, size: int, filename: str = ""):
+        """Reserve without waiting; None if the budget cannot take ``size`` right now."""
+        if self.waiters or not self._fits(size):
+            return None
+        reservation = Reservation(self, self._new_path(filename), size)
+        self.reservations.add(reservation)
+        return reservation
+
+    async def reserve(self, size: int, filename: str = "") -> Reservation:
+        reservation = self.try_reserve(size, filename)
+        if reservation:
+            return reservation
+        future = asyncio.get_running_loop().create_future()
+        waiter = (size, filename, future)
+        self.waiters.append(waiter)
+        logger.info(f"Spool budget full, queued {filename or 'download'} ({size / (1024 * 1024):.1f} MB)")
+        try:
+            return await future
+        except asyncio.CancelledError:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            elif future.done() and not future.cancelled():
+                future.result().release()
+            raise
+
+    def _release(self, reservation: Reservation):
+        self.reservations.discard(reservation)
+        while self.waiters:
+            size, filename, future = self.waiters[0]
+            if future.done():
+                self.waiters.popleft()
+                continue
+            if not self._fits(size):
+                break
+            self.waiters.popleft()
+            granted = Reservation(self, self._new_path(filename), size)
+            self.reservations.add(granted)
+            future.set_result(granted)
+
+    def stats(self) -> dict:
+        return {
+            "files": len(self.reservations),
+            "reserved": self.reserved,
+            "budget": self.budget,
+            "waiting": len(self.waiters),
+        }
+
+
+_held = {}
+
+
+def _hold(path: str) -> int:
+    """Lock ``path`` for the life of the process; flock would make a second Spool here wait on the first."""
+    if path not in _held:
+        _held[path] = _lock(path, wait=True)
+    return _held[path]
+
+
+def _lock(path: str, wait: bool):
+    """
+    Open and lock ``path``; None when ``wait`` is False and another process holds it.
+    A lock taken on a file that a cleanup unlinked meanwhile protects nothing, so that is retried.
+    """
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        try:
+            if os.path.samestat(os.fstat(fd), os.stat(path)):
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+
+def _clear(directory: str) -> int:
+    """Delete the files in ``directory``; returns how many went."""
+    removed = 0
+    for name in os.listdir(directory):
+        try:
+            os.unlink(os.path.join(directory, name))
+            removed += 1
+        except OSError:
+            pass
+    return removed
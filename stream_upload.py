@@ -0,0 +1,96 @@
+import asyncio
+import os
+import time
+import logging
+from aiogram.types import InputFile
+from http_client import get_session, TRANSFER_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+# ===== Streaming upload tuning =====
+STREAM_UPLOADS = os.getenv("STREAM_UPLOADS", "").lower() in ("1", "true", "yes")
+STREAM_BUFFER_MB = int(os.getenv("STREAM_BUFFER_MB", "16"))
+STREAM_UPLOAD_TIMEOUT = int(os.getenv("STREAM_UPLOAD_TIMEOUT", "3600"))
+CHUNK_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 5
+
+
+class StreamUnavailable(Exception):
+    pass
+
+
+class PipeInputFile(InputFile):
+    """InputFile whose bytes come from a bounded queue fed by a download in progress."""
+
+    def __init__(self, filename: str, queue: asyncio.Queue):
+        super().__init__(filename=filename, chunk_size=CHUNK_SIZE)
+        self.queue = queue
+        self.consumed = False
+
+    async def read(self, bot):
+        # The queue can only be drained once, a retried request must fall back to spooling
+        if self.consumed:
+            raise StreamUnavailable("stream already consumed")
+        self.consumed = True
+        while True:
+            chunk = await self.queue.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield chunk
+
+
+async def stream_upload(url: str, filename: str, send, headers: dict = None, progress=None):
+    """
+    Pipe ``url`` straight into an upload without touching the disk.
+
+    ``send`` is ``async (input_file) -> result`` and performs the Telegram call.
+    Raises :class:`StreamUnavailable` before anything is sent when the server
+    does not announce a Content-Length; the caller should spool instead. Any
+    error while reading the source fails the upload request with it.
+    """
+    request_headers = dict(headers or {})
+    request_headers["Accept-Encoding"] = "identity"
+    session = get_session()
+    async with session.get(url, headers=request_headers, timeout=TRANSFER_TIMEOUT) as resp:
+        if resp.status != 200:
+            raise StreamUnavailable(f"HTTP Status {resp.status}")
+        total = int(resp.headers.get("Content-Length", 0))
+        if not total:
+            raise StreamUnavailable("unknown content length")
+
+        queue = asyncio.Queue(maxsize=max(1, STREAM_BUFFER_MB * 1024 * 1024 // CHUNK_SIZE))
+        state = {"downloaded": 0}
+        start_time = time.time()
+
+        async def pump():
+            try:
+                async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                    await queue.put(chunk)
+                    state["downloaded"] += len(chunk)
+                if state["downloaded"] != total:
+                    raise StreamUnavailable(f"source ended at byte {state['downloaded']} of {total}")
+                await queue.put(None)
+            except Exception as e:
+                await queue.put(e)
+
+        async def report():
+            while True:
+                await asyncio.sleep(PROGRESS_INTERVAL)
+                try:
+                    await progress(state["downloaded"], total)
+                except Exception as e:
+                    logger.debug(f"Progress callback failed: {e}")
+
+        pump_task = asyncio.create_task(pump())
+        reporter = asyncio.create_task(report()) if progress else None
+        try:
+            result = await send(PipeInputFile(filename, queue))
+        finally:
+            pump_task.cancel()
+            if reporter:
+                reporter.cancel()
+        elapsed = time.time() - start_time
+        logger.info(f"Streamed {filename} ({total / (1024 * 1024):.1f} MB) in {elapsed:.1f}s")
+        return result
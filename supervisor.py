@@ -0,0 +1,106 @@
+import asyncio
+import os
+import signal
+import sys
+import time
+import logging
+from spool import SPOOL_BUDGET_MB
+from pipeline import wait_event
+
+logger = logging.getLogger(__name__)
+
+# ===== Supervisor =====
+# Runs bot1.py as one frontend (Telegram updates → job queue) plus WORKERS
+# worker processes, each on its own event loop (uvloop when installed) and
+# claiming only its shard of the job queue, so downloads use every core.
+# SIGTERM is forwarded to every child, which stops claiming, gives running
+# jobs DRAIN_SECONDS to finish and hands the rest back to the queue.
+WORKERS = int(os.getenv("WORKERS", str(os.cpu_count() or 1)))
+FRONTEND = os.getenv("SUPERVISOR_FRONTEND", "1").lower() in ("1", "true", "yes")
+DRAIN_SECONDS = float(os.getenv("DRAIN_SECONDS", "60"))
+STOP_GRACE = 15  # seconds past the drain before a child is killed
+RESTART_BACKOFF = 1
+RESTART_BACKOFF_MAX = 60
+STABLE_AFTER = 60  # a child that ran this long restarts without backoff
+ENTRY_POINT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot1.py")
+
+
+def child_env(role: str, shard: int = 0) -> dict:
+    env = dict(os.environ, BOT_ROLE=role, WORKER_SHARDS=str(WORKERS), WORKER_SHARD=str(shard))
+    # Each process serves its own /metrics: frontend on METRICS_PORT, worker i on METRICS_PORT + 1 + i
+    metrics_port = int(os.getenv("METRICS_PORT", "9100"))
+    if metrics_port and role == "worker":
+        env["METRICS_PORT"] = str(metrics_port + 1 + shard)
+    # Workers split the disk budget (the default one too) instead of each assuming all of it
+    if role == "worker":
+        env["SPOOL_BUDGET_MB"] = str(max(1, SPOOL_BUDGET_MB // WORKERS))
+    return env
+
+
+class Child:
+    def __init__(self, name: str, env: dict):
+        self.name = name
+        self.env = env
+        self.proc = None
+        self.started_at = 0.0
+        self.restarts = 0
+
+    async def start(self):
+        self.proc = await asyncio.create_subprocess_exec(sys.executable, ENTRY_POINT, env=self.env)
+        self.started_at = time.monotonic()
+        logger.info(f"Started {self.name} (pid {self.proc.pid})")
+
+    def signal(self, sig):
+        if self.proc and self.proc.returncode is None:
+            self.proc.send_signal(sig)
+
+
+class Supervisor:
+    def __init__(self, workers: int = WORKERS, frontend: bool = FRONTEND):
+        self.children = [Child(f"worker {i + 1}/{workers}", child_env("worker", i)) for i in range(workers)]
+        if frontend:
+            self.children.insert(0, Child("frontend", child_env("frontend")))
+        self.stopping = asyncio.Event()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stopping.set)
+        await asyncio.gather(*(self._keep_alive(child) for child in self.children))
+
+    async def _keep_alive(self, child: Child):
+        """Run ``child`` until shutdown, restarting it with backoff when it exits on its own."""
+        backoff = RESTART_BACKOFF
+        while not self.stopping.is_set():
+            await child.start()
+            exited = asyncio.ensure_future(child.proc.wait())
+            stopping = asyncio.ensure_future(self.stopping.wait())
+            await asyncio.wait([exited, stopping], return_when=asyncio.FIRST_COMPLETED)
+            stopping.cancel()
+            if self.stopping.is_set():
+                exited.cancel()
+                await self._stop(child)
+                return
+            if time.monotonic() - child.started_at >= STABLE_AFTER:
+                backoff = RESTART_BACKOFF
+            child.restarts += 1
+            logger.error(f"{child.name} exited with {child.proc.returncode}, restarting in {backoff}s")
+            await wait_event(self.stopping, backoff)
+            backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+
+    async def _stop(self, child: Child):
+        """SIGTERM lets the child drain; it is killed if it outlives the drain by ``STOP_GRACE``."""
+        child.signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(child.proc.wait(), DRAIN_SECONDS + STOP_GRACE)
+            logger.info(f"{child.name} stopped ({child.proc.returncode})")
+        except asyncio.TimeoutError:
+            logger.warning(f"{child.name} did not stop in time, killing it")
+            child.signal(signal.SIGKILL)
+            await child.proc.wait()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - supervisor - %(levelname)s - %(message)s")
+    logger.info(f"Supervising {WORKERS} worker(s){' and a frontend' if FRONTEND else ''}")
+    asyncio.run(Supervisor().run())
@@ -0,0 +1,70 @@
+"""
+Synthetic MP4 files for the ``mp4meta`` tests and benchmark: ``ftyp``,
+``mdat``, then ``moov`` at the end, with every chunk starting with a tag and
+its index so moved chunk offsets can be checked.
+"""
+import os
+import struct
+
+import mp4meta
+
+CHUNK_TAG = b"CHNK"
+WIDTH, HEIGHT, TIMESCALE = 1920, 1080, 90000
+
+
+def box(kind: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", len(payload) + 8, kind) + payload
+
+
+def full_box(kind: bytes, version: int, payload: bytes) -> bytes:
+    return box(kind, struct.pack(">I", version << 24) + payload)
+
+
+def build_moov(offsets: list, duration_s: int) -> bytes:
+    wide = offsets and max(offsets) > 0xFFFFFFFF
+    matrix = struct.pack(">9i", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+    mvhd = full_box(b"mvhd", 0, struct.pack(">IIII", 0, 0, TIMESCALE, duration_s * TIMESCALE)
+                    + struct.pack(">IH", 0x10000, 0x100) + b"\0" * 10 + matrix + b"\0" * 24 + struct.pack(">I", 2))
+    tkhd = full_box(b"tkhd", 0, struct.pack(">IIIII", 0, 0, 1, 0, duration_s * TIMESCALE)
+                    + b"\0" * 8 + struct.pack(">HHHH", 0, 0, 0, 0) + matrix + struct.pack(">II", WIDTH << 16, HEIGHT << 16))
+    mdhd = full_box(b"mdhd", 0, struct.pack(">IIII", 0, 0, TIMESCALE, duration_s * TIMESCALE) + b"\0" * 4)
+    hdlr = full_box(b"hdlr", 0, b"\0" * 4 + b"vide" + b"\0" * 12 + b"VideoHandler\0")
+    chunk_offsets = full_box(b"co64" if wide else b"stco", 0,
+                             struct.pack(f">I{len(offsets)}{'Q' if wide else 'I'}", len(offsets), *offsets))
+    stbl = box(b"stbl", chunk_offsets)
+    minf = box(b"minf", stbl)
+    mdia = box(b"mdia", mdhd + hdlr + minf)
+    trak = box(b"trak", tkhd + mdia)
+    return box(b"moov", mvhd + trak)
+
+
+def write_sample(path: str, size: int, chunk: int) -> int:
+    """Write ftyp + mdat + moov; every chunk starts with its tag and index. Returns the chunk count."""
+    ftyp = box(b"ftyp", b"isom" + struct.pack(">I", 512) + b"isomiso2avc1mp41")
+    count = max(1, size // chunk)
+    filler = bytes(range(256)) * (chunk // 256)
+    offsets = []
+    with open(path, "wb") as f:
+        f.write(ftyp)
+        f.write(struct.pack(">I4sQ", 1, b"mdat", 16 + count * chunk))
+        for i in range(count):
+            offsets.append(f.tell())
+            f.write(CHUNK_TAG + struct.pack(">Q", i) + filler[12:])
+        f.write(build_moov(offsets, duration_s=count * 2))
+    return count
+
+
+def check_offsets(path: str, count: int) -> bool:
+    with open(path, "rb") as f:
+        atoms = mp4meta.top_level_atoms(f, os.path.getsize(path))
+        offset, size = next((o, s) for kind, o, s in atoms if kind == b"moov")
+        f.seek(offset)
+        moov = mp4meta.parse_boxes(f.read(size))[0][1]
+        table = next(mp4meta._walk(moov, (b"stco", b"co64")))
+        wide = table[0] == b"co64"
+        offsets = struct.unpack_from(f">{count}{'Q' if wide else 'I'}", table[1], 8)
+        for i, chunk_offset in enumerate(offsets):
+            f.seek(chunk_offset)
+            if f.read(12) != CHUNK_TAG + struct.pack(">Q", i):
+                return False
+    return True
@@ -0,0 +1,68 @@
+import asyncio
+import os
+
+import pytest
+
+import disk_writer
+
+
+def flaky_pwrite(monkeypatch, failing: bytes):
+    """Make os.pwrite fail (ENOSPC) once, on the write of ``failing``."""
+    real = os.pwrite
+    state = {"failed": False}
+
+    def pwrite(fd, data, offset):
+        if bytes(data) == failing and not state["failed"]:
+            state["failed"] = True
+            raise OSError(28, "No space left on device")
+        return real(fd, data, offset)
+    monkeypatch.setattr(os, "pwrite", pwrite)
+
+
+def test_segments_write_at_their_offsets(tmp_path):
+    path = str(tmp_path / "file")
+
+    async def run():
+        with disk_writer.FileWriter(path) as file:
+            await file.preallocate(8)
+            first, second = file.segment(0), file.segment(4)
+            for segment, data in ((first, b"ab"), (second, b"EF"), (first, b"cd"), (second, b"GH")):
+                await segment.write(data)
+            await first.close()
+            await second.close()
+            return first.written, second.written
+    assert asyncio.run(run()) == (4, 8)
+    assert open(path, "rb").read() == b"abcdEFGH"
+
+
+def test_failed_write_stops_the_segment(tmp_path, monkeypatch):
+    path = str(tmp_path / "file")
+    flaky_pwrite(monkeypatch, b"BB")
+
+    async def run():
+        with disk_writer.FileWriter(path) as file:
+            segment = disk_writer.SegmentWriter(file, 0, coalesce=2)
+            with pytest.raises(OSError):
+                for data in (b"AA", b"BB", b"CC"):
+                    await segment.write(data)
+            # Neither a later write nor the close in a finally block may write past the hole
+            with pytest.raises(OSError):
+                await segment.write(b"DD")
+            await segment.close()
+            return segment.written
+    assert asyncio.run(run()) == 2
+    assert open(path, "rb").read() == b"AA"
+
+
+def test_failed_flush_is_reported_by_close(tmp_path, monkeypatch):
+    path = str(tmp_path / "file")
+    flaky_pwrite(monkeypatch, b"AB")
+
+    async def run():
+        with disk_writer.FileWriter(path) as file:
+            segment = disk_writer.SegmentWriter(file, 0, coalesce=4)
+            await segment.write(b"AB")
+            with pytest.raises(OSError):
+                await segment.close()
+            return segment.written
+    assert asyncio.run(run()) == 0
@@ -0,0 +1,58 @@
+import downloader
+from downloader import merge_ranges, missing_ranges, plan_segments
+
+
+def test_merge_ranges_joins_overlapping_and_adjacent():
+    assert merge_ranges([(10, 19), (0, 4), (5, 9), (15, 30), (40, 49)]) == [(0, 30), (40, 49)]
+
+
+def test_merge_ranges_drops_empty_ranges():
+    assert merge_ranges([(5, 4), (0, 0)]) == [(0, 0)]
+
+
+def test_missing_ranges_are_the_gaps():
+    assert missing_ranges([(0, 9), (20, 29)], 40) == [(10, 19), (30, 39)]
+    assert missing_ranges([], 10) == [(0, 9)]
+    assert missing_ranges([(0, 9)], 10) == []
+
+
+def test_plan_covers_missing_bytes_exactly_once():
+    mb = 1024 * 1024
+    missing = [(0, 100 * mb - 1), (150 * mb, 151 * mb - 1)]
+    plan = plan_segments(missing, segments=8)
+    assert merge_ranges(plan) == missing
+    assert sum(end - start + 1 for start, end in plan) == 101 * mb
+    # No overlaps: pieces of one gap follow each other
+    pieces = sorted(plan)
+    assert all(a[1] < b[0] for a, b in zip(pieces, pieces[1:]))
+
+
+def test_plan_does_not_leave_a_tiny_tail():
+    size = downloader.MIN_SEGMENT_SIZE
+    plan = plan_segments([(0, size + size // 4 - 1)], segments=8)
+    assert plan == [(0, size + size // 4 - 1)]
+
+
+def test_resume_plans_only_what_the_manifest_lacks(tmp_path):
+    path = str(tmp_path / "video.mp4")
+    total = 64 * 1024 * 1024
+    with open(path, "wb") as f:
+        f.truncate(total)
+    downloader.save_manifest(path, total, [(0, 9), (10, 1023), (2048, total - 1)])
+    manifest = downloader.load_manifest(path)
+    assert manifest["total"] == total
+    assert missing_ranges(manifest["done"], total) == [(1024, 2047)]
+    assert plan_segments(missing_ranges(manifest["done"], total)) == [(1024, 2047)]
+    assert downloader.completed_bytes(path) == total - 1024
+    assert not downloader.verify(path)
+
+    downloader.save_manifest(path, total, manifest["done"] + [(1024, 2047)])
+    assert downloader.verify(path)
+
+
+def test_verify_rejects_a_file_of_the_wrong_size(tmp_path):
+    path = str(tmp_path / "video.mp4")
+    with open(path, "wb") as f:
+        f.write(b"x" * 10)
+    downloader.save_manifest(path, 20, [(0, 19)])
+    assert not downloader.verify(path)
@@ -0,0 +1,67 @@
+import os
+import struct
+
+import mp4meta
+from tests.mp4_samples import CHUNK_TAG, box, build_moov, check_offsets, write_sample
+
+
+def chunk_offsets(path: str):
+    """(table kind, offsets) of the first chunk offset table and the top-level atom order."""
+    with open(path, "rb") as f:
+        atoms = mp4meta.top_level_atoms(f, os.path.getsize(path))
+        offset, size = next((o, s) for kind, o, s in atoms if kind == b"moov")
+        f.seek(offset)
+        moov = mp4meta.parse_boxes(f.read(size))[0][1]
+    kind, body = next(mp4meta._walk(moov, (b"stco", b"co64")))
+    count = struct.unpack_from(">I", body, 4)[0]
+    offsets = struct.unpack_from(f">{count}{'Q' if kind == b'co64' else 'I'}", body, 8)
+    return kind, list(offsets), [kind for kind, _, _ in atoms]
+
+
+def test_faststart_moves_moov_and_keeps_chunk_offsets(tmp_path):
+    path = str(tmp_path / "video.mp4")
+    count = write_sample(path, 64 * 1024, 4096)
+    before = mp4meta.prepare(path, relocate=False, with_thumbnail=False)
+
+    assert mp4meta.faststart(path)
+    kind, _, order = chunk_offsets(path)
+    assert kind == b"stco"
+    assert order.index(b"moov") < order.index(b"mdat")
+    assert check_offsets(path, count)
+    assert not os.path.exists(path + mp4meta.REMUX_MARKER)
+    # Already faststart: nothing to do, and the metadata is unchanged
+    assert not mp4meta.faststart(path)
+    after = mp4meta.prepare(path, relocate=False, with_thumbnail=False)
+    assert {k: after[k] for k in ("duration", "width", "height")} == {k: before[k] for k in ("duration", "width", "height")}
+
+
+def test_shift_offsets_widens_stco_past_4gb():
+    moov = mp4meta.parse_boxes(build_moov([100, 0xFFFFFF00], duration_s=10))[0][1]
+    mp4meta._shift_offsets(moov, 0x200)
+    kind, body = next(mp4meta._walk(moov, (b"stco", b"co64")))
+    assert kind == b"co64"
+    assert struct.unpack_from(">I2Q", body, 4) == (2, 100 + 0x200, 0xFFFFFF00 + 0x200)
+
+
+def test_faststart_relocation_to_co64(tmp_path):
+    """Offsets near 4 GB overflow 32 bits once moov moves in front, so stco has to become co64."""
+    path = str(tmp_path / "video.mp4")
+    ftyp = box(b"ftyp", b"isom" + struct.pack(">I", 512) + b"isomiso2avc1mp41")
+    chunk = CHUNK_TAG + struct.pack(">Q", 0) + b"\0" * 500
+    real_offset = len(ftyp) + 8
+    mdat = box(b"mdat", chunk)
+    # The second offset only exists in the table: faststart rewrites offsets, it never reads the chunks
+    far_offset = 0xFFFFFFFF - 16
+    with open(path, "wb") as f:
+        f.write(ftyp + mdat + build_moov([real_offset, far_offset], duration_s=10))
+
+    assert mp4meta.faststart(path)
+    kind, offsets, order = chunk_offsets(path)
+    assert kind == b"co64"
+    assert order.index(b"moov") < order.index(b"mdat")
+    # Both offsets moved by the same amount, the far one past 32 bits
+    assert offsets[1] - far_offset == offsets[0] - real_offset > 0
+    assert offsets[1] > 0xFFFFFFFF
+    with open(path, "rb") as f:
+        f.seek(offsets[0])
+        assert f.read(12) == CHUNK_TAG + struct.pack(">Q", 0)
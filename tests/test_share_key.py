@@ -0,0 +1,44 @@
+import pytest
+
+from share_key import DOMAINS, extract_links, share_key
+
+
+@pytest.mark.parametrize("domain", DOMAINS)
+def test_every_domain_is_recognised(domain):
+    assert extract_links(f"see https://www.{domain}.com/s/1AbC-d_9 now") == [("AbC-d_9", f"https://www.{domain}.com/s/1AbC-d_9")]
+
+
+def test_path_and_surl_forms_share_a_key():
+    assert share_key("https://terabox.com/s/1AbCdEf") == "AbCdEf"
+    assert share_key("https://www.1024tera.com/sharing/link?surl=AbCdEf") == "AbCdEf"
+    assert share_key("https://teraboxapp.com/wap/share/filelist?foo=1&surl=AbCdEf") == "AbCdEf"
+    assert share_key("https://terabox.com/main?category=all") is None
+
+
+def test_mixed_case_hosts_and_paths_dedupe():
+    text = "https://TERABOX.COM/S/1ABCDEF and https://terabox.com/s/1ABCDEF and https://TeraBoxApp.com/sharing/link?SURL=ABCDEF"
+    assert extract_links(text) == [("ABCDEF", "https://TERABOX.COM/S/1ABCDEF")]
+    # Ids are case-sensitive, only the URL around them is not
+    assert share_key("https://terabox.com/s/1abcdef") != share_key("https://terabox.com/s/1ABCDEF")
+
+
+def test_trailing_punctuation_is_trimmed():
+    text = "(https://terabox.com/s/1Abc_), 'https://nephobox.com/s/1Def-'. https://4funbox.com/s/1Ghi!?"
+    assert extract_links(text) == [
+        ("Abc_", "https://terabox.com/s/1Abc_"),
+        ("Def-", "https://nephobox.com/s/1Def-"),
+        ("Ghi", "https://4funbox.com/s/1Ghi"),
+    ]
+
+
+def test_links_embedded_in_other_urls():
+    text = "https://t.me/share/url?url=https://terabox.com/s/1Inner and https://example.com/s/1NotOurs"
+    assert extract_links(text) == [("Inner", "https://terabox.com/s/1Inner")]
+    # A domain name inside another host's label is not a TeraBox host
+    assert extract_links("https://notterabox.com/s/1Fake") == []
+
+
+def test_links_without_a_share_id_are_keyed_by_url():
+    assert extract_links("https://terabox.com/main https://terabox.com/main") == [
+        ("https://terabox.com/main", "https://terabox.com/main"),
+    ]
@@ -0,0 +1,54 @@
+import hashlib
+import hmac
+import os
+import logging
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# ===== Webhook ingestion =====
+# With WEBHOOK_URL set, Telegram pushes updates to WEBHOOK_URL + WEBHOOK_PATH
+# instead of the bot long polling for them. Any number of frontends can serve
+# that URL behind a load balancer; unset, the bots fall back to polling.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")  # public https base, e.g. https://bot.example.com
+WEBHOOK_PATH = "/" + os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "100"))  # Telegram's cap per bot
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+ENABLED = bool(WEBHOOK_URL)
+
+
+def url() -> str:
+    return WEBHOOK_URL + WEBHOOK_PATH
+
+
+def secret_token(bot_token: str) -> str:
+    """WEBHOOK_SECRET, or one derived from the bot token so every replica agrees without extra config."""
+    return WEBHOOK_SECRET or hashlib.sha256(f"webhook:{bot_token}".encode()).hexdigest()
+
+
+def verify(request: web.Request, secret: str) -> bool:
+    """True when the request carries the secret Telegram was given in setWebhook."""
+    return hmac.compare_digest(request.headers.get(SECRET_HEADER, "").encode(), secret.encode())
+
+
+async def _handle_health(request):
+    return web.Response(text="ok")
+
+
+def application() -> web.Application:
+    """aiohttp app with ``/healthz`` for the load balancer; the caller adds the update route."""
+    app = web.Application()
+    app.router.add_get("/healthz", _handle_health)
+    return app
+
+
+async def start_server(app: web.Application, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT):
+    """Serve ``app`` on the running loop; returns the runner to clean up."""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Receiving updates on http://{host}:{port}{WEBHOOK_PATH} for {url()}")
+    return runner